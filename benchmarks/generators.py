@@ -0,0 +1,89 @@
+"""synthetic inputs for the benchmarks: reference genomes, VCF files, mutation matrices, signatures and exposures"""
+
+import numpy as np
+import pandas as pd
+
+from mutationsPy.gen_context import gen_context
+from mutationsPy.matrix_io import write_matrix
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def random_sequence(length, rng):
+    """random uppercase ACGT sequence (bytes)"""
+    return BASES[rng.integers(0, 4, length)].tobytes()
+
+
+def write_fasta(path, contig_lengths, rng, line_width=60):
+    """write a fasta file with one random contig per length, named chr1, chr2...
+
+    Returns:
+        dict: contig name -> sequence (bytes)
+    """
+    seqs = {}
+    with open(path, 'wb') as file:
+        for i, length in enumerate(contig_lengths):
+            name = f'chr{i + 1}'
+            seq = random_sequence(length, rng)
+            file.write(f'>{name}\n'.encode())
+            for start in range(0, length, line_width):
+                file.write(seq[start:start + line_width] + b'\n')
+            seqs[name] = seq
+    return seqs
+
+
+def random_snvs(seqs, n_mutations, rng):
+    """random SNVs on the given sequences, avoiding the first and last bases
+
+    Returns:
+        pd.DataFrame: columns CHROM, POS (1-based), REF and ALT
+    """
+    names = list(seqs)
+    lengths = np.array([len(seqs[name]) for name in names])
+    chrom = rng.choice(len(names), size=n_mutations, p=lengths / lengths.sum())
+    pos = (rng.random(n_mutations) * (lengths[chrom] - 10)).astype(np.int64) + 5
+    ref = np.array([seqs[names[c]][p:p + 1].decode() for c, p in zip(chrom, pos)])
+    shift = rng.integers(1, 4, n_mutations)
+    alt = np.array(list('ACGT'))[(np.searchsorted(list('ACGT'), ref) + shift) % 4]
+    return pd.DataFrame({'CHROM': np.array(names)[chrom], 'POS': pos + 1, 'REF': ref, 'ALT': alt})
+
+
+def write_vcf(path, snvs):
+    """write SNVs as a minimal VCF file"""
+    with open(path, 'w') as file:
+        file.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        vcf = snvs.assign(ID='.', QUAL='.', FILTER='PASS', INFO='.')[['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']]
+        vcf.to_csv(file, sep='\t', header=False, index=False)
+
+
+def mutation_matrix(n_samples, kmer, rng, mean_count=5):
+    """random integer counts over gen_context(kmer) in sigprofiler layout
+
+    Returns:
+        tuple: counts (mutation types x samples, sorted alphabetically), mutation types and sample names
+    """
+    mut_vector = np.array(sorted(gen_context(kmer)))
+    counts = rng.poisson(mean_count, size=(len(mut_vector), n_samples))
+    samples = np.array([f'sample{i}' for i in range(n_samples)])
+    return counts, mut_vector, samples
+
+
+def write_sigprofiler_matrix(path, n_samples, kmer, rng):
+    counts, mut_vector, samples = mutation_matrix(n_samples, kmer, rng)
+    write_matrix(path, counts, mut_vector, samples, 'sigprofiler')
+
+
+def signatures_and_exposures(n_samples, n_signatures, kmer, rng, burden_range=(100, 10_000)):
+    """random signatures (COSMIC table layout) and an exposure matrix as gen_mut_matrix takes them
+
+    Returns:
+        tuple: signatures (pd.DataFrame) and exposure_matrix (pd.DataFrame)
+    """
+    mut_class = gen_context(kmer)
+    names = [f'SBS{i + 1}' for i in range(n_signatures)]
+    signatures = pd.DataFrame(rng.dirichlet(np.full(len(mut_class), 0.5), size=n_signatures).T, columns=names)
+    signatures.insert(0, 'Type', mut_class)
+    exposures = pd.DataFrame(rng.dirichlet(np.full(n_signatures, 0.3), size=n_samples), columns=names)
+    exposures.insert(0, 'burdens', rng.integers(*burden_range, n_samples))
+    exposures.insert(0, 'sample_id', [f'sample{i}' for i in range(n_samples)])
+    return signatures, exposures
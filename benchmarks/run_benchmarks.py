@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""benchmarks of the context, matrix conversion and simulation hot paths
+
+every case runs on synthetic inputs over a sweep of sizes (samples, kmer, genome length) and records the best
+wall time of a few repeats and the peak memory allocated (tracemalloc, which numpy reports to).
+Results can be saved as a baseline and later runs compared against it, failing on regressions:
+
+    python benchmarks/run_benchmarks.py --sizes small --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --sizes small --baseline benchmarks/baseline.json
+
+a reference baseline of each preset that has one is stored in benchmarks/baselines/<sizes>.json, with the machine it
+was recorded on. --compare runs against it, and --save-baseline without a path refreshes it:
+
+    python benchmarks/run_benchmarks.py --sizes small --compare
+    python benchmarks/run_benchmarks.py --sizes small --save-baseline
+
+baselines are machine specific, record them on the machine that runs the comparison (a comparison against a baseline
+of another machine warns, as its timings only give the order of magnitude)
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from mutationsPy.gen_context import gen_context
+from mutationsPy.get_mut import get_context, get_contexts, symmetrise_context
+from mutationsPy.encode_context import encode_contexts, symmetrise_table
+from mutationsPy.read_file import extract_seq_from_fasta, index_fasta
+from mutationsPy.mut_matrix import (sigprofiler_to_hdp_no_rearrangement, sigprofiler_to_hdp, hdp_to_sigprofiler,
+                                    concat_sigprofiler_mutmats)
+from mutationsPy.simulate_mut_matrix import sample_mut_mat_simple, sample_mut_mat_multinomial, _align_signatures
+from mutationsPy.vcf_to_matrix import build_matrix
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generators  # noqa: E402
+
+# parameter sweeps per preset
+SIZES = {
+    'small': {'mutations': [10_000], 'genome': [1_000_000], 'samples': [100], 'kmer': [3], 'vcf_mutations': [50_000]},
+    'medium': {'mutations': [100_000], 'genome': [10_000_000], 'samples': [1_000, 5_000], 'kmer': [3, 5], 'vcf_mutations': [500_000]},
+    'large': {'mutations': [1_000_000], 'genome': [100_000_000], 'samples': [10_000, 50_000], 'kmer': [3, 5], 'vcf_mutations': [5_000_000]},
+}
+# changes below these are noise, never regressions
+MIN_CHANGE = {'seconds': 0.01, 'peak_mb': 1}
+# reference baselines stored with the benchmarks, one per preset
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def bench_get_context(tmpdir, rng, mutations):
+    seq = generators.random_sequence(100_000, rng).decode()
+    pos = rng.integers(5, len(seq) - 5, mutations)
+    ref = np.array([seq[p] for p in pos])
+    alt = np.where(ref == 'A', 'C', 'A')
+    return lambda: [get_context(seq, p, r, a) for p, r, a in zip(pos.tolist(), ref.tolist(), alt.tolist())]
+
+
+def bench_get_contexts(tmpdir, rng, mutations):
+    seq = generators.random_sequence(100_000, rng).decode()
+    pos = rng.integers(5, len(seq) - 5, mutations)
+    ref = np.array([seq[p] for p in pos])
+    alt = np.where(ref == 'A', 'C', 'A')
+    return lambda: get_contexts(seq, pos, ref, alt)
+
+
+def bench_symmetrise_context(tmpdir, rng, mutations):
+    contexts = np.array(gen_context(3, symmetric=False))[rng.integers(0, 192, mutations)].tolist()
+    return lambda: [symmetrise_context(context) for context in contexts]
+
+
+def bench_symmetrise_table(tmpdir, rng, mutations):
+    contexts = np.array(gen_context(3, symmetric=False))[rng.integers(0, 192, mutations)]
+    return lambda: symmetrise_table(3).take(encode_contexts(contexts, 3, symmetric=False))
+
+
+def bench_extract_seq_from_fasta(tmpdir, rng, genome, indexed=False):
+    fasta = os.path.join(tmpdir, f'genome_{genome}_{indexed}.fa')
+    generators.write_fasta(fasta, [genome], rng)
+    if indexed:
+        index_fasta(fasta)
+    return lambda: extract_seq_from_fasta(fasta, 'chr1')
+
+
+def _matrix_files(tmpdir, rng, samples, kmer):
+    sigprofiler = os.path.join(tmpdir, f'sp_{samples}_{kmer}.txt')
+    hdp = os.path.join(tmpdir, f'hdp_{samples}_{kmer}.txt')
+    if not os.path.exists(sigprofiler):
+        generators.write_sigprofiler_matrix(sigprofiler, samples, kmer, rng)
+        sigprofiler_to_hdp(sigprofiler, hdp)
+    return sigprofiler, hdp
+
+
+def bench_sigprofiler_to_hdp_no_rearrangement(tmpdir, rng, samples, kmer):
+    sigprofiler, _ = _matrix_files(tmpdir, rng, samples, kmer)
+    return lambda: sigprofiler_to_hdp_no_rearrangement(sigprofiler, os.path.join(tmpdir, 'out.txt'))
+
+
+def bench_sigprofiler_to_hdp(tmpdir, rng, samples, kmer):
+    sigprofiler, _ = _matrix_files(tmpdir, rng, samples, kmer)
+    return lambda: sigprofiler_to_hdp(sigprofiler, os.path.join(tmpdir, 'out.txt'))
+
+
+def bench_hdp_to_sigprofiler(tmpdir, rng, samples, kmer):
+    _, hdp = _matrix_files(tmpdir, rng, samples, kmer)
+    return lambda: hdp_to_sigprofiler(hdp, os.path.join(tmpdir, 'out.txt'))
+
+
+def bench_concat_sigprofiler_mutmats(tmpdir, rng, samples, kmer, streaming=False):
+    paths = []
+    for i in range(4):
+        path = os.path.join(tmpdir, f'part{i}_{samples}_{kmer}.txt')
+        generators.write_sigprofiler_matrix(path, max(1, samples // 4), kmer, rng)
+        paths.append(path)
+    return lambda: concat_sigprofiler_mutmats(paths, os.path.join(tmpdir, 'out.txt'), streaming=streaming)
+
+
+def _simulation_inputs(rng, samples, kmer):
+    signatures, exposure_matrix = generators.signatures_and_exposures(samples, 20, kmer, rng)
+    burdens, exposures, signatures, _ = _align_signatures(exposure_matrix, signatures)
+    return exposures.to_numpy(), burdens.to_numpy(), signatures
+
+
+def bench_sample_mut_mat_simple(tmpdir, rng, samples, kmer):
+    exposures, burdens, signatures = _simulation_inputs(rng, samples, kmer)
+    return lambda: sample_mut_mat_simple(exposures, burdens, signatures)
+
+
+def bench_sample_mut_mat_multinomial(tmpdir, rng, samples, kmer):
+    exposures, burdens, signatures = _simulation_inputs(rng, samples, kmer)
+    return lambda: sample_mut_mat_multinomial(exposures, burdens, signatures, rng=0)
+
+
+def bench_build_matrix(tmpdir, rng, vcf_mutations, genome):
+    fasta = os.path.join(tmpdir, f'reference_{genome}.fa')
+    seqs = generators.write_fasta(fasta, [genome // 2, genome // 4, genome // 4], rng)
+    index_fasta(fasta)
+    vcf = os.path.join(tmpdir, f'mutations_{vcf_mutations}.vcf')
+    generators.write_vcf(vcf, generators.random_snvs(seqs, vcf_mutations, rng))
+    return lambda: build_matrix([vcf], fasta, os.path.join(tmpdir, 'out.txt'))
+
+
+def cases(sizes):
+    """(name, parameters, setup) of every benchmark for a preset of sizes"""
+    for mutations in sizes['mutations']:
+        for name, setup in [('get_context', bench_get_context), ('get_contexts', bench_get_contexts),
+                            ('symmetrise_context', bench_symmetrise_context), ('symmetrise_table', bench_symmetrise_table)]:
+            yield name, {'mutations': mutations}, setup
+    for genome in sizes['genome']:
+        yield 'extract_seq_from_fasta', {'genome': genome, 'indexed': False}, bench_extract_seq_from_fasta
+        yield 'extract_seq_from_fasta', {'genome': genome, 'indexed': True}, bench_extract_seq_from_fasta
+    for samples in sizes['samples']:
+        for kmer in sizes['kmer']:
+            for name, setup in [('sigprofiler_to_hdp_no_rearrangement', bench_sigprofiler_to_hdp_no_rearrangement),
+                                ('sigprofiler_to_hdp', bench_sigprofiler_to_hdp), ('hdp_to_sigprofiler', bench_hdp_to_sigprofiler),
+                                ('sample_mut_mat_simple', bench_sample_mut_mat_simple),
+                                ('sample_mut_mat_multinomial', bench_sample_mut_mat_multinomial)]:
+                yield name, {'samples': samples, 'kmer': kmer}, setup
+            yield 'concat_sigprofiler_mutmats', {'samples': samples, 'kmer': kmer, 'streaming': False}, bench_concat_sigprofiler_mutmats
+            yield 'concat_sigprofiler_mutmats', {'samples': samples, 'kmer': kmer, 'streaming': True}, bench_concat_sigprofiler_mutmats
+    for vcf_mutations in sizes['vcf_mutations']:
+        yield 'build_matrix', {'vcf_mutations': vcf_mutations, 'genome': sizes['genome'][0]}, bench_build_matrix
+
+
+def measure(func, repeat):
+    """best wall time over repeat runs and the peak memory allocated by one run"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 2 ** 20
+
+
+def run(sizes, repeat=3, only=None, seed=0):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, params, setup in cases(SIZES[sizes]):
+            if only and name not in only:
+                continue
+            func = setup(tmpdir, np.random.default_rng(seed), **params)
+            seconds, peak_mb = measure(func, repeat)
+            results.append({'name': name, 'params': params, 'seconds': seconds, 'peak_mb': peak_mb})
+            print(f'{name:40} {json.dumps(params):60} {seconds:10.4f} s {peak_mb:10.1f} MB', flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """regressions of results against a baseline: cases slower or using more memory than (1 + tolerance) times the baseline"""
+    stored = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = stored.get(_key(result))
+        if before is None:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            if result[metric] > before[metric] * (1 + tolerance) and result[metric] - before[metric] > MIN_CHANGE[metric]:
+                regressions.append(f"{result['name']} {json.dumps(result['params'])}: {metric} {before[metric]:.4f} -> {result[metric]:.4f}")
+    return regressions
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def machine():
+    """description of the machine results are recorded on"""
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__}
+
+
+def stored_baseline(sizes):
+    """path of the reference baseline of a preset"""
+    return os.path.join(BASELINE_DIR, f'{sizes}.json')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark mutationsPy hot paths on synthetic data')
+    parser.add_argument('--sizes', choices=list(SIZES), default='small', help='size sweep to run, default small')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per case (the best is kept), default 3')
+    parser.add_argument('--only', nargs='+', default=None, help='names of the benchmarks to run, default all')
+    parser.add_argument('--output', type=str, default=None, help='path to write the results to (JSON)')
+    parser.add_argument('--save-baseline', type=str, nargs='?', const='', default=None, 
+                        help='path to store the results as a baseline (JSON), default the reference baseline of the preset')
+    baseline = parser.add_mutually_exclusive_group()
+    baseline.add_argument('--baseline', type=str, default=None, help='baseline (JSON) to compare against, exit with 1 on regressions')
+    baseline.add_argument('--compare', action='store_true', help='compare against the reference baseline of the preset in benchmarks/baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown or memory growth over the baseline, default 0.25')
+    return parser
+
+
+def main():
+    args = get_arguments().parse_args()
+    baseline_path = stored_baseline(args.sizes) if args.compare else args.baseline
+    if baseline_path and not os.path.exists(baseline_path):
+        sys.exit(f'no baseline at {baseline_path}, record one with --save-baseline')
+    results = run(args.sizes, repeat=args.repeat, only=args.only)
+    report = {'sizes': args.sizes, 'machine': machine(), 'results': results}
+    save_baseline = stored_baseline(args.sizes) if args.save_baseline == '' else args.save_baseline
+    for path in (args.output, save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(report, file, indent=2)
+                file.write('\n')
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        if baseline.get('machine') != report['machine']:
+            print(f"WARNING baseline recorded on another machine: {json.dumps(baseline.get('machine'))}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
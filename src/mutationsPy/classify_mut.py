@@ -0,0 +1,248 @@
+from functools import lru_cache
+
+import numpy as np
+
+from mutationsPy.encode_context import BASE_CODES, dbs_catalog, id_catalog, encode_seqs, reverse_complement_table
+from mutationsPy.gen_context import gen_dbs_context
+from mutationsPy.get_mut import _bases_at
+from mutationsPy.read_file import _UPPER_CODES
+
+# ID83 tells apart up to 5 repeat units and microhomologies of up to 5 bases, longer ones are "5+"
+MAX_REPEATS = 5
+
+# first code of each group of ID83 classes, see gen_id_context
+_ID_INSERTION_REPEATS = 48
+_ID_DELETION_REPEATS = 24
+_ID_MICROHOMOLOGY = 72
+# position of the first microhomology class of each deletion size (2 to 5+) among the microhomology classes
+_ID_MICROHOMOLOGY_OFFSETS = np.array([0, 0, 0, 1, 3, 6])
+
+
+def get_dbs_context(seq, pos, ref, alt):
+    """get the DBS78 class of a doublet base substitution (see gen_dbs_context), eg GT>TG is AC>CA
+
+    Args:
+        seq (str): reference sequence
+        pos (int): 0-based position of the first base of the substitution
+        ref (str): reference dinucleotide
+        alt (str): mutated dinucleotide
+
+    Raises:
+        ValueError: the mutation is not a doublet base substitution
+        KeyError: reference allele should match the reference sequence
+
+    Returns:
+        str: DBS78 class of the mutation
+    """
+    codes, mismatch = get_dbs_codes(seq, [pos], [ref], [alt])
+    if mismatch[0]:
+        raise KeyError(f'position {pos} of the provided sequence is not {ref}')
+    if codes[0] < 0:
+        raise ValueError(f'{ref}>{alt} is not a doublet base substitution')
+    return dbs_catalog().labels[codes[0]]
+
+
+def get_dbs_codes(seq, pos, ref, alt):
+    """batch classification of doublet base substitutions into the codes of dbs_catalog (positions in gen_dbs_context)
+
+    every mutation is mapped with one lookup of its reference and mutated dinucleotides, or of their reverse complements
+    (the other strand) if that is the one in DBS78. Rows that are not substitutions of two bases by two other A, C, G or T
+    bases are skipped, so whole VCF chunks can be classified
+
+    Args:
+        seq (str, bytes, np.array of uint8 or Contig): reference sequence
+        pos (np.array convertible): 0-based positions of the first base of the mutations
+        ref (np.array convertible): reference alleles
+        alt (np.array convertible): mutated alleles
+
+    Returns:
+        tuple: np.array of the codes (-1 for rows that are skipped) and np.array of bool,
+            True where a doublet base substitution does not match the reference sequence (its code is -1)
+    """
+    pos = np.asarray(pos, dtype=np.int64).ravel()
+    n = len(pos)
+    ref_bases, ref_starts, ref_lengths = _allele_buffer(ref, n)
+    alt_bases, alt_starts, alt_lengths = _allele_buffer(alt, n)
+    rows = np.flatnonzero((ref_lengths == 2) & (alt_lengths == 2))
+    ref_pair = ref_bases[ref_starts[rows, None] + np.arange(2)]
+    alt_pair = BASE_CODES[alt_bases[alt_starts[rows, None] + np.arange(2)]]
+    ref_codes = BASE_CODES[ref_pair]
+    valid = np.all(ref_codes < 4, axis=1) & np.all(alt_pair < 4, axis=1) & np.all(ref_codes != alt_pair, axis=1)
+    valid &= (pos[rows] >= 0) & (pos[rows] + 2 <= len(seq))
+    rows, ref_pair, ref_codes, alt_pair = rows[valid], ref_pair[valid], ref_codes[valid], alt_pair[valid]
+    matches = np.all(_seq_bases(seq, pos[rows, None] + np.arange(2)) == ref_pair, axis=1)
+    codes = np.full(n, -1, dtype=np.int64)
+    keys = encode_seqs(ref_codes) * 16 + encode_seqs(alt_pair)
+    codes[rows[matches]] = _dbs_table()[keys[matches]]
+    mismatch = np.zeros(n, dtype=bool)
+    mismatch[rows[~matches]] = True
+    return codes, mismatch
+
+
+def get_id_context(seq, pos, ref, alt):
+    """get the ID83 class of an insertion or a deletion (see gen_id_context), given as in VCF files:
+    ref and alt share their first base, eg ref=AC, alt=A deletes the C after position pos
+
+    Args:
+        seq (str): reference sequence
+        pos (int): 0-based position of the first base of ref
+        ref (str): reference allele
+        alt (str): mutated allele
+
+    Raises:
+        ValueError: the mutation is not a simple insertion or deletion
+        KeyError: reference allele should match the reference sequence
+
+    Returns:
+        str: ID83 class of the mutation
+    """
+    codes, mismatch = get_id_codes(seq, [pos], [ref], [alt])
+    if mismatch[0]:
+        raise KeyError(f'position {pos} of the provided sequence is not {ref}')
+    if codes[0] < 0:
+        raise ValueError(f'{ref}>{alt} is not an insertion or a deletion')
+    return id_catalog().labels[codes[0]]
+
+
+def get_id_codes(seq, pos, ref, alt):
+    """batch classification of indels into the codes of id_catalog (positions in gen_id_context)
+
+    indels are given as in VCF files, ref and alt sharing their first base. The deleted or inserted sequence is the repeat unit:
+    its copies next to the indel in the reference are counted on both sides, and deletions without any copy are
+    checked for microhomology (the longest prefix of the deletion found right after it, or suffix found right before it).
+    The scans compare every base of every unit at once: the units of all rows are concatenated, compared against the
+    reference bases at the matching offsets and reduced per row, one pass per repeat unit.
+    Rows that are not simple insertions or deletions of A, C, G or T bases are skipped, as are those running off the sequence
+
+    Args:
+        seq (str, bytes, np.array of uint8 or Contig): reference sequence
+        pos (np.array convertible): 0-based positions of the first base of the reference alleles
+        ref (np.array convertible): reference alleles
+        alt (np.array convertible): mutated alleles
+
+    Returns:
+        tuple: np.array of the codes (-1 for rows that are skipped) and np.array of bool,
+            True where an indel does not match the reference sequence (its code is -1)
+    """
+    pos = np.asarray(pos, dtype=np.int64).ravel()
+    n = len(pos)
+    ref_bases, ref_starts, ref_lengths = _allele_buffer(ref, n)
+    alt_bases, alt_starts, alt_lengths = _allele_buffer(alt, n)
+    anchored = (ref_lengths > 0) & (alt_lengths > 0)
+    anchored[anchored] = ref_bases[ref_starts[anchored]] == alt_bases[alt_starts[anchored]]
+    is_deletion = anchored & (alt_lengths == 1) & (ref_lengths > 1)
+    is_insertion = anchored & (ref_lengths == 1) & (alt_lengths > 1)
+    is_indel = (is_deletion | is_insertion) & _only_bases(ref_bases, ref_starts, ref_lengths) & _only_bases(alt_bases, alt_starts, alt_lengths)
+    is_indel &= (pos >= 0) & (pos + ref_lengths <= len(seq))
+    rows = np.flatnonzero(is_indel)
+    codes = np.full(n, -1, dtype=np.int64)
+    mismatch = np.zeros(n, dtype=bool)
+    if not len(rows):
+        return codes, mismatch
+
+    # reference alleles against the reference sequence
+    group, local = _ragged(ref_lengths[rows])
+    matches = _all_groups(_seq_bases(seq, pos[rows][group] + local) == ref_bases[ref_starts[rows][group] + local], ref_lengths[rows])
+    mismatch[rows[~matches]] = True
+    rows = rows[matches]
+    if not len(rows):
+        return codes, mismatch
+
+    # repeat units: the deleted or inserted bases after the shared first base
+    deletion = is_deletion[rows]
+    unit_lengths = np.where(deletion, ref_lengths[rows], alt_lengths[rows]) - 1
+    group, local = _ragged(unit_lengths)
+    units = np.empty(len(group), dtype=np.uint8)
+    from_ref = deletion[group]
+    units[from_ref] = ref_bases[ref_starts[rows][group][from_ref] + 1 + local[from_ref]]
+    units[~from_ref] = alt_bases[alt_starts[rows][group][~from_ref] + 1 + local[~from_ref]]
+    start = pos[rows] + 1 # first deleted base, or the base the insertion goes in front of
+    after = start + np.where(deletion, unit_lengths, 0) # first reference base after the unit
+
+    repeats = np.zeros(len(rows), dtype=np.int64)
+    for first_copy, step in ((after, unit_lengths), (start - unit_lengths, -unit_lengths)):
+        extending = np.ones(len(rows), dtype=bool)
+        for copy in range(MAX_REPEATS):
+            copy_start = first_copy + copy * step
+            extending &= _all_groups(_seq_bases(seq, copy_start[group] + local) == units, unit_lengths)
+            repeats += extending
+    repeats = np.minimum(repeats, MAX_REPEATS)
+
+    # microhomology of deletions that are not repeated: matching bases right after the deletion (from its first base)
+    # or right before it (from its last base)
+    right_matches = _seq_bases(seq, after[group] + local) == units
+    first_mismatch = np.minimum.reduceat(np.where(right_matches, unit_lengths[group], local), np.cumsum(unit_lengths) - unit_lengths)
+    left_matches = _seq_bases(seq, start[group] - unit_lengths[group] + local) == units
+    last_mismatch = np.maximum.reduceat(np.where(left_matches, -1, local), np.cumsum(unit_lengths) - unit_lengths)
+    microhomology = np.minimum(np.maximum(first_mismatch, unit_lengths - 1 - last_mismatch), MAX_REPEATS)
+
+    size = np.minimum(unit_lengths, 5)
+    # 1bp indels are labelled by the pyrimidine of their base pair: C for C and G, T for A and T
+    first_base = units[np.cumsum(unit_lengths) - unit_lengths]
+    thymine = (first_base == ord('A')) | (first_base == ord('T'))
+    single = np.where(deletion, 0, 12) + thymine * 6 + repeats
+    deletion_codes = np.where((repeats == 0) & (microhomology > 0),
+                              _ID_MICROHOMOLOGY + _ID_MICROHOMOLOGY_OFFSETS[size] + microhomology - 1,
+                              _ID_DELETION_REPEATS + (size - 2) * 6 + repeats)
+    longer = np.where(deletion, deletion_codes, _ID_INSERTION_REPEATS + (size - 2) * 6 + repeats)
+    codes[rows] = np.where(unit_lengths == 1, single, longer)
+    return codes, mismatch
+
+
+@lru_cache(maxsize=None)
+def _dbs_table():
+    """lookup table from ref code * 16 + alt code of a dinucleotide substitution to its DBS78 code, -1 if it is not one"""
+    table = np.full(256, -1, dtype=np.int64)
+    reverse_complement = reverse_complement_table(2)
+    for code, label in enumerate(gen_dbs_context()):
+        ref, alt = (encode_seqs(BASE_CODES[np.frombuffer(part.encode(), dtype=np.uint8)][None])[0] for part in label.split('>'))
+        table[ref * 16 + alt] = code
+        table[reverse_complement[ref] * 16 + reverse_complement[alt]] = code
+    table.flags.writeable = False
+    return table
+
+
+def _allele_buffer(alleles, n):
+    """concatenated uppercase ASCII codes of alleles of any length, with the start and length of each allele"""
+    if np.ndim(alleles) == 0:
+        alleles = [alleles] * n
+    values = alleles.ravel().tolist() if isinstance(alleles, np.ndarray) else list(alleles)
+    try:
+        joined = ''.join(values)
+    except TypeError:
+        values = [value.decode() if isinstance(value, bytes) else str(value) for value in values]
+        joined = ''.join(values)
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    # padded with one byte so that the first base of an empty last allele can be looked up
+    bases = _UPPER_CODES[np.frombuffer(joined.encode('ascii', errors='replace') + b'\0', dtype=np.uint8)]
+    return bases, np.cumsum(lengths) - lengths, lengths
+
+
+def _only_bases(bases, starts, lengths):
+    """whether every character of each allele is A, C, G or T"""
+    others = np.r_[0, np.cumsum(BASE_CODES[bases[:-1]] > 3)]
+    return others[starts + lengths] == others[starts]
+
+
+def _ragged(lengths):
+    """row and offset within the row of every element of rows of the given lengths laid end to end"""
+    group = np.repeat(np.arange(len(lengths)), lengths)
+    local = np.arange(len(group)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return group, local
+
+
+def _all_groups(values, lengths):
+    """whether all values of each row (laid end to end, rows of at least one value) are True"""
+    return np.logical_and.reduceat(values, np.cumsum(lengths) - lengths) if len(lengths) else np.zeros(0, dtype=bool)
+
+
+def _seq_bases(seq, positions):
+    """uppercase ASCII codes of the bases at positions of a sequence, 0 for positions outside of it"""
+    positions = np.asarray(positions, dtype=np.int64)
+    length = len(seq)
+    inside = (positions >= 0) & (positions < length)
+    if not length:
+        return np.zeros(positions.shape, dtype=np.uint8)
+    clipped = np.where(inside, positions, 0)
+    bases = _bases_at(seq, clipped)
+    return np.where(inside, bases, 0).astype(np.uint8)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""command line interface of mutationsPy, the mutation_matrix console script
+
+only the standard library is imported here, numpy and pandas are imported by the modules of a subcommand
+when it runs, so that --help and argument errors return straight away
+"""
+
+import argparse, shlex, sys
+
+from mutationsPy.profiling import PROFILE_ENV, enable_profiling, stage
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Format mutation matrix')
+    parser.add_argument('--profile', type=str, default=None, metavar='PATH', 
+                        help=f'append per-stage wall time, rows, throughput and resident memory as JSON lines to PATH (- for stderr), also enabled by setting {PROFILE_ENV}=PATH')
+    subparsers = parser.add_subparsers(required=True, dest='cmd')
+    
+    # parser for sigprofiler_to_hdp
+    parser_sigprofiler_to_hdp_no_rearrangement = subparsers.add_parser('sigprofiler_to_hdp_no_rearrangement', help='convert tab delimited mutation matrix from sigprofiler format to hdp format (only works for trinucleotide SNV format), no rearrangement of rows/columns is performed')
+    parser_sigprofiler_to_hdp_no_rearrangement.add_argument('--sigprofiler_path', type=str, required=True, help='path to sigprofiler tab delimited (or .npz) file')
+    parser_sigprofiler_to_hdp_no_rearrangement.add_argument('--hdp_outpath', type=str, required=True, help='path to output hdp tab delimited (or .npz) file')
+    
+    # parser for sigprofiler_to_hdp
+    parser_sigprofiler_to_hdp = subparsers.add_parser('sigprofiler_to_hdp', help='convert tab delimited mutation matrix from sigprofiler format to hdp format (works for SNV contexts, whose kmer size is inferred from the mutation types, and for DBS78 and ID83 classes)')
+    parser_sigprofiler_to_hdp.add_argument('--sigprofiler_path', type=str, required=True, help='path to sigprofiler tab delimited (or .npz) file')
+    parser_sigprofiler_to_hdp.add_argument('--hdp_outpath', type=str, required=True, help='path to output hdp tab delimited (or .npz) file')
+    parser_sigprofiler_to_hdp.add_argument('--cache_dir', type=str, default=None, help='directory caching the result, keyed by the content of the inputs and the options (the cache is evicted down to $MUTATIONSPY_CACHE_MAX_MB, default 4096)')
+    
+    # parser for hdp_to_sigprofiler
+    parser_hdp_to_sigprofiler = subparsers.add_parser('hdp_to_sigprofiler', help='convert tab delimited mutation matrix from hdp format to sigprofiler format (works for SNVs, DBS78 and ID83)')
+    parser_hdp_to_sigprofiler.add_argument('--hdp_path', type=str, required=True, help='path to hdp tab delimited (or .npz) file')
+    parser_hdp_to_sigprofiler.add_argument('--sigprofiler_outpath', type=str, required=True, help='path to output sigprofiler tab delimited (or .npz) file')
+    parser_hdp_to_sigprofiler.add_argument('--cache_dir', type=str, default=None, help='directory caching the result, keyed by the content of the inputs and the options (the cache is evicted down to $MUTATIONSPY_CACHE_MAX_MB, default 4096)')
+    
+    # parser for concat_sigprofiler_mutmats
+    parser_concat_sigprofiler_mutmats = subparsers.add_parser('concat_sigprofiler_mutmats', help = 'concatenated multiple mutation matrix files to one')
+    parser_concat_sigprofiler_mutmats.add_argument('--mutmats', nargs='+', help='paths to mutation matrices', required=True)
+    parser_concat_sigprofiler_mutmats.add_argument('--outpath', type = str, required = True, help='path to resulting combined matrix')
+    parser_concat_sigprofiler_mutmats.add_argument('--cache_dir', type=str, default=None, help='directory caching the result, keyed by the content of the inputs and the options (the cache is evicted down to $MUTATIONSPY_CACHE_MAX_MB, default 4096)')
+    parser_concat_sigprofiler_mutmats.add_argument('--streaming', action = 'store_true', help='hold only one input matrix in memory at a time (inputs must share the mutation types of the first one)')
+    
+    # parser for convert_format
+    parser_convert_format = subparsers.add_parser('convert_format', help = 'convert a mutation matrix between the tab delimited text format and the binary (.npz) format, chosen by file extension')
+    parser_convert_format.add_argument('--inpath', type = str, required = True, help='path to mutation matrix')
+    parser_convert_format.add_argument('--outpath', type = str, required = True, help='path to resulting mutation matrix, binary if it ends with .npz')
+    parser_convert_format.add_argument('--layout', type = str, choices = ['sigprofiler', 'hdp'], default = 'sigprofiler', help='layout of the mutation matrix, default sigprofiler')
+    storage_convert_format = parser_convert_format.add_mutually_exclusive_group()
+    storage_convert_format.add_argument('--sparse', action = 'store_true', help='save a sparse binary matrix, memory then scales with the nonzero counts')
+    storage_convert_format.add_argument('--dense', action = 'store_true', help='save a dense binary matrix from a sparse one')
+    
+    # parser for build_matrix
+    parser_build_matrix = subparsers.add_parser('build_matrix', help = 'build a mutation matrix of SNVs, doublet base substitutions or indels from VCF files, streaming the files chunk by chunk')
+    parser_build_matrix.add_argument('--vcfs', nargs='+', help='paths to VCF files (plain or gzip compressed), one sample per file unless --sample_colname is given', required=True)
+    parser_build_matrix.add_argument('--fasta', type = str, required = True, help='path to reference genome fasta file, indexed (.fai) on the fly if needed')
+    parser_build_matrix.add_argument('--outpath', type = str, required = True, help='path to resulting mutation matrix')
+    parser_build_matrix.add_argument('--kmer', type = int, default = 3, help='kmer size of the sequence context, default 3')
+    parser_build_matrix.add_argument('--asymmetric', action = 'store_true', help='keep A and G reference alleles instead of symmetrising to C and T')
+    parser_build_matrix.add_argument('--format', type = str, choices = ['sigprofiler', 'hdp'], default = 'sigprofiler', help='format of the resulting matrix, default sigprofiler')
+    parser_build_matrix.add_argument('--sample_colname', type = str, default = None, help='column of the VCF files with the sample of each mutation')
+    parser_build_matrix.add_argument('--chunksize', type = int, default = 100_000, help='number of VCF rows read at a time, default 100000')
+    parser_build_matrix.add_argument('--n_jobs', type = int, default = 1, help='number of worker processes, default 1')
+    parser_build_matrix.add_argument('--chrom_shards', type = int, default = 1, help='number of chromosome groups the chunks of each VCF file are split into across workers, each file is still parsed once, default 1')
+    parser_build_matrix.add_argument('--mutation_type', type = str, choices = ['SBS', 'DBS', 'ID'], default = 'SBS', help='mutations to count: SBS (SNV contexts of --kmer), DBS (DBS78) or ID (ID83), default SBS')
+    parser_build_matrix.add_argument('--io_threads', type = int, default = 0, help='read the VCF files (one sample per file) on this many threads, decompressing bgzip blocks in parallel and reading files ahead, default 0 (off)')
+    parser_build_matrix.add_argument('--cache_dir', type=str, default=None, help='directory caching the result, keyed by the content of the inputs and the options (the cache is evicted down to $MUTATIONSPY_CACHE_MAX_MB, default 4096)')
+    parser_build_matrix.add_argument('--sparse', action = 'store_true', help='keep the counts sparse, memory then scales with the nonzero counts (a .npz outpath gives a sparse binary matrix)')
+    
+    # parser for collapse_matrix
+    parser_collapse_matrix = subparsers.add_parser('collapse_matrix', help = 'collapse a mutation matrix of SNV contexts to a smaller kmer (eg pentanucleotide to trinucleotide) and/or fold asymmetric into symmetric contexts')
+    parser_collapse_matrix.add_argument('--inpath', type = str, required = True, help='path to mutation matrix, the kmer size is inferred from its mutation types')
+    parser_collapse_matrix.add_argument('--outpath', type = str, required = True, help='path to resulting mutation matrix, binary if it ends with .npz')
+    parser_collapse_matrix.add_argument('--kmer', type = int, required = True, help='kmer size to collapse to')
+    parser_collapse_matrix.add_argument('--symmetric', action = 'store_true', help='fold asymmetric contexts into symmetric ones (C and T reference alleles)')
+    parser_collapse_matrix.add_argument('--layout', type = str, choices = ['sigprofiler', 'hdp'], default = 'sigprofiler', help='layout of the mutation matrix, default sigprofiler')
+    
+    # parser for count_opportunities
+    parser_count_opportunities = subparsers.add_parser('count_opportunities', help = 'count how often the wildtype sequence of each SNV context occurs in a reference genome, over the whole genome or the regions of a BED file')
+    parser_count_opportunities.add_argument('--fasta', type = str, required = True, help='path to reference genome fasta file, indexed (.fai) on the fly if needed')
+    parser_count_opportunities.add_argument('--outpath', type = str, required = True, help='path to resulting opportunities, a one column sigprofiler matrix')
+    parser_count_opportunities.add_argument('--kmer', type = int, default = 3, help='kmer size of the sequence context, default 3')
+    parser_count_opportunities.add_argument('--asymmetric', action = 'store_true', help='keep A and G reference alleles instead of folding them into C and T')
+    parser_count_opportunities.add_argument('--bed', type = str, default = None, help='BED file of the regions to count over (eg exome targets), default whole genome')
+    parser_count_opportunities.add_argument('--n_jobs', type = int, default = 1, help='number of worker processes, default 1')
+    parser_count_opportunities.add_argument('--cache_dir', type = str, default = None, help='directory caching kmer counts by reference checksum and regions')
+    
+    # parser for batch
+    parser_batch = subparsers.add_parser('batch', help = 'run many subcommands in one process, one per line of a manifest file')
+    parser_batch.add_argument('--manifest', type = str, required = True, help='text file with one subcommand and its arguments per line, as typed after mutation_matrix (lines starting with # are skipped)')
+    parser_batch.add_argument('--n_jobs', type = int, default = 1, help='number of jobs run at the same time in worker processes, default 1')
+    
+    return parser
+
+
+
+
+def main(argv=None):
+    args = get_arguments().parse_args(argv)
+    if args.profile:
+        enable_profiling(args.profile)
+    with stage(args.cmd):
+        if args.cmd == 'batch':
+            return run_batch(args.manifest, n_jobs=args.n_jobs)
+        run_command(args)
+
+
+def run_command(args):
+    """run a parsed subcommand, importing only the modules it needs"""
+    if args.cmd == 'sigprofiler_to_hdp_no_rearrangement':
+        from mutationsPy.mut_matrix import sigprofiler_to_hdp_no_rearrangement
+        sigprofiler_to_hdp_no_rearrangement(args.sigprofiler_path, args.hdp_outpath)
+    if args.cmd == 'sigprofiler_to_hdp':
+        from mutationsPy.mut_matrix import sigprofiler_to_hdp
+        sigprofiler_to_hdp(args.sigprofiler_path, args.hdp_outpath, cache_dir=args.cache_dir)
+    if args.cmd == 'hdp_to_sigprofiler':
+        from mutationsPy.mut_matrix import hdp_to_sigprofiler
+        hdp_to_sigprofiler(args.hdp_path, args.sigprofiler_outpath, cache_dir=args.cache_dir)
+    if args.cmd == 'concat_sigprofiler_mutmats':
+        from mutationsPy.mut_matrix import concat_sigprofiler_mutmats
+        concat_sigprofiler_mutmats(args.mutmats, args.outpath, streaming=args.streaming, cache_dir=args.cache_dir)
+    if args.cmd == 'convert_format':
+        from mutationsPy.matrix_io import convert_matrix_format
+        sparse = True if args.sparse else (False if args.dense else None)
+        convert_matrix_format(args.inpath, args.outpath, layout=args.layout, sparse=sparse)
+    if args.cmd == 'build_matrix':
+        from mutationsPy.vcf_to_matrix import build_matrix
+        build_matrix(args.vcfs, args.fasta, args.outpath, kmer=args.kmer, symmetric=not args.asymmetric, 
+                     matrix_format=args.format, sample_colname=args.sample_colname, chunksize=args.chunksize, 
+                     n_jobs=args.n_jobs, chrom_shards=args.chrom_shards, sparse=args.sparse, 
+                     mutation_type=args.mutation_type, io_threads=args.io_threads, cache_dir=args.cache_dir)
+    if args.cmd == 'count_opportunities':
+        from mutationsPy.opportunity import count_opportunities
+        count_opportunities(args.fasta, args.outpath, kmer=args.kmer, symmetric=not args.asymmetric, bed=args.bed, 
+                            n_jobs=args.n_jobs, cache_dir=args.cache_dir)
+    if args.cmd == 'collapse_matrix':
+        from mutationsPy.collapse_context import collapse_matrix
+        collapse_matrix(args.inpath, args.outpath, args.kmer, target_symmetric=True if args.symmetric else None, layout=args.layout)
+
+
+def read_manifest(manifest):
+    """parse the jobs of a batch manifest: one subcommand and its arguments per line, as typed after mutation_matrix.
+    Blank lines and lines starting with # are skipped
+
+    Args:
+        manifest (path): path to the manifest
+
+    Raises:
+        ValueError: a line is not a valid subcommand, or is itself a batch
+
+    Returns:
+        list: (line number, argv) of every job
+    """
+    parser = get_arguments()
+    jobs = []
+    with open(manifest) as file:
+        for line_number, line in enumerate(file, start = 1):
+            argv = shlex.split(line, comments = True)
+            if not argv:
+                continue
+            try:
+                args = parser.parse_args(argv)
+            except SystemExit:
+                raise ValueError(f'line {line_number} of {manifest} is not a valid subcommand: {line.strip()}') from None
+            if args.cmd == 'batch' or args.profile:
+                raise ValueError(f'line {line_number} of {manifest}: batches can not be nested or profiled per job')
+            jobs.append((line_number, argv))
+    return jobs
+
+
+def run_batch(manifest, n_jobs=1):
+    """run the jobs of a manifest (see read_manifest) in this process, or on a pool of n_jobs worker processes. 
+    Every line is parsed before any job starts. A failing job does not stop the others, failures are reported on stderr
+
+    Args:
+        manifest (path): path to the manifest
+        n_jobs (int, optional): number of jobs run at the same time, None for one per CPU. Defaults to 1 (no pool).
+
+    Returns:
+        int: 0 if every job succeeded, 1 otherwise
+    """
+    jobs = read_manifest(manifest)
+    if n_jobs == 1 or len(jobs) <= 1:
+        errors = [_run_job(line_number, argv) for line_number, argv in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_run_job, line_number, argv) for line_number, argv in jobs]
+            errors = [future.result() for future in futures]
+    for (line_number, argv), error in zip(jobs, errors):
+        if error is not None:
+            print(f'job on line {line_number} of {manifest} failed ({shlex.join(argv)}): {error}', file = sys.stderr)
+    return 1 if any(error is not None for error in errors) else 0
+
+
+def _run_job(line_number, argv):
+    """run one job of a batch, returning its error message (None if it succeeded)"""
+    args = get_arguments().parse_args(argv)
+    try:
+        with stage(args.cmd, job = line_number):
+            run_command(args)
+    except Exception as error:
+        return f'{type(error).__name__}: {error}'
+    return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import numpy as np
+
+from mutationsPy.encode_context import collapse_table, context_catalog, infer_context_catalog, n_contexts
+from mutationsPy.matrix_io import iter_matrix_blocks, read_matrix_labels, write_matrix
+from mutationsPy.profiling import profiled
+
+
+def collapse_counts(counts, kmer, target_kmer, symmetric=True, target_symmetric=None, axis=-1):
+    """collapse counts over the contexts of gen_context(kmer, symmetric) into a smaller kmer (eg 5-mers -> 3-mers),
+    optionally folding asymmetric into symmetric contexts, see collapse_table
+
+    Args:
+        counts (np.array): counts with one entry per context of gen_context(kmer, symmetric) along axis
+        kmer (int): kmer size of the contexts
+        target_kmer (int): kmer size to collapse to
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+        target_symmetric (bool, optional): whether collapsed mutations are symmetric. Defaults to None (same as symmetric).
+        axis (int, optional): axis of the contexts. Defaults to -1 (columns, as in HDP matrices).
+
+    Returns:
+        np.array: counts with one entry per context of gen_context(target_kmer, target_symmetric) along axis
+    """
+    target_symmetric = symmetric if target_symmetric is None else target_symmetric
+    table = collapse_table(kmer, target_kmer, symmetric, target_symmetric)
+    return aggregate_counts(counts, table, n_contexts(target_kmer, target_symmetric), axis=axis)
+
+
+def aggregate_counts(counts, groups, n_groups, axis=-1):
+    """sum counts along an axis by group, with one np.add.reduceat over the entries sorted by group
+
+    Args:
+        counts (np.array): counts
+        groups (np.array): group (0 to n_groups - 1) of each entry along axis
+        n_groups (int): number of groups
+        axis (int, optional): axis to sum over. Defaults to -1.
+
+    Returns:
+        np.array: counts with n_groups entries along axis, 0 for groups without entries
+    """
+    counts = np.moveaxis(np.asarray(counts), axis, 0)
+    groups = np.asarray(groups, dtype=np.int64)
+    aggregated = np.zeros((n_groups,) + counts.shape[1:], dtype=np.result_type(counts.dtype, np.int64))
+    if len(groups):
+        order = np.argsort(groups, kind = 'stable')
+        sorted_groups = groups[order]
+        starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        aggregated[sorted_groups[starts]] = np.add.reduceat(counts[order], starts, axis=0)
+    return np.moveaxis(aggregated, 0, axis)
+
+
+@profiled()
+def collapse_matrix(inpath, outpath, target_kmer, target_symmetric=None, layout='sigprofiler'):
+    """collapse a mutation matrix of SNV contexts into a smaller kmer, and/or fold asymmetric into symmetric contexts.
+    The kmer size of the input is inferred from its mutation types and the output keeps its layout and ordering
+    convention (alphabetical for sigprofiler, gen_context for hdp). The input is read a block of rows at a time
+
+    Args:
+        inpath (path): path to mutation matrix, text or binary (.npz)
+        outpath (path): path to resulting mutation matrix, binary if it ends with .npz
+        target_kmer (int): kmer size to collapse to
+        target_symmetric (bool, optional): whether collapsed mutations are symmetric. Defaults to None (same as the input).
+        layout (str, optional): 'sigprofiler' (mutation types as rows) or 'hdp' (samples as rows). Defaults to 'sigprofiler'.
+
+    Raises:
+        KeyError: a mutation type is not a context of the inferred kmer size
+    """
+    rows, columns = read_matrix_labels(inpath, layout)
+    mut_vector = rows if layout == 'sigprofiler' else columns
+    catalog = infer_context_catalog(mut_vector)
+    target_symmetric = catalog.symmetric if target_symmetric is None else target_symmetric
+    target = context_catalog(target_kmer, target_symmetric)
+    groups = collapse_table(catalog.kmer, target_kmer, catalog.symmetric, target_symmetric)[catalog.codes(mut_vector)]
+    if layout == 'sigprofiler':
+        groups = target.hdp_order[groups] # positions among the alphabetically sorted contexts
+        collapsed, start = None, 0
+        for labels, block in iter_matrix_blocks(inpath, layout):
+            block_sums = aggregate_counts(block, groups[start:start + len(labels)], len(target), axis=0)
+            collapsed = block_sums if collapsed is None else collapsed + block_sums
+            start += len(labels)
+        if collapsed is None:
+            collapsed = np.zeros((len(target), len(columns)), dtype=np.int64)
+        write_matrix(outpath, collapsed, target.sigprofiler_labels, columns, layout)
+    else:
+        blocks = [aggregate_counts(block, groups, len(target), axis=1) for _, block in iter_matrix_blocks(inpath, layout)]
+        collapsed = np.vstack(blocks) if blocks else np.zeros((0, len(target)), dtype=np.int64)
+        write_matrix(outpath, collapsed, rows, target.labels, layout)
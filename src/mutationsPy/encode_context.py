@@ -0,0 +1,478 @@
+from functools import lru_cache
+
+import numpy as np
+
+from mutationsPy.gen_context import gen_context, gen_dbs_context, gen_id_context
+
+MUTATION_TYPES = ('SBS', 'DBS', 'ID')
+
+# 2-bit base codes, anything else (eg N) is 4
+BASES = 'ACGT'
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    BASE_CODES[ord(_base)] = _code
+    BASE_CODES[ord(_base.lower())] = _code
+
+
+def n_contexts(kmer=3, symmetric=True):
+    """number of contexts generated by gen_context
+
+    Args:
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Returns:
+        int: number of contexts
+    """
+    _check_kmer(kmer)
+    return (6 if symmetric else 12) * 4 ** (kmer - 1)
+
+
+def encode_context_parts(ref, alt, left, right, kmer=3, symmetric=True):
+    """compose integer context codes from their parts
+
+    codes follow the order of gen_context(kmer, symmetric): the mutation, then the left flank, then the right flank
+
+    Args:
+        ref (np.array): 2-bit codes of the reference bases
+        alt (np.array): 2-bit codes of the mutated bases
+        left (np.array): base-4 codes of the left flanks (first base most significant)
+        right (np.array): base-4 codes of the right flanks (first base most significant)
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric, ref then has to be C or T. Defaults to True.
+
+    Returns:
+        np.array: context codes
+    """
+    ref = np.asarray(ref, dtype=np.int64)
+    alt = np.asarray(alt, dtype=np.int64)
+    mut = alt - (alt > ref)
+    mut = mut + 3 * (ref == 3) if symmetric else mut + 3 * ref
+    flank_size = kmer // 2
+    return (mut << (4 * flank_size)) + (np.asarray(left, dtype=np.int64) << (2 * flank_size)) + np.asarray(right, dtype=np.int64)
+
+
+def decode_context_parts(codes, kmer=3, symmetric=True):
+    """split integer context codes into their parts, inverse of encode_context_parts
+
+    Args:
+        codes (np.array convertible): context codes
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Returns:
+        tuple: np.arrays of ref, alt (2-bit codes), left and right flanks (base-4 codes)
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    flank_size = kmer // 2
+    right = codes & ((1 << (2 * flank_size)) - 1)
+    left = (codes >> (2 * flank_size)) & ((1 << (2 * flank_size)) - 1)
+    mut = codes >> (4 * flank_size)
+    ref = np.where(mut >= 3, 3, 1) if symmetric else mut // 3
+    alt = mut % 3
+    alt = alt + (alt >= ref)
+    return ref, alt, left, right
+
+
+def encode_seqs(seqs):
+    """encode equal-length sequences into base-4 integers (first base most significant)
+
+    Args:
+        seqs (np.array convertible): sequences, or a 2-D array of 2-bit base codes with one sequence per row
+
+    Raises:
+        ValueError: a sequence contains a base other than A, C, G or T
+
+    Returns:
+        np.array: sequence codes
+    """
+    seqs = np.asarray(seqs)
+    if seqs.ndim == 2 and seqs.dtype.kind in 'iu':
+        bases = seqs
+    else:
+        seqs = seqs.astype('S').ravel()
+        bases = BASE_CODES[np.ascontiguousarray(seqs).view(np.uint8).reshape(len(seqs), seqs.dtype.itemsize)]
+    if np.any(bases > 3):
+        raise ValueError('sequences can only contain A, C, G or T')
+    codes = np.zeros(len(bases), dtype=np.int64)
+    for i in range(bases.shape[1]):
+        codes = (codes << 2) | bases[:, i]
+    return codes
+
+
+def decode_seqs(codes, length):
+    """decode base-4 integers back into sequences, inverse of encode_seqs
+
+    Args:
+        codes (np.array convertible): sequence codes
+        length (int): sequence length
+
+    Returns:
+        np.array: sequences (str)
+    """
+    codes = np.asarray(codes, dtype=np.int64).ravel()
+    shifts = 2 * np.arange(length - 1, -1, -1)
+    ascii_codes = np.frombuffer(BASES.encode(), dtype=np.uint8)[(codes[:, None] >> shifts) & 3]
+    return ascii_codes.astype(np.uint32).view(f'U{max(length, 1)}').ravel() if length else np.full(len(codes), '')
+
+
+def encode_contexts(contexts, kmer=3, symmetric=True):
+    """encode context labels (eg A[C>G]T) into integer codes, the position of the label in gen_context(kmer, symmetric)
+
+    Args:
+        contexts (np.array convertible): contexts of mutations
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Raises:
+        ValueError: a label is not part of gen_context(kmer, symmetric)
+
+    Returns:
+        np.array: context codes
+    """
+    _check_kmer(kmer)
+    flank_size = kmer // 2
+    width = kmer + 4 if kmer > 1 else 3
+    contexts = np.asarray(contexts)
+    contexts = contexts.astype(f'S{width + 1}').ravel() # one extra byte to catch labels that are too long
+    chars = np.ascontiguousarray(contexts).view(np.uint8).reshape(len(contexts), width + 1)
+    if kmer == 1:
+        ref, arrow, alt = chars[:, 0], chars[:, 1], chars[:, 2]
+        valid = arrow == ord('>')
+        left = right = np.zeros(len(contexts), dtype=np.int64)
+    else:
+        ref, alt = chars[:, flank_size + 1], chars[:, flank_size + 3]
+        valid = ((chars[:, flank_size] == ord('[')) & (chars[:, flank_size + 2] == ord('>'))
+                 & (chars[:, flank_size + 4] == ord(']')))
+        left_bases = BASE_CODES[chars[:, :flank_size]]
+        right_bases = BASE_CODES[chars[:, flank_size + 5:width]]
+        valid &= np.all(left_bases < 4, axis=1) & np.all(right_bases < 4, axis=1)
+        left, right = encode_seqs(np.minimum(left_bases, 3)), encode_seqs(np.minimum(right_bases, 3))
+    ref, alt = BASE_CODES[ref], BASE_CODES[alt]
+    valid &= (chars[:, width] == 0) & (ref < 4) & (alt < 4) & (ref != alt)
+    if symmetric:
+        valid &= (ref == 1) | (ref == 3)
+    if not np.all(valid):
+        raise ValueError(f'{contexts[~valid][0].decode()} is not a context of gen_context({kmer}, symmetric={symmetric})')
+    return encode_context_parts(ref, alt, left, right, kmer, symmetric)
+
+
+def decode_contexts(codes, kmer=3, symmetric=True):
+    """convert integer context codes back into the labels used in the matrix files
+
+    Args:
+        codes (np.array convertible): context codes
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Returns:
+        np.array: contexts of mutations (str)
+    """
+    return context_labels(kmer, symmetric)[np.asarray(codes, dtype=np.int64)]
+
+
+def context_labels(kmer=3, symmetric=True):
+    """read-only array version of gen_context(kmer, symmetric), the lookup table of decode_contexts"""
+    return context_catalog(kmer, symmetric).labels
+
+
+class MutationCatalog:
+    """the mutation types of a matrix with the lookups needed to move between matrix orderings
+
+    HDP matrices order mutation types as the generating function does (eg gen_context), SigProfiler matrices
+    sort SNV contexts alphabetically and keep the COSMIC order of other mutation types.
+    Both orders are precomputed as index arrays so that reordering a matrix is a single np.take
+
+    Args:
+        name (str): name of the catalog, eg DBS78
+        labels (list): mutation types in HDP order
+        sigprofiler_labels (list, optional): the same mutation types in SigProfiler order. Defaults to None (sorted alphabetically).
+
+    Attributes:
+        name (str): name of the catalog
+        labels (np.array): mutation types in HDP order
+        index (dict): position of each mutation type in labels, ie its code
+        sigprofiler_order (np.array): indices into HDP ordered mutation types that put them in SigProfiler order
+        hdp_order (np.array): indices into SigProfiler ordered mutation types that put them in HDP order, inverse of sigprofiler_order
+        sigprofiler_labels (np.array): mutation types in SigProfiler order
+    """
+
+    def __init__(self, name, labels, sigprofiler_labels=None):
+        self.name = name
+        self.labels = _read_only(np.array(labels))
+        self.index = {label: i for i, label in enumerate(self.labels.tolist())}
+        if sigprofiler_labels is None:
+            sigprofiler_order = np.argsort(self.labels, kind = 'stable')
+        else:
+            sigprofiler_order = np.array([self.index[label] for label in sigprofiler_labels], dtype=np.int64)
+        self.sigprofiler_order = _read_only(sigprofiler_order)
+        hdp_order = np.empty_like(self.sigprofiler_order)
+        hdp_order[self.sigprofiler_order] = np.arange(len(hdp_order))
+        self.hdp_order = _read_only(hdp_order)
+        self.sigprofiler_labels = _read_only(self.labels[self.sigprofiler_order])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return f'MutationCatalog({self.name!r})'
+
+    def codes(self, labels, default=None):
+        """positions of mutation types in HDP order
+
+        Args:
+            labels (iterable): mutation types
+            default (int, optional): code of mutation types that are not in the catalog. Defaults to None (raise a KeyError).
+
+        Raises:
+            KeyError: a mutation type is not in the catalog and no default is given
+
+        Returns:
+            np.array: codes
+        """
+        labels = labels.tolist() if isinstance(labels, np.ndarray) else labels
+        if default is None:
+            return np.array([self.index[label] for label in labels], dtype=np.int64)
+        return np.array([self.index.get(label, default) for label in labels], dtype=np.int64)
+
+    def to_sigprofiler(self, counts, axis=0):
+        """reorder counts whose axis is in HDP order as SigProfiler does"""
+        return np.take(counts, self.sigprofiler_order, axis=axis)
+
+    def to_hdp(self, counts, axis=0):
+        """reorder counts whose axis is in SigProfiler order as HDP does"""
+        return np.take(counts, self.hdp_order, axis=axis)
+
+
+class ContextCatalog(MutationCatalog):
+    """the SNV contexts of gen_context(kmer, symmetric), built once per (kmer, symmetric) by context_catalog.
+    SigProfiler sorts them alphabetically, the codes are those of encode_contexts
+
+    Attributes:
+        kmer (int): kmer size
+        symmetric (bool): whether mutation is symmetric
+    """
+
+    def __init__(self, kmer=3, symmetric=True):
+        super().__init__(f'SBS{n_contexts(kmer, symmetric)}', gen_context(kmer, symmetric))
+        self.kmer = kmer
+        self.symmetric = symmetric
+
+    def __repr__(self):
+        return f'ContextCatalog(kmer={self.kmer}, symmetric={self.symmetric})'
+
+
+def context_catalog(kmer=3, symmetric=True):
+    """catalog of the contexts of gen_context(kmer, symmetric), cached so that it is only built once
+
+    Args:
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Returns:
+        ContextCatalog: shared catalog, its arrays are read-only
+    """
+    _check_kmer(kmer)
+    return _context_catalog(int(kmer), bool(symmetric))
+
+
+@lru_cache(maxsize=None)
+def _context_catalog(kmer, symmetric):
+    return ContextCatalog(kmer, symmetric)
+
+
+@lru_cache(maxsize=None)
+def dbs_catalog():
+    """catalog of the COSMIC doublet base substitutions of gen_dbs_context, in COSMIC order for both layouts
+
+    Returns:
+        MutationCatalog: shared catalog, its arrays are read-only
+    """
+    return MutationCatalog('DBS78', gen_dbs_context(), gen_dbs_context())
+
+
+@lru_cache(maxsize=None)
+def id_catalog():
+    """catalog of the COSMIC indel classes of gen_id_context, in COSMIC order for both layouts
+
+    Returns:
+        MutationCatalog: shared catalog, its arrays are read-only
+    """
+    return MutationCatalog('ID83', gen_id_context(), gen_id_context())
+
+
+def mutation_catalog(mutation_type='SBS', kmer=3, symmetric=True):
+    """catalog of a type of mutations, one of MUTATION_TYPES
+
+    Args:
+        mutation_type (str, optional): 'SBS' (single base substitutions), 'DBS' (doublet base substitutions) or 'ID' (indels). Defaults to 'SBS'.
+        kmer (int, optional): kmer size of SBS contexts. Defaults to 3.
+        symmetric (bool, optional): whether SBS are symmetric. Defaults to True.
+
+    Raises:
+        ValueError: unknown mutation type
+
+    Returns:
+        MutationCatalog: shared catalog
+    """
+    if mutation_type == 'SBS':
+        return context_catalog(kmer, symmetric)
+    if mutation_type == 'DBS':
+        return dbs_catalog()
+    if mutation_type == 'ID':
+        return id_catalog()
+    raise ValueError(f'mutation_type should be one of {MUTATION_TYPES}')
+
+
+def infer_context_catalog(labels):
+    """catalog matching the contexts of a matrix: kmer from the label length, symmetric unless a mutation is from A or G
+
+    Args:
+        labels (iterable): contexts of mutations (eg the rows of a SigProfiler matrix)
+
+    Raises:
+        ValueError: labels are empty or do not look like contexts of gen_context
+
+    Returns:
+        ContextCatalog: shared catalog, labels may still include contexts that are not in it
+    """
+    labels = [str(label) for label in labels]
+    if not labels:
+        raise ValueError('no contexts to infer the kmer size from')
+    first = labels[0]
+    kmer = len(first) - 4 if '[' in first else len(first) - 2
+    if kmer < 1 or kmer % 2 != 1 or any(len(label) != len(first) for label in labels):
+        raise ValueError(f'{first} is not a context of gen_context')
+    ref_at = kmer // 2 + 1 if kmer > 1 else 0
+    symmetric = all(label[ref_at] in 'CT' for label in labels)
+    return context_catalog(kmer, symmetric)
+
+
+def infer_mutation_catalog(labels):
+    """catalog matching the mutation types of a matrix: DBS78 or ID83 if the first label is one of their classes,
+    SNV contexts otherwise (see infer_context_catalog)
+
+    Args:
+        labels (iterable): mutation types (eg the rows of a SigProfiler matrix)
+
+    Raises:
+        ValueError: labels are empty or not mutation types of any catalog
+
+    Returns:
+        MutationCatalog: shared catalog, labels may still include mutation types that are not in it
+    """
+    labels = [str(label) for label in labels]
+    for catalog in (dbs_catalog(), id_catalog()):
+        if labels and labels[0] in catalog.index:
+            return catalog
+    return infer_context_catalog(labels)
+
+
+@lru_cache(maxsize=None)
+def reverse_complement_table(length):
+    """lookup table from the code of a sequence to the code of its reverse complement
+
+    Args:
+        length (int): sequence length
+
+    Returns:
+        np.array: read-only table with 4**length entries
+    """
+    codes = np.arange(4 ** length, dtype=np.int64)
+    table = np.zeros_like(codes)
+    for i in range(length):
+        table |= (3 - ((codes >> (2 * i)) & 3)) << (2 * (length - 1 - i))
+    return _read_only(table)
+
+
+@lru_cache(maxsize=None)
+def rv_context_table(kmer=3):
+    """lookup table from the code of an asymmetric context to the code of its complementary context (eg AG[A>C]T -> A[T>G]CT)
+
+    Args:
+        kmer (int, optional): kmer size. Defaults to 3.
+
+    Returns:
+        np.array: read-only table over gen_context(kmer, symmetric=False)
+    """
+    ref, alt, left, right = decode_context_parts(np.arange(n_contexts(kmer, symmetric=False)), kmer, symmetric=False)
+    flank_rc = reverse_complement_table(kmer // 2)
+    return _read_only(encode_context_parts(3 - ref, 3 - alt, flank_rc[right], flank_rc[left], kmer, symmetric=False))
+
+
+@lru_cache(maxsize=None)
+def symmetrise_table(kmer=3):
+    """lookup table from the code of an asymmetric context to the code of its symmetrised context (see symmetrise_context),
+    so that symmetrise_table(kmer).take(codes) symmetrises a whole batch
+
+    Args:
+        kmer (int, optional): kmer size. Defaults to 3.
+
+    Returns:
+        np.array: read-only table from gen_context(kmer, symmetric=False) codes to gen_context(kmer, symmetric=True) codes
+    """
+    codes = np.arange(n_contexts(kmer, symmetric=False))
+    ref = decode_context_parts(codes, kmer, symmetric=False)[0]
+    codes = np.where((ref == 1) | (ref == 3), codes, rv_context_table(kmer))
+    ref, alt, left, right = decode_context_parts(codes, kmer, symmetric=False)
+    return _read_only(encode_context_parts(ref, alt, left, right, kmer, symmetric=True))
+
+
+@lru_cache(maxsize=None)
+def collapse_table(kmer, target_kmer, symmetric=True, target_symmetric=None):
+    """lookup table from the code of a context to the code of the context with shorter flanks that contains it
+    (eg AA[C>G]TC -> A[C>G]T), folding asymmetric into symmetric contexts as symmetrise_context does if asked to
+
+    Args:
+        kmer (int): kmer size of the contexts
+        target_kmer (int): kmer size to collapse to, no larger than kmer
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+        target_symmetric (bool, optional): whether collapsed mutations are symmetric. Defaults to None (same as symmetric).
+
+    Raises:
+        ValueError: target_kmer is larger than kmer, or symmetric contexts would have to be unfolded
+
+    Returns:
+        np.array: read-only table from gen_context(kmer, symmetric) codes to gen_context(target_kmer, target_symmetric) codes
+    """
+    _check_kmer(kmer)
+    _check_kmer(target_kmer)
+    target_symmetric = symmetric if target_symmetric is None else target_symmetric
+    if target_kmer > kmer:
+        raise ValueError(f'cannot collapse {kmer}-mers to {target_kmer}-mers')
+    if symmetric and not target_symmetric:
+        raise ValueError('symmetric contexts cannot be collapsed to asymmetric ones')
+    codes = np.arange(n_contexts(kmer, symmetric))
+    if target_symmetric and not symmetric:
+        codes, symmetric = symmetrise_table(kmer)[codes], True
+    ref, alt, left, right = decode_context_parts(codes, kmer, symmetric)
+    trimmed = kmer // 2 - target_kmer // 2
+    left = left & ((1 << (2 * (target_kmer // 2))) - 1) # the bases next to the mutation are the last ones of the left flank
+    right = right >> (2 * trimmed)
+    return _read_only(encode_context_parts(ref, alt, left, right, target_kmer, target_symmetric))
+
+
+@lru_cache(maxsize=None)
+def wt_seq_table(kmer=3, symmetric=True):
+    """lookup table from the code of a context to the code of its wildtype sequence (see get_wt_seq)
+
+    Args:
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Returns:
+        np.array: read-only table of sequence codes of length kmer
+    """
+    flank_size = kmer // 2
+    ref, _, left, right = decode_context_parts(np.arange(n_contexts(kmer, symmetric)), kmer, symmetric)
+    return _read_only((((left << 2) | ref) << (2 * flank_size)) | right)
+
+
+def _read_only(table):
+    table.flags.writeable = False
+    return table
+
+
+def _check_kmer(kmer):
+    if kmer % 2 != 1 or kmer < 1:
+        raise ValueError("kmer should be an odd number no less than 1")
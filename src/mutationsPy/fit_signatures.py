@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from mutationsPy.simulate_mut_matrix import _signature_array
+
+METHODS = ('kl', 'frobenius')
+
+
+def fit_exposures(mut_mat, signatures, method='kl', max_iter=2000, tol=1e-6, n_jobs=1, chunksize=None):
+    """estimate the exposures of samples to known signatures, the inverse of sample_mut_mat_simple
+
+    all samples are fitted at once with multiplicative updates, the exposures of every sample being one row of a
+    matrix update: 'kl' maximises the Poisson likelihood of the counts (the model of the simulator), 'frobenius'
+    solves the non-negative least squares problem. A sample stops being updated once it has converged.
+    Samples can be split into chunks fitted on a thread pool, numpy releasing the GIL during the matrix products
+
+    Args:
+        mut_mat (np.array convertible): mutation counts, where rows are the samples and columns are the mutation classes
+        signatures (np.array convertible): signatures with rows are the signatures, and columns are the proportion of mutation classes
+        method (str, optional): 'kl' or 'frobenius'. Defaults to 'kl'.
+        max_iter (int, optional): maximum number of updates. Defaults to 2000.
+        tol (float, optional): stop once no exposure changes by more than tol (relative to the burden of its sample). Defaults to 1e-6.
+        n_jobs (int, optional): number of threads, None for one per CPU. Defaults to 1 (no pool).
+        chunksize (int, optional): number of samples per chunk on the thread pool. Defaults to None (samples split evenly across threads).
+
+    Returns:
+        np.array: exposures in number of mutations, where rows are the samples and columns are the signatures
+    """
+    if method not in METHODS:
+        raise ValueError(f"method should be one of {METHODS}")
+    mut_mat = np.asarray(mut_mat, dtype=float)
+    signatures = np.asarray(signatures, dtype=float)
+    if mut_mat.shape[1] != signatures.shape[1]:
+        raise ValueError(f'{mut_mat.shape[1]} mutation classes do not match signatures of {signatures.shape[1]}')
+    n_jobs = n_jobs or os.cpu_count()
+    if n_jobs == 1 or len(mut_mat) <= 1:
+        return _fit_chunk(mut_mat, signatures, method, max_iter, tol)
+    chunksize = chunksize or -(-len(mut_mat) // n_jobs)
+    starts = range(0, len(mut_mat), chunksize)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        chunks = executor.map(lambda start: _fit_chunk(mut_mat[start:start + chunksize], signatures, method, max_iter, tol), starts)
+        return np.vstack(list(chunks))
+
+
+def fit_mut_matrix(mut_matrix, signatures, method='kl', **kwargs):
+    """fit exposures to the mutation matrix of a cohort, with inputs and output shaped as those of gen_mut_matrix,
+    so that fit_mut_matrix(gen_mut_matrix(exposure_matrix, signatures), signatures) recovers exposure_matrix
+
+    Args:
+        mut_matrix (pd.DataFrame): columns include 'sample_id' and the mutation classes of signatures['Type']
+        signatures (pd.DataFrame): downloaded from COSMIC, the signatures to fit
+        method (str, optional): 'kl' or 'frobenius', see fit_exposures. Defaults to 'kl'.
+        **kwargs: passed to fit_exposures, eg n_jobs
+
+    Raises:
+        KeyError: a mutation class of the signatures is missing from mut_matrix
+
+    Returns:
+        pd.DataFrame: columns 'sample_id', 'burdens' (mutation burdens) and one per signature (exposures in proportion)
+    """
+    signature_names = [column for column in signatures.columns if column != 'Type']
+    signature_array, mut_class = _signature_array(signatures, signature_names)
+    missing = [mut for mut in mut_class if mut not in mut_matrix.columns]
+    if missing:
+        raise KeyError(f'{missing} not in the columns of the mutation matrix')
+    counts = mut_matrix[mut_class].to_numpy(dtype=float)
+    exposures = fit_exposures(counts, signature_array, method=method, **kwargs)
+    burdens = counts.sum(axis=1)
+    proportions = np.divide(exposures, exposures.sum(axis=1, keepdims=True), out=np.zeros_like(exposures),
+                            where=exposures.sum(axis=1, keepdims=True) > 0)
+    exposure_matrix = pd.DataFrame(proportions, columns = signature_names, index = mut_matrix.index)
+    exposure_matrix.insert(0, 'burdens', burdens)
+    exposure_matrix.insert(0, 'sample_id', mut_matrix['sample_id'] if 'sample_id' in mut_matrix.columns else mut_matrix.index)
+    return exposure_matrix
+
+
+def _fit_chunk(mut_mat, signatures, method, max_iter, tol):
+    """multiplicative updates of the exposures of a block of samples, samples that have converged are no longer updated"""
+    eps = np.finfo(float).eps
+    burdens = mut_mat.sum(axis=1, keepdims=True)
+    exposures = np.repeat(burdens / len(signatures), len(signatures), axis=1) + eps
+    scale = np.maximum(burdens, 1)
+    signature_totals = signatures.sum(axis=1)
+    if method == 'frobenius':
+        numerator, gram = mut_mat @ signatures.T, signatures @ signatures.T
+    active = np.flatnonzero(burdens[:, 0] > 0)
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        previous = exposures[active]
+        if method == 'kl':
+            updated = previous * ((mut_mat[active] / np.maximum(previous @ signatures, eps)) @ signatures.T) / signature_totals
+        else:
+            updated = previous * numerator[active] / np.maximum(previous @ gram, eps)
+        exposures[active] = updated
+        active = active[np.max(np.abs(updated - previous) / scale[active], axis=1) >= tol]
+    exposures[burdens[:, 0] == 0] = 0
+    return exposures
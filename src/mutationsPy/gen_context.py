@@ -1,3 +1,4 @@
+from functools import lru_cache
 from itertools import product
 
 def gen_context(kmer=3, symmetric=True):
@@ -13,6 +14,12 @@ def gen_context(kmer=3, symmetric=True):
     Returns:
         a list of mutations 
     """
+    return list(_gen_context(kmer, symmetric))
+
+
+@lru_cache(maxsize=None)
+def _gen_context(kmer, symmetric):
+    """contexts are only built once per (kmer, symmetric), gen_context hands out a fresh list of them"""
     if kmer % 2 != 1 or kmer < 1:
         raise ValueError("kmer should be an odd number no less than 1") 
     bases = 'ACGT'
@@ -21,10 +28,47 @@ def gen_context(kmer=3, symmetric=True):
     else:
         muts = [f'{ref}>{alt}' for ref, alt in product(bases, bases) if ref != alt]
     if kmer == 1: 
-        return muts
+        return tuple(muts)
     else:
         flank = [''.join(f) for f in product(bases, repeat=(kmer//2))]
         contexts = [f'{left}[{mut}]{right}' for mut, left, right in product(muts, flank, flank)]
-        return contexts
-        
-        
\ No newline at end of file
+        return tuple(contexts)
+
+
+# reference dinucleotides of the COSMIC DBS78 classes and their mutated dinucleotides, the other 6 references
+# are the reverse complements of these (eg GT>TG is AC>CA)
+_DBS78 = {
+    'AC': ['CA', 'CG', 'CT', 'GA', 'GG', 'GT', 'TA', 'TG', 'TT'],
+    'AT': ['CA', 'CC', 'CG', 'GA', 'GC', 'TA'],
+    'CC': ['AA', 'AG', 'AT', 'GA', 'GG', 'GT', 'TA', 'TG', 'TT'],
+    'CG': ['AT', 'GC', 'GT', 'TA', 'TC', 'TT'],
+    'CT': ['AA', 'AC', 'AG', 'GA', 'GC', 'GG', 'TA', 'TC', 'TG'],
+    'GC': ['AA', 'AG', 'AT', 'CA', 'CG', 'TA'],
+    'TA': ['AT', 'CG', 'CT', 'GC', 'GG', 'GT'],
+    'TC': ['AA', 'AG', 'AT', 'CA', 'CG', 'CT', 'GA', 'GG', 'GT'],
+    'TG': ['AA', 'AC', 'AT', 'CA', 'CC', 'CT', 'GA', 'GC', 'GT'],
+    'TT': ['AA', 'AC', 'AG', 'CA', 'CC', 'CG', 'GA', 'GC', 'GG'],
+}
+
+
+def gen_dbs_context():
+    """Generate the 78 doublet base substitution classes of COSMIC (DBS78), eg AC>CA, in COSMIC order
+
+    Returns:
+        a list of mutations
+    """
+    return [f'{ref}>{alt}' for ref, alts in _DBS78.items() for alt in alts]
+
+
+def gen_id_context():
+    """Generate the 83 indel classes of COSMIC (ID83), in COSMIC order, labelled as SigProfiler does:
+    size:type:repeat base or R (repeat) or M (microhomology):number of repeat units or microhomology length, 
+    5 standing for 5 or more (eg 1:Del:C:0 or 3:Del:M:2)
+
+    Returns:
+        a list of mutations
+    """
+    single = [f'1:{kind}:{base}:{repeats}' for kind, base, repeats in product(['Del', 'Ins'], 'CT', range(6))]
+    repeat = [f'{size}:{kind}:R:{repeats}' for kind, size, repeats in product(['Del', 'Ins'], range(2, 6), range(6))]
+    microhomology = [f'{size}:Del:M:{length}' for size in range(2, 6) for length in range(1, size if size < 5 else 6)]
+    return single + repeat + microhomology
@@ -1,3 +1,8 @@
+import numpy as np
+
+from mutationsPy.read_file import _UPPER_CODES
+from mutationsPy.encode_context import BASE_CODES, encode_context_parts, encode_seqs, symmetrise_table
+
 
 def get_mut(context):
     """get the central mutation given the context 
@@ -44,6 +49,171 @@ def get_context(seq, pos, ref, alt, kmer=3):
     else:
         return f'{seq[(pos - flank_size):pos]}[{ref}>{alt}]{seq[(pos + 1):(pos + flank_size + 1)]}'
 
+def get_contexts(seq, pos, ref, alt, kmer=3):
+    """batch version of get_context, gets the contexts of many mutations on one reference sequence at once
+
+    the bases are looked up with one fancy indexing operation on a uint8 view of the sequence
+    (or through the memory map if seq is a Contig from read_file.FastaReference). A str or bytes sequence is
+    encoded once and kept until another one is looked up, so batches on the same sequence do not encode it again.
+    Instead of raising on the first bad row, rows are flagged in a mask: the reference allele does not match the sequence, 
+    either allele is not a single base, or the kmer window runs off the end of the sequence
+
+    alleles are fastest as numpy string arrays (U or S), which are read in place. Object arrays of str (eg from pandas)
+    are joined into one string first, which takes most of the time: on 100k SNVs this is about 15x faster than calling
+    get_context in a loop, against about 35x with U arrays
+
+    here mut refers to the base substitutions, eg C>G
+    context refers to the substitution plus the flanking sequences, eg AT[C>G]GT
+    seq refers to a sequence (a string), eg ATCGC
+    Args:
+        seq (str, bytes, np.array of uint8 or Contig): reference sequence
+        pos (np.array convertible): 0-based positions of the mutations
+        ref (np.array convertible): reference alleles
+        alt (np.array convertible): mutated alleles
+        kmer (int, optional): kmer size. Defaults to 3.
+
+    Raises:
+        ValueError: kmer should be an odd number no less than 1
+
+    Returns:
+        tuple: np.array of the contexts (str, empty where flagged) and np.array of bool, True where the row is flagged
+    """
+    window, ref_codes, alt_codes, mismatch = _context_windows(seq, pos, ref, alt, kmer)
+    n, flank_size = len(window), kmer // 2
+    contexts = np.empty((n, kmer + 4 if kmer > 1 else 3), dtype=np.uint8)
+    if kmer == 1:
+        contexts[:, 0], contexts[:, 1], contexts[:, 2] = ref_codes, ord('>'), alt_codes
+    else:
+        contexts[:, :flank_size] = window[:, :flank_size]
+        contexts[:, flank_size] = ord('[')
+        contexts[:, flank_size + 1] = ref_codes
+        contexts[:, flank_size + 2] = ord('>')
+        contexts[:, flank_size + 3] = alt_codes
+        contexts[:, flank_size + 4] = ord(']')
+        contexts[:, flank_size + 5:] = window[:, flank_size + 1:]
+    # numpy unicode strings are UCS4, so widening the ASCII codes gives the string array without a per-row conversion
+    contexts = contexts.astype(np.uint32).view(f'U{contexts.shape[1]}').ravel()
+    contexts[mismatch] = ''
+    return contexts, mismatch
+
+def get_context_codes(seq, pos, ref, alt, kmer=3, symmetric=True):
+    """batch version of get_context returning integer context codes (see encode_context) instead of labels
+
+    with symmetric=True contexts with A or G as reference allele are symmetrised, as in symmetrise_context.
+    Rows are flagged as in get_contexts, and also when ref and alt are the same base or the window contains a base other than A, C, G or T
+
+    Args:
+        seq (str, bytes, np.array of uint8 or Contig): reference sequence
+        pos (np.array convertible): 0-based positions of the mutations
+        ref (np.array convertible): reference alleles
+        alt (np.array convertible): mutated alleles
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether to return codes of gen_context(kmer, symmetric=True). Defaults to True.
+
+    Raises:
+        ValueError: kmer should be an odd number no less than 1
+
+    Returns:
+        tuple: np.array of the context codes (-1 where flagged) and np.array of bool, True where the row is flagged
+    """
+    window, _, alt_codes, mismatch = _context_windows(seq, pos, ref, alt, kmer)
+    flank_size = kmer // 2
+    window = BASE_CODES[window]
+    alt_codes = BASE_CODES[alt_codes]
+    mismatch |= np.any(window > 3, axis=1) | (alt_codes > 3) | (alt_codes == window[:, flank_size])
+    window[mismatch] = 0
+    alt_codes[mismatch] = 1
+    codes = encode_context_parts(window[:, flank_size], alt_codes, encode_seqs(window[:, :flank_size]), 
+                                 encode_seqs(window[:, flank_size + 1:]), kmer, symmetric=False)
+    if symmetric:
+        codes = symmetrise_table(kmer).take(codes)
+    codes[mismatch] = -1
+    return codes, mismatch
+
+def _context_windows(seq, pos, ref, alt, kmer):
+    """shared part of the batch context functions
+
+    Returns:
+        tuple: kmer windows of the sequence around each position (n x kmer uint8 ASCII codes), 
+            ASCII codes of ref and alt and the mask of flagged rows
+    """
+    if kmer % 2 != 1 or kmer < 1:
+        raise ValueError("kmer should be an odd number no less than 1") 
+    flank_size = kmer // 2
+    pos = np.asarray(pos, dtype=np.int64).ravel()
+    ref_codes, ref_valid = _allele_codes(ref, len(pos))
+    alt_codes, alt_valid = _allele_codes(alt, len(pos))
+    length = len(seq)
+    in_bounds = (pos >= flank_size) & (pos + flank_size < length)
+    # built kmer x n and transposed, so that numpy loops over the rows rather than the few bases of each window
+    offsets = np.arange(-flank_size, flank_size + 1)[:, None] + np.where(in_bounds, pos, flank_size)
+    window = (np.zeros(offsets.shape, dtype=np.uint8) if length < kmer else _bases_at(seq, offsets)).T
+    mismatch = ~in_bounds | ~ref_valid | ~alt_valid | (window[:, flank_size] != ref_codes)
+    return window, ref_codes, alt_codes, mismatch
+
+# _UPPER_CODES of ASCII characters, 0 for other bytes
+_ASCII_UPPER_CODES = np.where(np.arange(256) < 128, _UPPER_CODES, 0).astype(np.uint8)
+
+# last str or bytes sequence looked up and its uppercase ASCII codes, so that batches of mutations on the same
+# (immutable) sequence do not encode it again
+_encoded_seq = (None, None)
+
+def _bases_at(seq, offsets):
+    """uppercase ASCII codes of the bases at offsets of a sequence"""
+    global _encoded_seq
+    if hasattr(seq, 'bases'):
+        return seq.bases(offsets)
+    if isinstance(seq, np.ndarray):
+        return _UPPER_CODES[seq.view(np.uint8)[offsets]]
+    cached, codes = _encoded_seq
+    if cached is not seq:
+        codes = _UPPER_CODES[np.frombuffer(seq.encode('ascii') if isinstance(seq, str) else seq, dtype=np.uint8)]
+        _encoded_seq = (seq, codes)
+    return codes[offsets]
+
+def _allele_codes(alleles, n):
+    """uppercase ASCII codes of single-base alleles and a mask of which alleles are single ASCII characters"""
+    alleles = np.asarray(alleles)
+    if alleles.size == 1 and n != 1:
+        codes, valid = _allele_codes(alleles.reshape(1), 1)
+        return np.broadcast_to(codes, (n,)), np.broadcast_to(valid, (n,))
+    alleles = alleles.ravel()
+    if alleles.dtype.kind == 'S':
+        chars = np.ascontiguousarray(alleles).view(np.uint8).reshape(n, alleles.dtype.itemsize)
+        first = chars[:, 0] if chars.shape[1] else np.zeros(n, dtype=np.uint8)
+        single = chars[:, 1] == 0 if chars.shape[1] > 1 else None
+    elif alleles.dtype.kind == 'U':
+        # code points of unicode strings, padded with zeros to the longest one
+        points = np.ascontiguousarray(alleles).view(np.uint32).reshape(n, alleles.dtype.itemsize // 4)
+        first = points[:, 0] if points.shape[1] else np.zeros(n, dtype=np.uint32)
+        single = points[:, 1] == 0 if points.shape[1] > 1 else None
+    else:
+        values = alleles.tolist()
+        try:
+            joined = '\0'.join(values)
+        except TypeError:
+            values = [value.decode('latin-1') if isinstance(value, bytes) else str(value) for value in values]
+            joined = '\0'.join(values)
+        chars = np.frombuffer(joined.encode('ascii'), dtype=np.uint8) if len(joined) == 2 * n - 1 and joined.isascii() else None
+        # the alleles are all single characters exactly when the separators are every other character
+        if chars is not None and chars[1::2].max(initial=0) == 0 and chars[::2].all():
+            first = chars[::2]
+            single = None
+        else:
+            joined = ''.join(values)
+            lengths = np.fromiter(map(len, values), dtype=np.int64, count=n)
+            # one code point per character, padded so that the first character of an empty last allele can be looked up
+            points = np.frombuffer((joined + '\0').encode('utf-32-le'), dtype=np.uint32)
+            first = points[np.cumsum(lengths) - lengths]
+            single = lengths == 1
+    if first.dtype != np.uint8:
+        first = np.where(first < 128, first, 0)
+    codes = _ASCII_UPPER_CODES[first]
+    valid = codes != 0
+    if single is not None:
+        valid &= single
+    return codes, valid
+
 def get_wt_seq(mut):
     """take a mutation with sequence context and return the wildtype sequence
 
@@ -77,7 +247,8 @@ def complementary_base(base):
 def complementary_mut(mut):
     """get complementary mutation
 
-    here mut refers to the base substitutions, eg C>G
+    here mut refers to the base substitutions, eg C>G, or doublet base substitutions, eg AC>GT (whose complementary 
+    mutation is read on the other strand: GT>AC)
     context refers to the substitution plus the flanking sequences, eg AT[C>G]GT
     seq refers to a sequence (a string), eg ATCGC
     Args:
@@ -89,9 +260,10 @@ def complementary_mut(mut):
     Returns:
         str: complementary mutation 
     """
-    if len(mut) != 3:
-        raise ValueError("mut has to be a string of length 3")
-    return f'{complementary_base(mut[0])}>{complementary_base(mut[2])}'
+    ref, sep, alt = mut.partition('>')
+    if not sep or not ref or len(ref) != len(alt):
+        raise ValueError("mut has to be a substitution of as many bases, eg C>G or AC>GT")
+    return f'{complementary_seq(ref)}>{complementary_seq(alt)}'
     
 def complementary_seq(seq):
     """get complementary sequence
@@ -122,7 +294,7 @@ def rv_context(context):
     """
     left, rest = context.split('[')
     mut, right = rest.split(']')
-    return f'{complementary_seq(right)}[c{complementary_mut(mut)}]{complementary_seq(left)}'
+    return f'{complementary_seq(right)}[{complementary_mut(mut)}]{complementary_seq(left)}'
 
 def symmetrise_context(context):
     """get complementary context only if reference allele is either A or G
@@ -0,0 +1,367 @@
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from mutationsPy.profiling import profiled, stage
+from mutationsPy.sparse_counts import SparseCounts, is_sparse, vstack
+
+LAYOUTS = ('sigprofiler', 'hdp')
+# number of values converted to text at a time by write_matrix
+TEXT_BLOCK_SIZE = 2 ** 22
+
+
+def is_binary(path):
+    """whether a mutation matrix path refers to the binary (.npz) format
+
+    Args:
+        path (path): path to mutation matrix
+
+    Returns:
+        bool: True if the path ends with .npz
+    """
+    return str(path).endswith('.npz')
+
+
+def save_npz(path, counts, rows, columns, layout):
+    """save a mutation matrix in the binary format
+
+    the file is an uncompressed .npz archive holding the counts, the row and column labels and the layout,
+    so that it can be read with np.load and its counts can be memory-mapped by load_npz.
+    Arrays are streamed into the archive, so counts can itself be a memory-mapped array larger than memory.
+    SparseCounts are saved as their data, indices, indptr and shape arrays instead of counts
+
+    Args:
+        path (path): path to output .npz file
+        counts (np.array or SparseCounts): 2-D array of mutation counts
+        rows (list): row labels
+        columns (list): column labels
+        layout (str): 'sigprofiler' (rows are mutation types) or 'hdp' (rows are samples)
+    """
+    _check_layout(layout)
+    if counts.shape != (len(rows), len(columns)):
+        raise ValueError(f'counts of shape {counts.shape} do not match {len(rows)} rows and {len(columns)} columns')
+    if is_sparse(counts):
+        arrays = {'data': counts.data, 'indices': counts.indices, 'indptr': counts.indptr, 'shape': np.array(counts.shape)}
+    else:
+        arrays = {'counts': counts}
+    arrays.update({'rows': _labels(rows), 'columns': _labels(columns), 'layout': np.array(layout)})
+    with zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, array in arrays.items():
+            with archive.open(f'{name}.npy', mode='w', force_zip64=True) as file:
+                np.lib.format.write_array(file, np.asanyarray(array), allow_pickle=False)
+
+
+def load_npz(path, mmap=False):
+    """load a mutation matrix saved by save_npz
+
+    Args:
+        path (path): path to .npz file
+        mmap (bool, optional): memory-map the counts (read only) instead of reading them into memory. Defaults to False.
+
+    Returns:
+        tuple: counts (np.array, or SparseCounts for sparse archives), row labels (np.array), column labels (np.array) and layout (str)
+    """
+    with np.load(path, allow_pickle=False) as archive:
+        rows, columns, layout = archive['rows'], archive['columns'], str(archive['layout'])
+        shape = archive['shape'] if 'shape' in archive.files else None
+    load = (lambda name: _memmap_member(path, name)) if mmap else (lambda name: np.array(_memmap_member(path, name)))
+    if shape is not None:
+        counts = SparseCounts(load('data.npy'), load('indices.npy'), load('indptr.npy'), shape)
+    else:
+        counts = load('counts.npy')
+    return counts, rows, columns, layout
+
+
+def is_sparse_matrix(path):
+    """whether a mutation matrix path refers to a sparse binary matrix
+
+    Args:
+        path (path): path to mutation matrix
+
+    Returns:
+        bool: True if the path is a .npz file saved from SparseCounts
+    """
+    if not is_binary(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return 'indptr.npy' in archive.namelist()
+
+
+def read_matrix(path, layout, mmap=False):
+    """read a mutation matrix in either the text or the binary format, oriented as the given layout
+
+    text files are expected in the given layout: tab delimited with a MutationType column for sigprofiler,
+    and a header without a label for the sample column for hdp. Binary files are transposed (as a view) if they were
+    saved in the other layout
+
+    Args:
+        path (path): path to mutation matrix
+        layout (str): 'sigprofiler' (rows are mutation types) or 'hdp' (rows are samples)
+        mmap (bool, optional): memory-map the counts of binary files. Defaults to False.
+
+    Returns:
+        tuple: counts (np.array or SparseCounts), row labels (np.array) and column labels (np.array)
+    """
+    _check_layout(layout)
+    with stage('read_matrix', path=str(path)) as record:
+        if is_binary(path):
+            counts, rows, columns, saved_layout = load_npz(path, mmap=mmap)
+            if saved_layout != layout:
+                counts, rows, columns = counts.T, columns, rows
+            record.add_rows(len(rows))
+            return counts, rows, columns
+        if layout == 'sigprofiler':
+            mutmat = pd.read_csv(path, sep = '\t')
+            mutmat = mutmat.set_index('MutationType')
+        else:
+            mutmat = pd.read_csv(path, sep = '\t')
+        record.add_rows(len(mutmat))
+        return mutmat.to_numpy(), _labels(mutmat.index), _labels(mutmat.columns)
+
+
+def iter_matrix_blocks(path, layout, block_size=None):
+    """read a mutation matrix a block of rows at a time, oriented as the given layout
+
+    text is parsed straight into typed numpy blocks (int64 when every value is an integer, float64 otherwise)
+    rather than through a DataFrame, binary files are sliced out of their memory map
+
+    Args:
+        path (path): path to mutation matrix
+        layout (str): 'sigprofiler' (rows are mutation types) or 'hdp' (rows are samples)
+        block_size (int, optional): number of values per block. Defaults to TEXT_BLOCK_SIZE.
+
+    Yields:
+        tuple: row labels (np.array) and counts (2-D np.array) of consecutive blocks of rows
+    """
+    _check_layout(layout)
+    block_size = TEXT_BLOCK_SIZE if block_size is None else block_size
+    if is_binary(path):
+        counts, rows, _ = read_matrix(path, layout, mmap=True)
+        block_rows = max(1, block_size // max(1, counts.shape[1]))
+        for start in range(0, len(rows), block_rows):
+            yield rows[start:start + block_rows], np.asarray(counts[start:start + block_rows])
+        return
+    with open(path, newline='') as file:
+        columns = _header_columns(file.readline(), layout, path)
+        block_rows = max(1, block_size // max(1, len(columns)))
+        labels, lines = [], []
+        for line in file:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            label, _, values = line.partition('\t')
+            labels.append(label)
+            lines.append(values)
+            if len(lines) == block_rows:
+                yield _labels(labels), _parse_block(lines, len(columns))
+                labels, lines = [], []
+        if lines:
+            yield _labels(labels), _parse_block(lines, len(columns))
+
+
+@profiled()
+def transpose_matrix(path, layout, outdir, take=None, destination=None):
+    """transpose a mutation matrix into a memory-mapped .npy file, a block of rows at a time
+
+    only one block of the input is in memory at a time and the dtype of the input is kept (int64 unless a value is not an integer).
+    take selects and reorders the input columns, which become the output rows (eg to sort mutation types).
+    destination places the input rows, which become the output columns (eg to put mutation types in gen_context order)
+
+    Args:
+        path (path): path to mutation matrix
+        layout (str): layout of the input, 'sigprofiler' (rows are mutation types) or 'hdp' (rows are samples)
+        outdir (path): directory for the memory-mapped file
+        take (np.array, optional): indices of the input columns to keep, in output order. Defaults to None (all).
+        destination (np.array, optional): output column of each input row, -1 to drop the row. Defaults to None (input order).
+
+    Returns:
+        tuple: transposed counts (np.memmap, or SparseCounts for sparse inputs), its row labels (np.array) and its column labels (np.array)
+    """
+    rows, columns = read_matrix_labels(path, layout)
+    take = np.arange(len(columns)) if take is None else np.asarray(take, dtype=np.int64)
+    destination = np.arange(len(rows)) if destination is None else np.asarray(destination, dtype=np.int64)
+    kept = destination >= 0
+    shape = (len(take), int(kept.sum()))
+    column_labels = np.empty(shape[1], dtype=rows.dtype)
+    column_labels[destination[kept]] = rows[kept]
+    if is_sparse_matrix(path):
+        # sparse counts are transposed in memory, which only takes memory for the nonzero counts
+        counts = read_matrix(path, layout)[0]
+        kept_rows = np.flatnonzero(kept)[np.argsort(destination[kept], kind = 'stable')]
+        return counts.T.take_rows(take).take_columns(kept_rows), columns[take], column_labels
+    transposed, start = None, 0
+    with stage('transpose_blocks', path=str(path)) as record:
+        for labels, block in iter_matrix_blocks(path, layout):
+            if transposed is None or not np.can_cast(block.dtype, transposed.dtype):
+                dtype = block.dtype if transposed is None else np.result_type(block.dtype, transposed.dtype)
+                transposed = _open_transposed(outdir, transposed, dtype, shape)
+            block_destination = destination[start:start + len(labels)]
+            block_kept = kept[start:start + len(labels)]
+            if np.all(block_kept) and np.all(np.diff(block_destination) == 1):
+                transposed[:, block_destination[0]:block_destination[-1] + 1] = block[:, take].T
+            else:
+                transposed[:, block_destination[block_kept]] = block[block_kept][:, take].T
+            start += len(labels)
+            record.add_rows(len(labels))
+    if transposed is None:
+        transposed = _open_transposed(outdir, None, np.int64, shape)
+    transposed.flush()
+    return transposed, columns[take], column_labels
+
+
+def _open_transposed(outdir, previous, dtype, shape):
+    """create the memory-mapped output of transpose_matrix, copying over what was written with a narrower dtype"""
+    path = os.path.join(outdir, f'transposed_{np.dtype(dtype).name}.npy')
+    transposed = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    if previous is not None:
+        block_rows = max(1, TEXT_BLOCK_SIZE // max(1, shape[1]))
+        for start in range(0, shape[0], block_rows):
+            transposed[start:start + block_rows] = previous[start:start + block_rows]
+    return transposed
+
+
+def _parse_block(lines, n_columns):
+    """parse tab delimited values, as integers if possible"""
+    try:
+        block = np.loadtxt(lines, dtype=np.int64, delimiter='\t', ndmin=2)
+    except ValueError:
+        block = pd.read_csv(io.StringIO('\n'.join(lines)), sep = '\t', header = None, dtype = float).to_numpy()
+    if block.shape[1] != n_columns:
+        raise ValueError(f'rows of {block.shape[1]} values do not match a header of {n_columns} columns')
+    return block
+
+
+def read_matrix_labels(path, layout):
+    """read the row and column labels of a mutation matrix without parsing its counts
+
+    Args:
+        path (path): path to mutation matrix
+        layout (str): 'sigprofiler' (rows are mutation types) or 'hdp' (rows are samples)
+
+    Returns:
+        tuple: row labels (np.array) and column labels (np.array)
+    """
+    _check_layout(layout)
+    if is_binary(path):
+        with np.load(path, allow_pickle=False) as archive:
+            rows, columns, saved_layout = archive['rows'], archive['columns'], str(archive['layout'])
+        return (rows, columns) if saved_layout == layout else (columns, rows)
+    with open(path, newline='') as file:
+        columns = _header_columns(file.readline(), layout, path)
+        rows = [line.partition('\t')[0].rstrip('\r\n') for line in file if line.strip('\r\n')]
+    return _labels(rows), columns
+
+
+def _header_columns(header, layout, path):
+    """column labels from the header line of a text matrix"""
+    header = header.rstrip('\r\n').split('\t')
+    if layout == 'sigprofiler':
+        if header[0] != 'MutationType':
+            raise ValueError(f'{path} has no MutationType column')
+        header = header[1:]
+    return _labels(header)
+
+
+def write_matrix(path, counts, rows, columns, layout, integer_columns=None):
+    """write a mutation matrix, in the binary format if the path ends with .npz and as tab delimited text otherwise
+
+    SparseCounts are saved as a sparse binary matrix, or written out a block of rows at a time as text
+
+    Args:
+        path (path): path to output mutation matrix
+        counts (np.array or SparseCounts): 2-D array of mutation counts
+        rows (list): row labels
+        columns (list): column labels
+        layout (str): 'sigprofiler' (rows are mutation types) or 'hdp' (rows are samples)
+        integer_columns (np.array of bool, optional): columns of float counts that are written as integers in text, as pandas
+            writes integer columns next to float ones. Defaults to None (all columns as their dtype).
+    """
+    _check_layout(layout)
+    with stage('write_matrix', rows=len(rows), path=str(path)):
+        if is_binary(path):
+            save_npz(path, counts, rows, columns, layout)
+            return
+        rows, columns = _labels(rows), _labels(columns)
+        # text is written a block of rows at a time so that memory-mapped counts are never loaded as a whole
+        block_size = max(1, TEXT_BLOCK_SIZE // max(1, len(columns)))
+        with open(path, 'w', newline='') as file:
+            header = (['MutationType'] if layout == 'sigprofiler' else []) + columns.tolist()
+            file.write('\t'.join(header) + '\n')
+            for start in range(0, len(rows), block_size):
+                block = np.asarray(counts[start:start + block_size])
+                file.writelines(_format_rows(rows[start:start + block_size], block, integer_columns))
+
+
+def _format_rows(labels, block, integer_columns=None):
+    """tab delimited lines of a block of counts, floats as pandas writes them (NaN as empty fields)
+    and the integer_columns of floats as integers"""
+    if block.dtype.kind == 'f' and integer_columns is not None and np.any(integer_columns):
+        integer_columns = np.asarray(integer_columns, dtype=bool).tolist()
+        return [f'{label}\t' + '\t'.join('' if value != value else str(int(value)) if integer else str(value)
+                                          for value, integer in zip(row, integer_columns)) + '\n'
+                for label, row in zip(labels.tolist(), block.tolist())]
+    if block.dtype.kind == 'f':
+        return [f'{label}\t' + '\t'.join('' if value != value else str(value) for value in row) + '\n' 
+                for label, row in zip(labels.tolist(), block.tolist())]
+    return [f'{label}\t' + '\t'.join(map(str, row)) + '\n' for label, row in zip(labels.tolist(), block.tolist())]
+
+
+@profiled()
+def convert_matrix_format(inpath, outpath, layout='sigprofiler', sparse=None):
+    """convert a mutation matrix between the text and the binary format (by file extension), keeping its layout
+
+    Args:
+        inpath (path): path to mutation matrix
+        outpath (path): path to output mutation matrix, binary if it ends with .npz
+        layout (str, optional): 'sigprofiler' or 'hdp'. Defaults to 'sigprofiler'.
+        sparse (bool, optional): save a sparse (True) or dense (False) binary matrix. Defaults to None (as the input, dense for text).
+    """
+    if sparse and not is_sparse_matrix(inpath):
+        # made sparse a block at a time, so that memory scales with the nonzero counts
+        _, columns = read_matrix_labels(inpath, layout)
+        blocks, rows = [SparseCounts.from_dense(np.zeros((0, len(columns)), dtype=np.int64))], []
+        for labels, block in iter_matrix_blocks(inpath, layout):
+            blocks.append(SparseCounts.from_dense(block))
+            rows.extend(labels)
+        write_matrix(outpath, vstack(blocks), rows, columns, layout)
+        return
+    counts, rows, columns = read_matrix(inpath, layout, mmap=True)
+    if sparse is False and is_sparse(counts):
+        counts = counts.toarray()
+    write_matrix(outpath, counts, rows, columns, layout)
+
+
+def _memmap_member(path, name):
+    """memory-map an uncompressed .npy member of a zip archive"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path, allow_pickle=False) as archive:
+            return archive[name[:-len('.npy')]]
+    with open(path, 'rb') as file:
+        file.seek(info.header_offset)
+        local_header = file.read(30)
+        name_length = int.from_bytes(local_header[26:28], 'little')
+        extra_length = int.from_bytes(local_header[28:30], 'little')
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if 0 in shape:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+def _labels(labels):
+    return np.asarray(labels).astype(str)
+
+
+def _check_layout(layout):
+    if layout not in LAYOUTS:
+        raise ValueError("layout should be either 'sigprofiler' or 'hdp'")
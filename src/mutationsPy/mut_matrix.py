@@ -1,118 +1,205 @@
 #!/usr/bin/env python3
 
-import pandas as pd
-from mutationsPy.gen_context import gen_context
+import numpy as np
+from mutationsPy.encode_context import ContextCatalog, infer_mutation_catalog
+from mutationsPy.matrix_io import read_matrix, read_matrix_labels, write_matrix, transpose_matrix, is_sparse_matrix
+from mutationsPy.sparse_counts import is_sparse, hstack
+from mutationsPy.profiling import profiled, stage
+from mutationsPy.result_cache import cached_call
+from mutationsPy import cli
 
-import argparse, sys
+import os, sys, tempfile
 
+@profiled()
 def sigprofiler_to_hdp_no_rearrangement(sigprofiler_path, hdp_outpath):
     """Convert sigprofiler-compatible matrix to HDP-compatible matrix - no reordering of columns/rows is performed. 
+    Either matrix can be in the text or the binary (.npz) format. The matrix is transposed in blocks through a 
+    temporary file next to hdp_outpath, keeping integer counts as integers
 
     Args:
         sigprofiler_path (_type_): path to sigprofiler matrix
         hdp_outpath (_type_): path to hdp matrix
     """
-    sigprofiler = pd.read_csv(sigprofiler_path, sep = '\t')    
-    sigprofiler = sigprofiler.set_index('MutationType')
-    sigprofiler.index.name = None
-    hdp = sigprofiler.transpose()
-    hdp.to_csv(hdp_outpath, sep = '\t', index=True, index_label=False)
+    with _scratch_dir(hdp_outpath) as tmpdir:
+        hdp, samples, hdp_mut_vector = transpose_matrix(sigprofiler_path, 'sigprofiler', tmpdir)
+        write_matrix(hdp_outpath, hdp, samples, hdp_mut_vector, 'hdp')
+        del hdp
 
 
 
-def sigprofiler_to_hdp(sigprofiler_path, hdp_outpath):
-    """Convert sigprofiler-compatible matrix to HDP-compatible matrix. Note that this is only true for trinucleotide SNVs
+@profiled()
+def sigprofiler_to_hdp(sigprofiler_path, hdp_outpath, cache_dir=None):
+    """Convert sigprofiler-compatible matrix to HDP-compatible matrix, ordering mutation types as gen_context does. 
+    The kmer size (and whether mutations are symmetric) is inferred from the mutation types, which have to be SNVs,
+    or the DBS78 or ID83 classes, which HDP matrices keep in COSMIC order (see gen_dbs_context and gen_id_context).
+    Either matrix can be in the text or the binary (.npz) format. The matrix is transposed in blocks through a 
+    temporary file next to hdp_outpath, keeping integer counts as integers
 
     Args:
         sigprofiler_path (_type_): path to sigprofiler matrix
         hdp_outpath (_type_): path to hdp matrix
-    """
-    sigprofiler = pd.read_csv(sigprofiler_path, sep = '\t')    
-    hdp_mut_vector = gen_context(3)
-    sigprofiler = sigprofiler.set_index('MutationType')
-    sigprofiler.index.name = None
-    hdp = sigprofiler.transpose()
-    hdp = hdp[hdp_mut_vector]
-    hdp.to_csv(hdp_outpath, sep = '\t', index=True, index_label=False)
-
+        cache_dir (path, optional): directory caching the result, keyed by the content of the input (see result_cache.cached_call).
+            Defaults to None (no cache).
 
-def hdp_to_sigprofiler(hdp_path, sigprofiler_outpath):
-    """Convert HDP-compatible matrix to sigprofiler-compatible matrix. Unlike HDP, Sigprofiler sorts mutations alphabetically. This is only true for SNVs (any sequence context size)
+    Raises:
+        KeyError: a mutation type of the catalog (eg gen_context) is missing from the sigprofiler matrix
+    """
+    if cache_dir is not None:
+        cached_call(cache_dir, 'sigprofiler_to_hdp', [sigprofiler_path], hdp_outpath, 
+                    lambda: sigprofiler_to_hdp(sigprofiler_path, hdp_outpath))
+        return
+    mut_vector, _ = read_matrix_labels(sigprofiler_path, 'sigprofiler')
+    catalog = infer_mutation_catalog(mut_vector)
+    if np.array_equal(mut_vector, catalog.sigprofiler_labels):
+        destination = catalog.sigprofiler_order
+    else:
+        missing = sorted(set(catalog.index) - set(mut_vector.tolist()))
+        if missing:
+            raise KeyError(f'{missing} not in the mutation types of {sigprofiler_path}')
+        destination = catalog.codes(mut_vector, default = -1)
+    with _scratch_dir(hdp_outpath) as tmpdir:
+        hdp, samples, hdp_mut_vector = transpose_matrix(sigprofiler_path, 'sigprofiler', tmpdir, destination=destination)
+        write_matrix(hdp_outpath, hdp, samples, hdp_mut_vector, 'hdp')
+        del hdp
+
+
+@profiled()
+def hdp_to_sigprofiler(hdp_path, sigprofiler_outpath, cache_dir=None):
+    """Convert HDP-compatible matrix to sigprofiler-compatible matrix. Unlike HDP, Sigprofiler sorts mutations alphabetically. This is only true for SNVs (any sequence context size),
+    DBS78 and ID83 matrices are put in COSMIC order.
+    Either matrix can be in the text or the binary (.npz) format. The matrix is transposed in blocks through a 
+    temporary file next to sigprofiler_outpath, keeping integer counts as integers
 
     Args:
         hdp_path (_type_): path to hdp matrix
         sigprofiler_outpath (_type_): path to sigprofiler matrix
+        cache_dir (path, optional): directory caching the result, see sigprofiler_to_hdp. Defaults to None (no cache).
     """
-    hdp = pd.read_csv(hdp_path, sep = '\t')
-    sigprofiler = hdp.transpose()
-    sigprofiler.sort_index(axis = 0, ascending = True, inplace = True)
-    sigprofiler.rename_axis('MutationType', inplace = True)
-    sigprofiler.reset_index(inplace = True)
-    sigprofiler.to_csv(sigprofiler_outpath, sep = '\t', index = False)
-
-
-def concat_sigprofiler_mutmats(mutmat_paths, outpath):
-    """concatenating a list of mutation matrix into one mutation matrix
+    if cache_dir is not None:
+        cached_call(cache_dir, 'hdp_to_sigprofiler', [hdp_path], sigprofiler_outpath, 
+                    lambda: hdp_to_sigprofiler(hdp_path, sigprofiler_outpath))
+        return
+    _, mut_vector = read_matrix_labels(hdp_path, 'hdp')
+    with _scratch_dir(sigprofiler_outpath) as tmpdir:
+        sigprofiler, mut_vector, samples = transpose_matrix(hdp_path, 'hdp', tmpdir, take=_sigprofiler_order(mut_vector))
+        write_matrix(sigprofiler_outpath, sigprofiler, mut_vector, samples, 'sigprofiler')
+        del sigprofiler
+
+
+def _sigprofiler_order(mut_vector):
+    """indices putting mutation types in SigProfiler order: alphabetical (precomputed for the contexts of gen_context), 
+    or COSMIC order for the DBS78 and ID83 classes"""
+    try:
+        catalog = infer_mutation_catalog(mut_vector)
+    except ValueError:
+        catalog = None
+    if catalog is not None and np.array_equal(mut_vector, catalog.labels):
+        return catalog.sigprofiler_order
+    if catalog is not None and not isinstance(catalog, ContextCatalog) and sorted(mut_vector.tolist()) == sorted(catalog.index):
+        position = {label: i for i, label in enumerate(mut_vector.tolist())}
+        return np.array([position[label] for label in catalog.sigprofiler_labels.tolist()], dtype=np.int64)
+    return np.argsort(mut_vector, kind = 'stable')
+
+
+def _scratch_dir(outpath):
+    """temporary directory next to an output file, for memory-mapped intermediate results"""
+    return tempfile.TemporaryDirectory(dir = os.path.dirname(os.path.abspath(outpath)))
+
+
+@profiled()
+def concat_sigprofiler_mutmats(mutmat_paths, outpath, streaming=False, cache_dir=None):
+    """concatenating a list of mutation matrix into one mutation matrix. 
+    The matrices can be in the text or the binary (.npz) format. Mutation types missing from a matrix are filled with NaN,
+    the samples of the matrices that are not missing any are still written as integers in text
+
+    with streaming=True only one input is held in memory at a time: the inputs are copied one by one into a 
+    memory-mapped file next to outpath, which is then written out. In that mode every input needs the same
+    mutation types as the first one (in any order) and a dtype that fits the one of the first input.
+    If any input is a sparse binary matrix, the inputs are concatenated as sparse counts instead (streaming is not needed then)
+    and a binary outpath gives a sparse matrix
 
     Args:
         mutmat_paths (list): list of paths to mutation matrices
         outpath: path to the output combined mutation matrix
+        streaming (bool, optional): bound memory by one input at a time. Defaults to False.
+        cache_dir (path, optional): directory caching the result, keyed by the content of the inputs in order 
+            (see result_cache.cached_call). Defaults to None (no cache).
 
     """
-    mutmats = [pd.read_csv(mutmat_path, sep = '\t') for mutmat_path in mutmat_paths]
-    mut_vector = mutmats[0]['MutationType'] # using the index from the first mutation matrix 
-    corrected_mutmats = []
-    for mutmat in mutmats:
-        mutmat = mutmat.set_index('MutationType', drop=True) 
-        mutmat = mutmat.reindex(mut_vector)
-        corrected_mutmats.append(mutmat)
-    combined_mutmat = pd.concat(corrected_mutmats, axis=1)
-    combined_mutmat = combined_mutmat.reset_index()
-    combined_mutmat.to_csv(outpath, sep = '\t', index = False)
+    if cache_dir is not None:
+        cached_call(cache_dir, 'concat_sigprofiler_mutmats', mutmat_paths, outpath, 
+                    lambda: concat_sigprofiler_mutmats(mutmat_paths, outpath, streaming=streaming), params={'streaming': streaming})
+        return
+    if any(is_sparse_matrix(mutmat_path) for mutmat_path in mutmat_paths):
+        streaming = False
+    if streaming:
+        _concat_sigprofiler_mutmats_streaming(mutmat_paths, outpath)
+        return
+    mut_vector = None # using the index from the first mutation matrix 
+    corrected_mutmats, samples, integer_columns = [], [], []
+    for mutmat_path in mutmat_paths:
+        counts, mutmat_vector, mutmat_samples = read_matrix(mutmat_path, 'sigprofiler', mmap=True)
+        if mut_vector is None:
+            mut_vector = mutmat_vector
+        with stage('reindex_rows', rows=len(mutmat_vector)):
+            corrected_mutmats.append(_reindex_rows(counts, mutmat_vector, mut_vector))
+        samples.extend(mutmat_samples)
+        # an input keeps its integer counts in text when it is not missing any mutation type, as with pandas
+        integer_columns.extend([corrected_mutmats[-1].dtype.kind in 'iu'] * len(mutmat_samples))
+    with stage('concatenate', rows=len(samples)):
+        if any(is_sparse(counts) for counts in corrected_mutmats):
+            combined_mutmat = hstack(corrected_mutmats)
+        else:
+            combined_mutmat = np.concatenate(corrected_mutmats, axis=1)
+    write_matrix(outpath, combined_mutmat, mut_vector, samples, 'sigprofiler', integer_columns=np.array(integer_columns, dtype=bool))
+
+
+def _concat_sigprofiler_mutmats_streaming(mutmat_paths, outpath):
+    samples = [read_matrix_labels(mutmat_path, 'sigprofiler')[1] for mutmat_path in mutmat_paths]
+    offsets = np.cumsum([0] + [len(mutmat_samples) for mutmat_samples in samples])
+    with _scratch_dir(outpath) as tmpdir:
+        combined_mutmat = mut_vector = None
+        for i, mutmat_path in enumerate(mutmat_paths):
+            counts, mutmat_vector, _ = read_matrix(mutmat_path, 'sigprofiler', mmap=True)
+            if combined_mutmat is None:
+                mut_vector = mutmat_vector # using the index from the first mutation matrix 
+                combined_mutmat = np.lib.format.open_memmap(os.path.join(tmpdir, 'combined.npy'), mode = 'w+', 
+                                                            dtype = counts.dtype, shape = (len(mut_vector), offsets[-1]))
+            if sorted(mutmat_vector) != sorted(mut_vector):
+                raise ValueError(f'mutation types of {mutmat_path} differ from those of {mutmat_paths[0]}')
+            if not np.can_cast(counts.dtype, combined_mutmat.dtype, casting = 'same_kind'):
+                raise ValueError(f'{mutmat_path} is of type {counts.dtype}, which does not fit {combined_mutmat.dtype} of {mutmat_paths[0]}')
+            with stage('reindex_rows', rows=len(mutmat_vector), path=str(mutmat_path)):
+                combined_mutmat[:, offsets[i]:offsets[i + 1]] = _reindex_rows(counts, mutmat_vector, mut_vector)
+            del counts
+        if combined_mutmat is None:
+            raise ValueError('no mutation matrix to concatenate')
+        combined_mutmat.flush()
+        write_matrix(outpath, combined_mutmat, mut_vector, np.concatenate(samples), 'sigprofiler')
+        del combined_mutmat
+
+
+def _reindex_rows(counts, rows, new_rows):
+    """reorder the rows of counts to new_rows, rows that are missing are filled with NaN"""
+    if np.array_equal(rows, new_rows):
+        return counts if is_sparse(counts) else np.asarray(counts)
+    index = {row: i for i, row in enumerate(rows)}
+    take = np.array([index.get(row, -1) for row in new_rows], dtype=np.int64)
+    if is_sparse(counts):
+        return counts.take_rows(take, fill_value = np.nan)
+    if np.all(take >= 0):
+        return counts[take]
+    reindexed = np.full((len(new_rows), counts.shape[1]), np.nan)
+    reindexed[take >= 0] = counts[take[take >= 0]]
+    return reindexed
 
 def get_arguments():
-    parser = argparse.ArgumentParser(description='Format mutation matrix')
-    subparsers = parser.add_subparsers(required=True, dest='cmd')
-    
-    # parser for sigprofiler_to_hdp
-    parser_sigprofiler_to_hdp_no_rearrangement = subparsers.add_parser('sigprofiler_to_hdp_no_rearrangement', help='convert tab delimited mutation matrix from sigprofiler format to hdp format (only works for trinucleotide SNV format), no rearrangement of rows/columns is performed')
-    parser_sigprofiler_to_hdp_no_rearrangement.add_argument('--sigprofiler_path', type=str, required=True, help='path to sigprofiler tab delimited file')
-    parser_sigprofiler_to_hdp_no_rearrangement.add_argument('--hdp_outpath', type=str, required=True, help='path to output hdp tab delimited file')
-    parser_sigprofiler_to_hdp_no_rearrangement.set_defaults(func=sigprofiler_to_hdp)
-    
-    # parser for sigprofiler_to_hdp
-    parser_sigprofiler_to_hdp = subparsers.add_parser('sigprofiler_to_hdp', help='convert tab delimited mutation matrix from sigprofiler format to hdp format (only works for trinucleotide SNV format)')
-    parser_sigprofiler_to_hdp.add_argument('--sigprofiler_path', type=str, required=True, help='path to sigprofiler tab delimited file')
-    parser_sigprofiler_to_hdp.add_argument('--hdp_outpath', type=str, required=True, help='path to output hdp tab delimited file')
-    parser_sigprofiler_to_hdp.set_defaults(func=sigprofiler_to_hdp)
-    
-    # parser for hdp_to_sigprofiler
-    parser_hdp_to_sigprofiler = subparsers.add_parser('hdp_to_sigprofiler', help='convert tab delimited mutation matrix from hdp format to sigprofiler format (only works for SNVs)')
-    parser_hdp_to_sigprofiler.add_argument('--hdp_path', type=str, required=True, help='path to hdp tab delimited file')
-    parser_hdp_to_sigprofiler.add_argument('--sigprofiler_outpath', type=str, required=True, help='path to output sigprofiler tab delimited file')
-    parser_hdp_to_sigprofiler.set_defaults(func=hdp_to_sigprofiler)
-    
-    # parser for concat_sigprofiler_mutmats
-    parser_concat_sigprofiler_mutmats = subparsers.add_parser('concat_sigprofiler_mutmats', help = 'concatenated multiple mutation matrix files to one')
-    parser_concat_sigprofiler_mutmats.add_argument('--mutmats', nargs='+', help='paths to mutation matrices', required=True)
-    parser_concat_sigprofiler_mutmats.add_argument('--outpath', type = str, required = True, help='path to resulting combined matrix')
-    parser_concat_sigprofiler_mutmats.set_defaults(func=concat_sigprofiler_mutmats)
-    
-    return parser
-
+    return cli.get_arguments()
 
 
 def main():
-    args = get_arguments().parse_args()
-    if args.cmd == 'sigprofiler_to_hdp_no_rearrangement':
-        sigprofiler_to_hdp_no_rearrangement(args.sigprofiler_path, args.hdp_outpath)
-    if args.cmd == 'sigprofiler_to_hdp':
-        sigprofiler_to_hdp(args.sigprofiler_path, args.hdp_outpath)
-    if args.cmd == 'hdp_to_sigprofiler':
-        hdp_to_sigprofiler(args.hdp_path, args.sigprofiler_outpath)
-    if args.cmd == 'concat_sigprofiler_mutmats':
-        concat_sigprofiler_mutmats(args.mutmats, args.outpath)
-    
+    return cli.main()
+
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
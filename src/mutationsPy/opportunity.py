@@ -0,0 +1,177 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mutationsPy.encode_context import BASE_CODES, context_catalog, reverse_complement_table, wt_seq_table, _check_kmer
+from mutationsPy.matrix_io import write_matrix
+from mutationsPy.profiling import profiled
+from mutationsPy.read_file import FastaReference, read_bed
+from mutationsPy.result_cache import cache_key
+
+# number of bases hashed at a time, bounds the memory of count_kmers to a few times this many int64
+KMER_BLOCK_SIZE = 2 ** 22
+
+
+@profiled()
+def count_kmers(reference, kmer=3, regions=None, n_jobs=1, cache_dir=None):
+    """count the kmer sequences of a reference genome, over the whole genome or over a set of regions
+
+    contigs are streamed a block at a time through the memory-mapped reference and every window is hashed into
+    a base-4 code (as encode_seqs does) with 2-bit shifts, so the counts come from one np.bincount per block.
+    Windows containing a base other than A, C, G or T are not counted. With regions, a kmer is counted if its
+    central base lies in a region, its flanks can reach outside of it. Contigs are counted in parallel on a process pool
+
+    Args:
+        reference (path or FastaReference): reference genome, indexed on the fly if no .fai index is present
+        kmer (int, optional): kmer size. Defaults to 3.
+        regions (path or dict, optional): BED file or the output of read_bed. Defaults to None (whole genome).
+        n_jobs (int, optional): number of worker processes, None for one per CPU. Defaults to 1 (no pool).
+        cache_dir (path, optional): directory caching the counts, keyed by the checksum of the reference file,
+            the regions, kmer and the version of the package. Defaults to None (no cache).
+
+    Raises:
+        KeyError: a region is on a chromosome that is not in the reference genome
+
+    Returns:
+        np.array: counts (int64) of the 4**kmer sequences, indexed by their encode_seqs code
+    """
+    _check_kmer(kmer)
+    if not isinstance(reference, FastaReference):
+        reference = FastaReference(reference)
+    if regions is not None and not isinstance(regions, dict):
+        regions = read_bed(regions)
+    if regions is None:
+        regions = {contig: (np.array([0]), np.array([reference.length(contig)])) for contig in reference.contigs}
+    for contig in regions:
+        reference.length(contig)
+    cache_path = None
+    if cache_dir is not None:
+        # the checksum of the reference is remembered for its path, size, modification time and inode
+        key = cache_key('count_kmers', [reference.fasta], 'kmers.npy', {'kmer': kmer, 'regions': _regions_checksum(regions)}, cache_dir)
+        cache_path = os.path.join(cache_dir, f'kmers_{kmer}_{key}.npy')
+        if os.path.exists(cache_path):
+            return np.load(cache_path)
+    tasks = [(contig, starts, ends) for contig, (starts, ends) in regions.items() if len(starts)]
+    if n_jobs == 1 or len(tasks) <= 1:
+        results = [_count_contig(reference, contig, starts, ends, kmer) for contig, starts, ends in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_count_contig, reference, contig, starts, ends, kmer) for contig, starts, ends in tasks]
+            results = [future.result() for future in futures]
+    counts = np.sum(results, axis=0, dtype=np.int64) if results else np.zeros(4 ** kmer, dtype=np.int64)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = f'{cache_path}.{os.getpid()}.tmp.npy'
+        np.save(temporary, counts)
+        os.replace(temporary, cache_path) # other processes only ever see a complete file
+    return counts
+
+
+def context_opportunities(reference, kmer=3, symmetric=True, regions=None, n_jobs=1, cache_dir=None):
+    """mutational opportunities of the contexts of gen_context(kmer, symmetric): the number of times the wildtype
+    sequence of each context occurs in the reference, see count_kmers. Symmetric contexts also count the reverse
+    complement of their sequence (eg A[C>T]G counts both ACG and CGT), so opportunities fold as symmetrise_context does
+
+    Args:
+        reference (path or FastaReference): reference genome
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+        regions (path or dict, optional): BED file or the output of read_bed. Defaults to None (whole genome).
+        n_jobs (int, optional): number of worker processes, None for one per CPU. Defaults to 1 (no pool).
+        cache_dir (path, optional): directory caching the kmer counts. Defaults to None (no cache).
+
+    Returns:
+        np.array: opportunities (int64) in the order of gen_context(kmer, symmetric)
+    """
+    return fold_opportunities(count_kmers(reference, kmer, regions=regions, n_jobs=n_jobs, cache_dir=cache_dir), kmer, symmetric)
+
+
+def fold_opportunities(kmer_counts, kmer=3, symmetric=True):
+    """opportunities of the contexts of gen_context(kmer, symmetric) from kmer sequence counts, see context_opportunities
+
+    Args:
+        kmer_counts (np.array): counts of the 4**kmer sequences, indexed by their encode_seqs code
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+
+    Returns:
+        np.array: opportunities in the order of gen_context(kmer, symmetric)
+    """
+    kmer_counts = np.asarray(kmer_counts)
+    wt_seqs = wt_seq_table(kmer, symmetric)
+    if not symmetric:
+        return kmer_counts[wt_seqs]
+    return kmer_counts[wt_seqs] + kmer_counts[reverse_complement_table(kmer)[wt_seqs]]
+
+
+def write_opportunities(outpath, opportunities, kmer=3, symmetric=True):
+    """write context opportunities as a one column sigprofiler matrix (mutation types sorted alphabetically)
+
+    Args:
+        outpath (path): path to output, binary if it ends with .npz
+        opportunities (np.array): opportunities in the order of gen_context(kmer, symmetric)
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+    """
+    catalog = context_catalog(kmer, symmetric)
+    write_matrix(outpath, catalog.to_sigprofiler(np.asarray(opportunities))[:, None], catalog.sigprofiler_labels, ['opportunities'], 'sigprofiler')
+
+
+@profiled()
+def count_opportunities(fasta, outpath, kmer=3, symmetric=True, bed=None, n_jobs=1, cache_dir=None):
+    """count the context opportunities of a reference genome (see context_opportunities) and write them out
+
+    Args:
+        fasta (path): path to the reference genome
+        outpath (path): path to output, binary if it ends with .npz
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+        bed (path, optional): BED file of the regions to count over. Defaults to None (whole genome).
+        n_jobs (int, optional): number of worker processes. Defaults to 1.
+        cache_dir (path, optional): directory caching the kmer counts. Defaults to None (no cache).
+    """
+    opportunities = context_opportunities(fasta, kmer, symmetric, regions=bed, n_jobs=n_jobs, cache_dir=cache_dir)
+    write_opportunities(outpath, opportunities, kmer, symmetric)
+
+
+def _count_contig(reference, contig, starts, ends, kmer):
+    """kmer counts of the windows centred in the given regions of one contig"""
+    flank_size = kmer // 2
+    length = reference.length(contig)
+    counts = np.zeros(4 ** kmer, dtype=np.int64)
+    step = max(KMER_BLOCK_SIZE, kmer)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        # centres of complete windows only
+        start, end = max(start, flank_size), min(end, length - flank_size)
+        for block_start in range(start, end, step):
+            block_end = min(block_start + step, end)
+            bases = BASE_CODES[np.frombuffer(reference.fetch_bytes(contig, block_start - flank_size, block_end + flank_size), dtype=np.uint8)]
+            counts += _kmer_counts(bases, kmer)
+    return counts
+
+
+def _kmer_counts(bases, kmer):
+    """counts of the kmer codes of all windows of a block of 2-bit base codes (4 for other bases)"""
+    n_windows = len(bases) - kmer + 1
+    if n_windows <= 0:
+        return np.zeros(4 ** kmer, dtype=np.int64)
+    codes = np.zeros(n_windows, dtype=np.int64)
+    for i in range(kmer):
+        codes <<= 2
+        codes |= bases[i:i + n_windows] & 3
+    # windows without other bases: no change in the running count of other bases across the window
+    other = np.r_[0, np.cumsum(bases > 3)]
+    valid = other[kmer:] == other[:n_windows]
+    return np.bincount(codes[valid], minlength=4 ** kmer)
+
+
+def _regions_checksum(regions):
+    """checksum of a set of regions, independent of the order of the chromosomes"""
+    digest = hashlib.blake2b(digest_size=16)
+    for contig in sorted(regions):
+        starts, ends = regions[contig]
+        digest.update(contig.encode() + b'\0')
+        digest.update(np.asarray(starts, dtype=np.int64).tobytes() + np.asarray(ends, dtype=np.int64).tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,221 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows, peak RSS is then not reported
+    resource = None
+
+# environment variable enabling profiling, its value is where records go (a path, or '-' for stderr).
+# It is read at every stage, so setting it after import enables profiling as well
+PROFILE_ENV = 'MUTATIONSPY_PROFILE'
+
+_lock = threading.Lock()
+_local = threading.local()
+# stages of any thread that are running, whose peak resident memory is folded in before the high-water mark is reset
+_open_stages = set()
+_memory_lock = threading.Lock()
+_process_peak = 0.0
+_can_reset_peak = True
+
+
+def enable_profiling(destination='-'):
+    """record the stages of the following calls as JSON lines, see stage
+
+    this sets the environment variable, so that worker processes started afterwards also record their stages
+
+    Args:
+        destination (path, optional): file the records are appended to, '-' for stderr. Defaults to '-'.
+    """
+    os.environ[PROFILE_ENV] = destination
+
+
+def disable_profiling():
+    os.environ.pop(PROFILE_ENV, None)
+
+
+def profiling_enabled():
+    return _destination() is not None
+
+
+def stage(name, rows=None, **fields):
+    """context manager timing a stage of a run, written out as one JSON line when the stage ends:
+    {"stage", "parent", "seconds", "rows", "rows_per_second", "rss_start_mb", "rss_end_mb", "peak_rss_mb",
+     "process_peak_rss_mb", "pid", **fields}
+
+    rss_start_mb and rss_end_mb are the resident memory of the process when the stage starts and ends, peak_rss_mb
+    the highest resident memory of the process while the stage ran (with other stages running on other threads, their
+    memory counts as well). On Linux the kernel high-water mark (VmHWM) is reset through /proc/self/clear_refs at the start
+    of each stage, after folding it into the peaks of the stages still running. These are None where not available.
+    process_peak_rss_mb is the peak resident memory of the process since it started.
+    rows can be given upfront or counted inside the stage with add_rows. When profiling is off a shared no-op stage
+    is returned, so instrumented code pays one function call per stage
+
+    Args:
+        name (str): name of the stage
+        rows (int, optional): number of rows processed. Defaults to None (counted with add_rows, if at all).
+        **fields: extra JSON serialisable values written with the record, eg the input path
+
+    Returns:
+        context manager, whose value has add_rows(n)
+    """
+    if _destination() is None:
+        return _NULL_STAGE
+    return _Stage(name, rows, fields)
+
+
+def profiled(name=None):
+    """decorator running a function as a stage (named after the function by default), see stage"""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _destination() is None:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, None, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def rss_mb():
+    """current resident memory of this process in MB, None where it is not available (read from /proc on Linux)"""
+    try:
+        with open('/proc/self/statm', 'rb') as file:
+            pages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def peak_rss_mb():
+    """peak resident memory of this process since it started in MB, None where it is not available"""
+    peaks = [_process_peak, rss_mb() or 0.0]
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        peaks.append(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10)
+    return max(peaks) or None
+
+
+class _Stage:
+    def __init__(self, name, rows, fields):
+        self.name = name
+        self.rows = rows
+        self.fields = fields
+
+    def add_rows(self, n):
+        self.rows = (self.rows or 0) + int(n)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.rss_start = rss_mb()
+        _start_peak(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        _local.stack.pop()
+        rss_end = rss_mb()
+        peak = _end_peak(self)
+        rows_per_second = self.rows / seconds if self.rows is not None and seconds > 0 else None
+        record = {'stage': self.name, 'parent': self.parent, 'seconds': round(seconds, 6), 'rows': self.rows,
+                  'rows_per_second': rows_per_second, 'rss_start_mb': self.rss_start, 'rss_end_mb': rss_end,
+                  'peak_rss_mb': None if peak is None else max(peak, rss_end or 0.0), 
+                  'process_peak_rss_mb': peak_rss_mb(), 'pid': os.getpid()}
+        if exc_info[0] is not None:
+            record['error'] = exc_info[0].__name__
+        record.update(self.fields)
+        _write_record(record)
+        return False
+
+
+class _NullStage:
+    def add_rows(self, n):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _high_water_mb():
+    """peak resident memory of this process since the high-water mark was last reset in MB, None where it is not available"""
+    try:
+        with open('/proc/self/status', 'rb') as file:
+            for line in file:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def _fold_high_water():
+    """raise the peaks of the running stages and of the process to the high-water mark, returns it"""
+    global _process_peak
+    high_water = _high_water_mb()
+    if high_water is not None:
+        _process_peak = max(_process_peak, high_water)
+        for running in _open_stages:
+            if running.peak is not None:
+                running.peak = max(running.peak, high_water)
+    return high_water
+
+
+def _start_peak(new_stage):
+    """reset the high-water mark for a stage that starts, its peak stays None if it cannot be tracked"""
+    global _can_reset_peak
+    with _memory_lock:
+        peak = None
+        if _can_reset_peak and _fold_high_water() is not None:
+            try:
+                with open('/proc/self/clear_refs', 'w') as file:
+                    file.write('5')
+                peak = rss_mb()
+            except OSError: # the mark would include the memory of earlier stages
+                _can_reset_peak = False
+        new_stage.peak = peak
+        _open_stages.add(new_stage)
+
+
+def _end_peak(ended_stage):
+    """peak resident memory of a stage that ends, None if it could not be tracked"""
+    with _memory_lock:
+        _fold_high_water()
+        _open_stages.discard(ended_stage)
+        return ended_stage.peak
+
+
+def _destination():
+    return os.environ.get(PROFILE_ENV) or None
+
+
+def _write_record(record):
+    destination = _destination()
+    if destination is None:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    with _lock:
+        if destination == '-':
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            # appended and closed line by line, so that records of several processes interleave whole lines
+            with open(destination, 'a') as file:
+                file.write(line)
@@ -1,5 +1,29 @@
+import gzip
+import mmap
+import os
+
+import numpy as np
 import pandas as pd
 
+_UPPER_CODES = np.arange(256, dtype=np.uint8)
+_UPPER_CODES[ord('a'):ord('z') + 1] -= 32
+_UPPER_BYTES = _UPPER_CODES.tobytes()
+
+def sample_name(vcf):
+    """default sample name of a VCF file: the file name without directory and extensions (eg sample1.vcf.gz -> sample1)
+
+    Args:
+        vcf (path): path to VCF format file
+
+    Returns:
+        str: sample name
+    """
+    name = os.path.basename(vcf)
+    for extension in ('.gz', '.bgz'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return os.path.splitext(name)[0]
+
 def read_vcf(vcf, pos_colname='POS', sep ='\t', **kwargs):
     """Read VCF format files, adjust the position so that it is 0-based indexing
 
@@ -15,9 +39,78 @@ def read_vcf(vcf, pos_colname='POS', sep ='\t', **kwargs):
     dt[pos_colname] = dt[pos_colname] - 1
     return dt
 
+def read_vcf_chunks(vcf, chunksize=100_000, pos_colname='POS', sep='\t', **kwargs):
+    """Read VCF format files chunk by chunk, adjusting the positions to 0-based indexing as read_vcf does
+
+    "##" meta lines are skipped and a leading "#" is removed from the header (eg #CHROM becomes CHROM),
+    so both VCFs and plain tab delimited mutation tables can be streamed. Gzip/bgzip compressed files are supported.
+
+    Args:
+        vcf (path): path to VCF format file
+        chunksize (int, optional): number of rows per chunk. Defaults to 100_000.
+        pos_colname (str, optional): name of the column that contains mutation positions. Defaults to 'POS'.
+        sep (str, optional): delimiter of VCF file. Defaults to '\t'.
+
+    Yields:
+        dataframes of VCF format with 0-based indexing
+    """
+    n_meta = 0
+    header = None
+    with _open_text(vcf) as file:
+        for line in file:
+            if not line.startswith('##'):
+                header = line.rstrip('\r\n').lstrip('#').split(sep)
+                break
+            n_meta += 1
+    if header is None:
+        return
+    with pd.read_csv(vcf, sep = sep, skiprows = n_meta + 1, header = None, names = header, chunksize = chunksize, **kwargs) as reader:
+        for dt in reader:
+            dt[pos_colname] = dt[pos_colname] - 1
+            yield dt
+
+def read_bed(bed):
+    """Read the regions of a BED file, merging overlapping and adjacent regions of each chromosome
+
+    "track", "browser" and "#" lines are skipped, only the first three columns are used and coordinates stay 0-based half-open.
+    Gzip compressed files are supported.
+
+    Args:
+        bed (path): path to BED file
+
+    Returns:
+        dict: chromosome -> (starts, ends) np.arrays of sorted, non-overlapping regions, in the order of the file
+    """
+    regions = {}
+    with _open_text(bed) as file:
+        for line in file:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            chrom, start, end = line.split('\t')[:3]
+            regions.setdefault(chrom, []).append((int(start), int(end)))
+    merged = {}
+    for chrom, intervals in regions.items():
+        intervals = np.array(sorted(intervals), dtype=np.int64).reshape(-1, 2)
+        # a region starts a new merged block if it begins after every region before it has ended
+        new_block = np.r_[True, intervals[1:, 0] > np.maximum.accumulate(intervals[:-1, 1])]
+        blocks = np.cumsum(new_block) - 1
+        ends = np.zeros(blocks[-1] + 1, dtype=np.int64)
+        np.maximum.at(ends, blocks, intervals[:, 1])
+        merged[chrom] = (intervals[new_block, 0], ends)
+    return merged
+
+def _open_text(path):
+    """open a plain or gzip compressed text file"""
+    with open(path, 'rb') as file:
+        compressed = file.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rt') if compressed else open(path)
+
 def extract_seq_from_fasta(fasta, identifier):
     """get one sequence from fasta file based on the identifier
 
+    if an up-to-date .fai index sits next to the fasta file the sequence is read through it,
+    otherwise the file is scanned line by line. Use FastaReference for repeated lookups.
+
     Args:
         fasta (path): path to fasta file
         identifier (str): identifier of the sequence (without the ">")
@@ -25,11 +118,16 @@ def extract_seq_from_fasta(fasta, identifier):
     Returns:
         an uppercase sequence 
     """
+    fai = fasta + '.fai'
+    if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(fasta):
+        with FastaReference(fasta, fai) as reference:
+            if identifier in reference:
+                return reference.fetch(identifier)
     started = False 
     seqs = []
     identifier = '>' + identifier
     with open(fasta) as file:
-        for line in file.readlines():
+        for line in file:
             if not line.strip(): # skip if line is empty
                 continue
             if line.split()[0] == identifier:
@@ -40,4 +138,305 @@ def extract_seq_from_fasta(fasta, identifier):
                 else:
                     if line.split()[0] != identifier:
                         seqs.append(line.strip('\n').strip())
-    return ''.join(seqs).upper()
\ No newline at end of file
+    return ''.join(seqs).upper()
+
+def index_fasta(fasta, fai=None):
+    """build a samtools-style .fai index for a fasta file
+
+    every sequence has to be wrapped with the same number of bases per line (except the last line),
+    which is what samtools faidx requires as well
+
+    Args:
+        fasta (path): path to fasta file
+        fai (path, optional): path to the output index. Defaults to fasta + '.fai'.
+
+    Raises:
+        ValueError: sequence lines of a record are not of uniform length
+
+    Returns:
+        dict: identifier -> (length, offset, linebases, linewidth), in the order found in the fasta file
+    """
+    fai = fasta + '.fai' if fai is None else fai
+    index = _build_index(fasta)
+    _write_index(index, fai)
+    return index
+
+
+def _write_index(index, fai):
+    with open(fai, 'w') as file:
+        for identifier, (length, offset, linebases, linewidth) in index.items():
+            file.write(f'{identifier}\t{length}\t{offset}\t{linebases}\t{linewidth}\n')
+
+
+def _build_index(fasta):
+    """index of a fasta file as index_fasta returns it, without writing it out"""
+    index = {}
+    with open(fasta, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            mm = b''
+        else:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header_start = mm.find(b'>')
+            while header_start != -1:
+                header_end = mm.find(b'\n', header_start)
+                header_end = len(mm) if header_end == -1 else header_end
+                identifier = mm[header_start + 1:header_end].split()[0].decode()
+                seq_start = min(header_end + 1, len(mm))
+                next_header = mm.find(b'\n>', header_end)
+                seq_end = len(mm) if next_header == -1 else next_header + 1
+                index[identifier] = _index_record(mm, identifier, seq_start, seq_end)
+                header_start = -1 if next_header == -1 else next_header + 1
+        finally:
+            if isinstance(mm, mmap.mmap):
+                mm.close()
+    return index
+
+
+def _index_record(mm, identifier, seq_start, seq_end):
+    """work out (length, offset, linebases, linewidth) of one fasta record spanning mm[seq_start:seq_end]"""
+    seq = np.frombuffer(mm, dtype=np.uint8, count=seq_end - seq_start, offset=seq_start) if seq_end > seq_start else np.empty(0, dtype=np.uint8)
+    record = _index_lines(seq, seq_start)
+    del seq # release the view so that the memory map can be closed
+    if record is None:
+        raise ValueError(f'lines of sequence {identifier} are not of uniform length, cannot index the fasta file')
+    return record
+
+
+def _index_lines(seq, seq_start):
+    """(length, offset, linebases, linewidth) of a record, None if its lines are not of uniform length"""
+    newlines = np.flatnonzero(seq == ord('\n'))
+    if newlines.size == 0 or newlines[-1] != seq.size - 1:
+        newlines = np.append(newlines, seq.size) # last line without a newline
+    carriage_returns = (newlines > 0) & (seq[np.maximum(newlines - 1, 0)] == ord('\r'))
+    line_ends = newlines - carriage_returns
+    line_starts = np.concatenate(([0], newlines[:-1] + 1))
+    line_lengths = line_ends - line_starts
+    # trailing empty lines (eg before the next record) are allowed
+    non_empty = np.flatnonzero(line_lengths > 0)
+    n_lines = non_empty[-1] + 1 if non_empty.size else 0
+    if n_lines == 0:
+        return 0, seq_start, 0, 0
+    linebases = int(line_lengths[0])
+    linewidth = int(newlines[0]) + 1
+    if (np.any(line_lengths[:n_lines - 1] != linebases) or line_lengths[n_lines - 1] > linebases
+            or np.any(line_starts[:n_lines] != np.arange(n_lines) * linewidth)):
+        return None
+    length = int(line_lengths[:n_lines].sum())
+    return length, seq_start, linebases, linewidth
+
+
+def read_fasta_index(fai):
+    """read a samtools-style .fai index
+
+    Args:
+        fai (path): path to the index
+
+    Returns:
+        dict: identifier -> (length, offset, linebases, linewidth), in the order found in the index
+    """
+    index = {}
+    with open(fai) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            identifier, length, offset, linebases, linewidth = line.split('\t')[:5]
+            index[identifier] = (int(length), int(offset), int(linebases), int(linewidth))
+    return index
+
+
+class FastaReference:
+    """memory-mapped access to an indexed fasta file
+
+    the .fai index is reused if it exists and is newer than the fasta file, otherwise it is (re)built. If the index
+    cannot be written (eg the fasta file is in a read-only directory) it is only kept in memory, and carried along
+    when the reference is pickled.
+    Sequences are served as uppercase strings straight from the memory-mapped file, so fetching a flank
+    around a position does not read the rest of the genome. Pickling only carries the paths,
+    a copy in another process maps the same file again and shares the OS page cache.
+
+    Args:
+        fasta (path): path to fasta file
+        fai (path, optional): path to the index. Defaults to fasta + '.fai'.
+    """
+
+    def __init__(self, fasta, fai=None):
+        fai = fasta + '.fai' if fai is None else fai
+        saved = True
+        if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(fasta):
+            index = read_fasta_index(fai)
+        else:
+            index = _build_index(fasta)
+            try:
+                _write_index(index, fai)
+            except OSError:
+                saved = False
+        self._open(fasta, fai, index, saved)
+
+    def _open(self, fasta, fai, index, saved):
+        self.fasta = fasta
+        self.fai = fai
+        self.index = index
+        self._saved_index = saved
+        self._file = open(self.fasta, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._mm = b''
+        else:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = np.frombuffer(self._mm, dtype=np.uint8)
+
+    def __getstate__(self):
+        return {'fasta': self.fasta, 'fai': self.fai, 'index': None if self._saved_index else self.index}
+
+    def __setstate__(self, state):
+        if state.get('index') is None:
+            self.__init__(state['fasta'], state['fai'])
+        else: # an index that could not be written is not built again
+            self._open(state['fasta'], state['fai'], state['index'], saved=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """release the memory map and the file handle"""
+        self._buffer = None
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    @property
+    def contigs(self):
+        """list of sequence identifiers in the order of the fasta file"""
+        return list(self.index)
+
+    def __contains__(self, identifier):
+        return identifier in self.index
+
+    def __getitem__(self, identifier):
+        return self.contig(identifier)
+
+    def length(self, identifier):
+        """length of a sequence
+
+        Args:
+            identifier (str): identifier of the sequence (without the ">")
+
+        Returns:
+            int: number of bases
+        """
+        return self._record(identifier)[0]
+
+    def contig(self, identifier):
+        """get a lazy handle to one sequence, nothing is read until it is sliced
+
+        Args:
+            identifier (str): identifier of the sequence (without the ">")
+
+        Returns:
+            Contig: sequence that supports len(), indexing and slicing like a string
+        """
+        self._record(identifier)
+        return Contig(self, identifier)
+
+    def fetch(self, identifier, start=0, end=None):
+        """get an uppercase subsequence, with 0-based half-open coordinates
+
+        Args:
+            identifier (str): identifier of the sequence (without the ">")
+            start (int, optional): start position (0-based, inclusive). Defaults to 0.
+            end (int, optional): end position (0-based, exclusive). Defaults to the end of the sequence.
+
+        Returns:
+            str: uppercase sequence
+        """
+        return self.fetch_bytes(identifier, start, end).decode()
+
+    def fetch_bytes(self, identifier, start=0, end=None):
+        """same as fetch but returning ASCII bytes
+
+        Args:
+            identifier (str): identifier of the sequence (without the ">")
+            start (int, optional): start position (0-based, inclusive). Defaults to 0.
+            end (int, optional): end position (0-based, exclusive). Defaults to the end of the sequence.
+
+        Returns:
+            bytes: uppercase sequence
+        """
+        length = self._record(identifier)[0]
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+        if start >= end:
+            return b''
+        first = self._offset(identifier, start)
+        last = self._offset(identifier, end - 1)
+        return self._mm[first:last + 1].translate(_UPPER_BYTES, b'\r\n')
+
+    def bases(self, identifier, positions):
+        """get the uppercase bases at an array of positions with one vectorised lookup into the memory map
+
+        Args:
+            identifier (str): identifier of the sequence (without the ">")
+            positions (np.array convertible): 0-based positions, all within the sequence
+
+        Raises:
+            IndexError: a position is outside the sequence
+
+        Returns:
+            np.array: ASCII codes (uint8) of the bases
+        """
+        length = self._record(identifier)[0]
+        positions = np.asarray(positions, dtype=np.int64)
+        if positions.size and (positions.min() < 0 or positions.max() >= length):
+            raise IndexError(f'positions outside of sequence {identifier} of length {length}')
+        return _UPPER_CODES[self._buffer[self._offset(identifier, positions)]]
+
+    def _offset(self, identifier, positions):
+        _, offset, linebases, linewidth = self.index[identifier]
+        return offset + (positions // linebases) * linewidth + positions % linebases
+
+    def _record(self, identifier):
+        if identifier not in self.index:
+            raise KeyError(f'sequence {identifier} not found in {self.fasta}')
+        return self.index[identifier]
+
+
+class Contig:
+    """lazy view of one sequence of a FastaReference, behaves like an uppercase string for len(), indexing and slicing
+
+    Args:
+        reference (FastaReference): indexed fasta file
+        identifier (str): identifier of the sequence (without the ">")
+    """
+
+    def __init__(self, reference, identifier):
+        self.reference = reference
+        self.identifier = identifier
+
+    def __len__(self):
+        return self.reference.length(self.identifier)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self.reference.fetch(self.identifier, start, stop)
+            positions = np.arange(start, stop, step)
+            return self.bases(positions).tobytes().decode()
+        length = len(self)
+        pos = key + length if key < 0 else key
+        if pos < 0 or pos >= length:
+            raise IndexError('sequence index out of range')
+        return self.reference.fetch(self.identifier, pos, pos + 1)
+
+    def __str__(self):
+        return self.reference.fetch(self.identifier)
+
+    def __repr__(self):
+        return f'Contig({self.identifier!r}, length={len(self)})'
+
+    def bases(self, positions):
+        """get the uppercase bases (ASCII codes) at an array of positions, see FastaReference.bases"""
+        return self.reference.bases(self.identifier, positions)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+
+try:
+    import fcntl
+except ImportError: # not available on Windows, eviction is then not serialised across processes
+    fcntl = None
+
+from mutationsPy.profiling import stage
+
+# size the results of a cache directory are evicted down to, least recently used first
+DEFAULT_MAX_BYTES = 4 * 2 ** 30
+# environment variable overriding DEFAULT_MAX_BYTES, in MB
+CACHE_MAX_MB_ENV = 'MUTATIONSPY_CACHE_MAX_MB'
+# age after which a temporary file is taken to be left behind by a writer that was killed, and evicted
+STALE_TEMPORARY_SECONDS = 24 * 3600
+
+try:
+    _VERSION = version('mutationsPy')
+except PackageNotFoundError:
+    _VERSION = 'unknown'
+
+
+def file_checksum(path):
+    """blake2b checksum of a file, read a block at a time"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(2 ** 24), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(name, input_paths, outpath, params=None, cache_dir=None):
+    """key of a result: the name of the function, the checksums of its inputs (in order), its parameters,
+    the format of its output (from the extension of outpath) and the version of the package
+
+    with a cache_dir, the checksum of each input is remembered for its path, size, modification time and inode,
+    so that unchanged inputs (eg a reference genome) are not read again
+
+    Args:
+        name (str): name of the function computing the result
+        input_paths (list): paths to the input files
+        outpath (path): path to the output file
+        params (dict, optional): JSON serialisable parameters the result depends on. Defaults to None.
+        cache_dir (path, optional): directory of the cache. Defaults to None (inputs are always read).
+
+    Returns:
+        str: hex digest
+    """
+    checksums = [_input_checksum(path, cache_dir) for path in input_paths]
+    description = {'name': name, 'inputs': checksums, 'params': params or {}, 'binary': str(outpath).endswith('.npz'),
+                   'version': _VERSION}
+    return hashlib.blake2b(json.dumps(description, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+def cached_call(cache_dir, name, input_paths, outpath, compute, params=None, max_bytes=None):
+    """write outpath from the cache if the same function was run on inputs of the same content with the same parameters,
+    otherwise run compute and store its output
+
+    results are stored as written by compute (a binary .npz matrix is copied back as is) under cache_dir/results.
+    They are written to a temporary file and renamed, so other processes only ever see complete results, and a hit
+    is copied to a temporary file next to outpath and renamed the same way, so an interrupted copy never leaves a
+    truncated outpath. A hit marks its result as recently used. After a result is stored the least recently used files
+    of the cache (results and remembered checksums) are evicted until they take at most max_bytes, holding a lock on
+    the cache so that several processes can share it.
+
+    Args:
+        cache_dir (path): directory of the cache, created if needed
+        name (str): name of the function computing the result
+        input_paths (list): paths to the input files
+        outpath (path): path to the output file
+        compute (callable): writes outpath when called without arguments
+        params (dict, optional): JSON serialisable parameters the result depends on. Defaults to None.
+        max_bytes (int, optional): size limit of the cache. Defaults to None, MUTATIONSPY_CACHE_MAX_MB megabytes if it is set,
+            otherwise DEFAULT_MAX_BYTES (4 GB).
+
+    Returns:
+        bool: whether the result came from the cache
+    """
+    results = os.path.join(cache_dir, 'results')
+    os.makedirs(results, exist_ok=True)
+    with stage('cache_key', function=name):
+        key = cache_key(name, input_paths, outpath, params, cache_dir)
+    entry = os.path.join(results, key + ('.npz' if str(outpath).endswith('.npz') else '.txt'))
+    temporary = f'{outpath}.{os.getpid()}.tmp'
+    try:
+        with open(entry, 'rb') as cached:
+            # an open entry stays readable if another process evicts it meanwhile
+            try:
+                with open(temporary, 'wb') as out:
+                    shutil.copyfileobj(cached, out, 2 ** 24)
+                os.replace(temporary, outpath)
+            finally:
+                if os.path.exists(temporary): # the copy was interrupted
+                    os.remove(temporary)
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            pass
+        return True
+    compute()
+    temporary = f'{entry}.{os.getpid()}.tmp'
+    shutil.copyfile(outpath, temporary)
+    os.replace(temporary, entry)
+    if max_bytes is None:
+        max_mb = os.environ.get(CACHE_MAX_MB_ENV)
+        max_bytes = int(float(max_mb) * 2 ** 20) if max_mb else DEFAULT_MAX_BYTES
+    evict(cache_dir, max_bytes)
+    return False
+
+
+def evict(cache_dir, max_bytes):
+    """remove the least recently used files of a cache, results and remembered checksums, until they take at most max_bytes.
+    Temporary files older than STALE_TEMPORARY_SECONDS, left behind by writers that did not finish, are removed as well
+
+    Args:
+        cache_dir (path): directory of the cache
+        max_bytes (int): size limit of the cache
+
+    Returns:
+        int: number of files removed, stale temporary files included
+    """
+    with _locked(cache_dir):
+        entries, removed = [], 0
+        stale = time.time_ns() - STALE_TEMPORARY_SECONDS * 10 ** 9
+        for directory in ['results', 'checksums']:
+            try:
+                listing = list(os.scandir(os.path.join(cache_dir, directory)))
+            except FileNotFoundError:
+                continue
+            for entry in listing:
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if not entry.name.endswith('.tmp'):
+                    entries.append((info.st_mtime_ns, info.st_size, entry.path))
+                elif info.st_mtime_ns < stale:
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+    return removed
+
+
+def _input_checksum(path, cache_dir):
+    """file_checksum of an input, remembered under cache_dir/checksums for its path, size, modification time and inode
+    (reading it marks it as recently used for evict)"""
+    if cache_dir is None:
+        return file_checksum(path)
+    info = os.stat(path)
+    identity = f'{os.path.abspath(path)}\0{info.st_size}\0{info.st_mtime_ns}\0{info.st_ino}'
+    memo = os.path.join(cache_dir, 'checksums', hashlib.blake2b(identity.encode(), digest_size=16).hexdigest())
+    try:
+        with open(memo) as file:
+            checksum = file.read()
+        if len(checksum) == 32:
+            os.utime(memo)
+            return checksum
+    except FileNotFoundError:
+        pass
+    checksum = file_checksum(path)
+    os.makedirs(os.path.dirname(memo), exist_ok=True)
+    temporary = f'{memo}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(checksum)
+    os.replace(temporary, memo)
+    return checksum
+
+
+@contextmanager
+def _locked(cache_dir):
+    """exclusive lock on a cache directory, across processes where fcntl is available"""
+    with open(os.path.join(cache_dir, 'lock'), 'a') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
@@ -1,62 +1,279 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd 
 
+from mutationsPy.sparse_counts import SparseCounts
+
 
-def sample_mut_mat_simple(exposures, burdens, signatures):
+def sample_mut_mat_simple(exposures, burdens, signatures, opportunities=None):
     """calculate mutation matrix with exact original metrics
 
     Args:
         exposures (np.array convertible): exposures in proportion, where rows are the samples and columns are the signatures
         burdens (np.array convertible): a vector of burdens for each sample
-        signatures (np.array convertible): signatures with rows are the signatures, and columns are the proportion of mutation classes
+        signatures (np.array convertible): signatures with rows are the signatures, and columns are the proportion of mutation classes,
+            or one such array per sample (samples x signatures x mutation classes)
+        opportunities (np.array convertible, optional): opportunities to renormalise the signatures with, see normalise_signatures. Defaults to None.
 
     Returns:
         _np.array_: mutation matrix with dimension compatible with SigProfilerExtractor
     """
+    signatures = _sample_signatures(signatures, opportunities)
     burden_by_signatures = np.array(exposures).T * np.array(burdens) 
+    if signatures.ndim == 3:
+        return np.einsum('sk,skc->sc', burden_by_signatures.T, signatures)
     mut_mat = np.matmul(burden_by_signatures.T, signatures)
     return mut_mat
 
-def sample_mut_mat_multinomial(exposures, burdens, signatures):
-    """calculate mutation matrix with exact original metrics
+def sample_mut_mat_multinomial(exposures, burdens, signatures, rng=None, opportunities=None):
+    """calculate mutation matrix by drawing the mutations of each sample and signature from a multinomial distribution
+
+    the burden of each signature in each sample is rounded. For each signature, the multinomials of all samples
+    exposed to it are drawn with one call to numpy.random.Generator.multinomial, (sample, signature) pairs 
+    without any mutation are skipped. Without rng the draws come from the global numpy random state one
+    (sample, signature) pair at a time, as in earlier versions, so that results seeded with np.random.seed do not change
 
     Args:
         exposures (np.array convertible): exposures in proportion, where rows are the samples and columns are the signatures
         burdens (np.array convertible): a vector of burdens for each sample
-        signatures (np.array convertible): signatures with rows are the signatures, and columns are the proportion of mutation classes
+        signatures (np.array convertible): signatures with rows are the signatures, and columns are the proportion of mutation classes,
+            or one such array per sample (samples x signatures x mutation classes)
+        rng (np.random.Generator or int, optional): random generator or seed, passed to np.random.default_rng. 
+            Defaults to None (the global numpy random state, see above).
+        opportunities (np.array convertible, optional): opportunities to renormalise the signatures with, see normalise_signatures. Defaults to None.
 
     Returns:
         _np.array_: mutation matrix with dimension compatible with SigProfilerExtractor
     """
-    exposures = np.array(exposures)
-    mut_mat = []
-    for i, burden in enumerate(burdens): 
-        exposure = exposures[i]
-        burden_by_sig = [np.random.multinomial(round(burden*exposure[j]), signatures[j]) for j, _ in enumerate(signatures)]
-        burden_by_sig = np.array(burden_by_sig).sum(axis=0)
-        mut_mat.append(burden_by_sig)
-    return np.array(mut_mat)
+    signatures = _sample_signatures(signatures, opportunities)
+    burden_by_sig = np.round(np.asarray(burdens, dtype=float)[:, None] * np.asarray(exposures, dtype=float)).astype(np.int64)
+    mut_mat = np.zeros((len(burden_by_sig), signatures.shape[-1]), dtype=np.int64)
+    if rng is None:
+        for i, sample_burdens in enumerate(burden_by_sig):
+            for j, burden in enumerate(sample_burdens):
+                mut_mat[i] += np.random.multinomial(burden, signatures[i, j] if signatures.ndim == 3 else signatures[j])
+        return mut_mat
+    rng = np.random.default_rng(rng)
+    for j in range(signatures.shape[-2]):
+        samples = np.flatnonzero(burden_by_sig[:, j])
+        if len(samples):
+            signature = signatures[samples, j] if signatures.ndim == 3 else signatures[j]
+            mut_mat[samples] += rng.multinomial(burden_by_sig[samples, j], signature)
+    return mut_mat
+
+def sample_mut_mat_sparse(exposures, burdens, signatures, rng=None, opportunities=None):
+    """draw the same multinomial model as sample_mut_mat_multinomial into sparse counts
 
-def gen_mut_matrix(exposure_matrix, signatures, sample_func = sample_mut_mat_multinomial):
+    each mutation is drawn on its own from the mutation classes of its signature (a multinomial is a sum of such draws),
+    so time and memory scale with the total burden rather than samples x mutation classes. This suits high kmer
+    matrices with low burdens, where most counts are zero. The random stream differs from sample_mut_mat_multinomial.
+    Without rng the draws come from the global numpy random state, so np.random.seed applies as well
+
+    Args:
+        exposures (np.array convertible): exposures in proportion, where rows are the samples and columns are the signatures
+        burdens (np.array convertible): a vector of burdens for each sample
+        signatures (np.array convertible): signatures with rows are the signatures, and columns are the proportion of mutation classes,
+            or one such array per sample (samples x signatures x mutation classes)
+        rng (np.random.Generator or int, optional): random generator or seed, passed to np.random.default_rng. 
+            Defaults to None (the global numpy random state).
+        opportunities (np.array convertible, optional): opportunities to renormalise the signatures with, see normalise_signatures. Defaults to None.
+
+    Returns:
+        SparseCounts: mutation matrix (samples x mutation classes)
+    """
+    random = np.random.random if rng is None else np.random.default_rng(rng).random
+    signatures = _sample_signatures(signatures, opportunities)
+    burden_by_sig = np.round(np.asarray(burdens, dtype=float)[:, None] * np.asarray(exposures, dtype=float)).astype(np.int64)
+    n_classes = signatures.shape[-1]
+    samples, classes = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for j in range(signatures.shape[-2]):
+        sample_ids = np.repeat(np.arange(len(burden_by_sig)), burden_by_sig[:, j])
+        if not len(sample_ids):
+            continue
+        if signatures.ndim == 3:
+            # one cumulative distribution per sample, shifted by the row so that a single searchsorted covers them all
+            cumulative = np.cumsum(signatures[:, j], axis=1)
+            cumulative = cumulative / cumulative[:, -1:]
+            shifted = (cumulative + np.arange(len(cumulative))[:, None]).ravel()
+            draws = np.searchsorted(shifted, random(len(sample_ids)) + sample_ids, side = 'right') - sample_ids * n_classes
+        else:
+            cumulative = np.cumsum(signatures[j])
+            draws = np.searchsorted(cumulative, random(len(sample_ids)) * cumulative[-1], side = 'right')
+        classes.append(np.minimum(draws, n_classes - 1))
+        samples.append(sample_ids)
+    return SparseCounts.from_coo(np.concatenate(samples), np.concatenate(classes), np.int64(1), 
+                                 (len(burden_by_sig), n_classes))
+
+def gen_mut_matrix(exposure_matrix, signatures, sample_func = sample_mut_mat_multinomial, opportunities = None, 
+                   reference_opportunities = None, **kwargs):
     """_summary_
 
     Args:
         exposure_matrix (pd.DataFrame): columns include 'burdens' (mutation burdens), 'sample_id' and 'signatures' (in proportion)
         signatures (pd.DataFrame): downloaded from COSMIC
         sample_func (function, optional): _description_. Defaults to sample_mut_mat_multinomial.
+        opportunities (pd.Series, pd.DataFrame or np.array, optional): opportunities of the simulated genomes (eg an exome), 
+            one per mutation class or one row per sample (a pd.DataFrame indexed by sample_id, an array in the order of 
+            exposure_matrix), see normalise_signatures. Defaults to None (signatures as they are).
+        reference_opportunities (pd.Series or np.array, optional): opportunities of the genome the signatures were 
+            derived on. Defaults to None.
+        **kwargs: passed to sample_func, eg rng for sample_mut_mat_multinomial
 
     Returns:
         _type_: _description_
     """
+    burdens, exposures, signatures, mut_class = _align_signatures(exposure_matrix, signatures, opportunities, reference_opportunities)
+    mut_mat = sample_func(exposures, burdens, signatures, **kwargs)
+    mut_mat = pd.DataFrame(mut_mat, columns = mut_class)
+    mut_mat['sample_id'] = exposure_matrix['sample_id']
+    mut_mat = mut_mat[['sample_id'] + mut_class]
+    return round(mut_mat)
+
+
+def gen_sparse_mut_matrix(exposure_matrix, signatures, rng = None, opportunities = None, reference_opportunities = None):
+    """simulate a mutation matrix as gen_mut_matrix does, keeping it sparse (see sample_mut_mat_sparse)
+
+    Args:
+        exposure_matrix (pd.DataFrame): columns include 'burdens' (mutation burdens), 'sample_id' and 'signatures' (in proportion)
+        signatures (pd.DataFrame): downloaded from COSMIC
+        rng (np.random.Generator or int, optional): random generator or seed. Defaults to None (the global numpy random state).
+        opportunities (pd.Series, pd.DataFrame or np.array, optional): see gen_mut_matrix. Defaults to None.
+        reference_opportunities (pd.Series or np.array, optional): see gen_mut_matrix. Defaults to None.
+
+    Returns:
+        tuple: SparseCounts of mutation counts (samples x mutation classes), sample ids and mutation classes,
+            eg for write_matrix(path, counts, sample_ids, mut_class, 'hdp')
+    """
+    burdens, exposures, signatures, mut_class = _align_signatures(exposure_matrix, signatures, opportunities, reference_opportunities)
+    mut_mat = sample_mut_mat_sparse(exposures, burdens, signatures, rng=rng)
+    return mut_mat, list(exposure_matrix['sample_id']), mut_class
+
+
+def gen_mut_matrix_replicates(exposure_matrix, signatures, n_replicates, seed = None, n_jobs = 1, sample_func = sample_mut_mat_multinomial,
+                              opportunities = None, reference_opportunities = None):
+    """simulate replicate mutation matrices of the same cohort, eg for bootstrap or power analyses
+
+    the setup of gen_mut_matrix (signature alignment and validation) is done once and the replicates are drawn into one array.
+    Each replicate gets its own random stream spawned from np.random.SeedSequence(seed), so the result only depends 
+    on the seed and not on the number of workers the replicates are spread over
+
+    Args:
+        exposure_matrix (pd.DataFrame): columns include 'burdens' (mutation burdens), 'sample_id' and 'signatures' (in proportion)
+        signatures (pd.DataFrame): downloaded from COSMIC
+        n_replicates (int): number of replicate matrices
+        seed (int or np.random.SeedSequence, optional): entropy of the replicate streams. Defaults to None (fresh entropy).
+        n_jobs (int, optional): number of worker processes, None for one per CPU. Defaults to 1 (no pool).
+        sample_func (function, optional): sampling function taking an rng keyword argument. Defaults to sample_mut_mat_multinomial.
+        opportunities (pd.Series, pd.DataFrame or np.array, optional): see gen_mut_matrix. Defaults to None.
+        reference_opportunities (pd.Series or np.array, optional): see gen_mut_matrix. Defaults to None.
+
+    Returns:
+        tuple: np.array of mutation counts (samples x mutation classes x replicates), sample ids and mutation classes
+    """
+    burdens, exposures, signatures, mut_class = _align_signatures(exposure_matrix, signatures, opportunities, reference_opportunities)
+    exposures, burdens = np.asarray(exposures, dtype=float), np.asarray(burdens, dtype=float)
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    streams = seed.spawn(n_replicates)
+    mut_mats = np.empty((len(exposures), len(mut_class), n_replicates), dtype=np.int64)
+    if n_jobs == 1 or n_replicates <= 1:
+        _draw_replicates(exposures, burdens, signatures, streams, sample_func, out=mut_mats)
+    else:
+        n_jobs = n_jobs or os.cpu_count()
+        blocks = np.array_split(np.arange(n_replicates), min(n_jobs, n_replicates))
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_draw_replicates, exposures, burdens, signatures, [streams[i] for i in block], sample_func) for block in blocks]
+            for block, future in zip(blocks, futures):
+                mut_mats[:, :, block] = future.result()
+    return mut_mats, list(exposure_matrix['sample_id']), mut_class
+
+
+def normalise_signatures(signatures, opportunities, reference_opportunities=None):
+    """renormalise signatures to the context opportunities of other genomes, eg exomes or other species
+
+    each signature is weighted by opportunities / reference_opportunities and rescaled to sum to 1, all signatures 
+    (and samples) at once. With one opportunity vector the result has the shape of signatures, with one row of
+    opportunities per sample it has one set of signatures per sample
+
+    Args:
+        signatures (np.array convertible): signatures x mutation classes, in proportion
+        opportunities (np.array convertible): opportunity of each mutation class (mutation classes,), or per sample (samples x mutation classes)
+        reference_opportunities (np.array convertible, optional): opportunities the signatures were derived on. Defaults to None (uniform).
+
+    Raises:
+        ValueError: a signature has no opportunity left to mutate
+
+    Returns:
+        np.array: signatures x mutation classes, or samples x signatures x mutation classes
+    """
+    signatures = np.asarray(signatures, dtype=float)
+    weights = np.asarray(opportunities, dtype=float)
+    if reference_opportunities is not None:
+        reference_opportunities = np.asarray(reference_opportunities, dtype=float)
+        weights = np.divide(weights, reference_opportunities, out=np.zeros(np.broadcast_shapes(weights.shape, reference_opportunities.shape)), 
+                            where=reference_opportunities > 0)
+    if weights.shape[-1] != signatures.shape[-1]:
+        raise ValueError(f'{weights.shape[-1]} opportunities do not match {signatures.shape[-1]} mutation classes')
+    weighted = signatures * weights[..., None, :] if weights.ndim == 2 else signatures * weights
+    totals = weighted.sum(axis=-1, keepdims=True)
+    if np.any(totals <= 0):
+        raise ValueError('at least one signature has no opportunity left to mutate')
+    return weighted / totals
+
+
+def _sample_signatures(signatures, opportunities):
+    signatures = np.asarray(signatures, dtype=float)
+    return signatures if opportunities is None else normalise_signatures(signatures, opportunities)
+
+
+def _align_signatures(exposure_matrix, signatures, opportunities=None, reference_opportunities=None):
+    """shared setup of the simulations: keep the signatures present in both inputs, check the exposures and 
+    renormalise the signatures to the opportunities if any (pandas opportunities are aligned to the mutation classes,
+    and the rows of a pd.DataFrame to the sample ids)
+
+    Raises:
+        ValueError: exposures of a sample do not add up to 1
+        KeyError: a sample is missing from the rows of pd.DataFrame opportunities
+
+    Returns:
+        tuple: burdens, exposures (pd.DataFrame), signatures (np.array, signatures x mutation classes, or 
+            samples x signatures x mutation classes with per sample opportunities) and mutation classes
+    """
     burdens = exposure_matrix['burdens']
-    mut_class = list(signatures['Type'])
-    present_signatures = list(set(exposure_matrix.columns) & set(signatures.columns))
+    # in the order of the exposure matrix, the samplers draw signature by signature
+    signature_names = set(signatures.columns)
+    present_signatures = [column for column in exposure_matrix.columns if column in signature_names]
     exposures = exposure_matrix[present_signatures]
     if not np.allclose(exposures.sum(axis = 1), 1):
         raise ValueError('exposures from at least one sample do not add up to 1')
-    signatures = np.array(signatures[present_signatures]).T
-    mut_mat = sample_func(exposures, burdens, signatures)
-    mut_mat = pd.DataFrame(mut_mat, columns = mut_class)
-    mut_mat['sample_id'] = exposure_matrix['sample_id']
-    mut_mat = mut_mat[['sample_id'] + mut_class]
-    return round(mut_mat)
\ No newline at end of file
+    signatures, mut_class = _signature_array(signatures, present_signatures)
+    if opportunities is not None:
+        if isinstance(opportunities, pd.DataFrame):
+            missing = [sample for sample in exposure_matrix['sample_id'] if sample not in opportunities.index]
+            if missing:
+                raise KeyError(f'samples {missing} have no opportunities, the rows of opportunities are matched by sample_id')
+            opportunities = opportunities.loc[exposure_matrix['sample_id'], mut_class]
+        elif isinstance(opportunities, pd.Series):
+            opportunities = opportunities.loc[mut_class]
+        if isinstance(reference_opportunities, pd.Series):
+            reference_opportunities = reference_opportunities.loc[mut_class]
+        signatures = normalise_signatures(signatures, opportunities, reference_opportunities)
+    return burdens, exposures, signatures, mut_class
+
+
+def _signature_array(signatures, signature_names):
+    """signatures x mutation classes array of the given signatures (columns of a COSMIC table) and the mutation classes"""
+    return np.array(signatures[signature_names]).T, list(signatures['Type'])
+
+
+def _draw_replicates(exposures, burdens, signatures, streams, sample_func, out=None):
+    """draw one replicate per seed sequence into out[..., i] (samples x mutation classes x replicates, allocated if None)"""
+    if out is None:
+        out = np.empty((len(exposures), signatures.shape[-1], len(streams)), dtype=np.int64)
+    for i, stream in enumerate(streams):
+        replicate = sample_func(exposures, burdens, signatures, rng=np.random.default_rng(stream))
+        if not np.issubdtype(np.asarray(replicate).dtype, np.integer):
+            replicate = np.rint(replicate)
+        out[..., i] = replicate
+    return out
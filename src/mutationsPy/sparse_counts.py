@@ -0,0 +1,244 @@
+import numpy as np
+
+
+class SparseCounts:
+    """2-D mutation counts in compressed sparse row (CSR) form, built on numpy alone
+
+    memory scales with the number of nonzero counts rather than rows x columns, which matters for high kmer
+    matrices with low burdens. Row and column labels are kept alongside, as for dense arrays.
+    Slicing rows (counts[start:stop]) gives a SparseCounts and np.asarray gives the dense array,
+    so blocks of a sparse matrix can be handled like blocks of a dense one. scipy is only needed by to_scipy
+
+    Attributes:
+        data (np.array): nonzero counts, row by row
+        indices (np.array): column of each nonzero count
+        indptr (np.array): start of each row in data and indices, with the end of the last row appended
+        shape (tuple): number of rows and columns
+    """
+
+    ndim = 2
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = (int(shape[0]), int(shape[1]))
+        if len(indptr) != self.shape[0] + 1 or len(data) != len(indices):
+            raise ValueError(f'data, indices and indptr do not describe a {self.shape} matrix')
+
+    @classmethod
+    def from_coo(cls, rows, columns, values, shape, dtype=None):
+        """build from (row, column, value) triplets, summing the values of repeated positions and dropping zeros
+
+        Args:
+            rows (np.array convertible): row of each value
+            columns (np.array convertible): column of each value
+            values (np.array convertible or scalar): values, eg 1 to count occurrences
+            shape (tuple): number of rows and columns
+            dtype (np.dtype, optional): dtype of the counts. Defaults to None (that of values).
+
+        Returns:
+            SparseCounts: sparse counts
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        values = np.broadcast_to(np.asarray(values, dtype=dtype), rows.shape)
+        keys = rows * shape[1] + columns
+        order = np.argsort(keys, kind = 'stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+        data = np.add.reduceat(values[order], starts) if len(keys) else values[:0].copy()
+        keys = keys[starts]
+        nonzero = data != 0
+        data, keys = data[nonzero], keys[nonzero]
+        indptr = np.searchsorted(keys, np.arange(shape[0] + 1, dtype=np.int64) * shape[1])
+        return cls(data, keys % max(shape[1], 1), indptr, shape)
+
+    @classmethod
+    def from_dense(cls, counts):
+        """build from a dense 2-D array
+
+        Args:
+            counts (np.array convertible): dense counts
+
+        Returns:
+            SparseCounts: sparse counts
+        """
+        counts = np.asarray(counts)
+        rows, columns = np.nonzero(counts)
+        indptr = np.searchsorted(rows, np.arange(counts.shape[0] + 1))
+        return cls(counts[rows, columns], columns, indptr, counts.shape)
+
+    @classmethod
+    def from_scipy(cls, matrix):
+        """build from any scipy.sparse matrix or array"""
+        matrix = matrix.tocsr()
+        matrix.sum_duplicates()
+        return cls(matrix.data, matrix.indices.astype(np.int64), matrix.indptr.astype(np.int64), matrix.shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        """number of stored counts"""
+        return len(self.data)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'SparseCounts(shape={self.shape}, nnz={self.nnz}, dtype={self.dtype})'
+
+    def __getitem__(self, rows):
+        """rows as a slice, eg counts[start:stop]"""
+        if not isinstance(rows, slice):
+            raise TypeError('SparseCounts only supports slicing rows, use take_rows or toarray')
+        start, stop, step = rows.indices(self.shape[0])
+        if step != 1:
+            return self.take_rows(np.arange(start, stop, step))
+        stop = max(start, stop)
+        first, last = self.indptr[start], self.indptr[stop]
+        return SparseCounts(self.data[first:last], self.indices[first:last], self.indptr[start:stop + 1] - first,
+                            (stop - start, self.shape[1]))
+
+    def __array__(self, dtype=None, copy=None):
+        counts = self.toarray()
+        return counts if dtype is None else counts.astype(dtype)
+
+    def toarray(self):
+        """dense 2-D array of the counts"""
+        counts = np.zeros(self.shape, dtype=self.dtype)
+        counts[self.row_indices(), self.indices] = self.data
+        return counts
+
+    def row_indices(self):
+        """row of each stored count"""
+        return np.repeat(np.arange(self.shape[0], dtype=np.int64), np.diff(self.indptr))
+
+    def tocoo(self):
+        """(row, column, value) triplets of the stored counts"""
+        return self.row_indices(), np.asarray(self.indices), np.asarray(self.data)
+
+    def transpose(self):
+        rows, columns, values = self.tocoo()
+        order = np.argsort(columns, kind = 'stable') # rows stay sorted within each column
+        indptr = np.searchsorted(columns[order], np.arange(self.shape[1] + 1))
+        return SparseCounts(values[order], rows[order], indptr, (self.shape[1], self.shape[0]))
+
+    def astype(self, dtype):
+        return SparseCounts(self.data.astype(dtype), self.indices, self.indptr, self.shape)
+
+    def take_rows(self, take, fill_value=0):
+        """select and reorder rows, -1 gives a row filled with fill_value (eg NaN for a missing mutation type)
+
+        Args:
+            take (np.array convertible): row of the input for each output row, -1 for a filled row
+            fill_value (scalar, optional): value of filled rows. Defaults to 0.
+
+        Returns:
+            SparseCounts: selected rows
+        """
+        take = np.asarray(take, dtype=np.int64)
+        missing = take < 0
+        safe = np.where(missing, 0, take)
+        starts = self.indptr[safe]
+        lengths = np.where(missing, 0, self.indptr[np.minimum(safe + 1, self.shape[0])] - starts)
+        indptr = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+        source = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        taken = SparseCounts(self.data[source], self.indices[source], indptr, (len(take), self.shape[1]))
+        if fill_value == 0 or not np.any(missing):
+            return taken
+        filled_rows = np.repeat(np.flatnonzero(missing), self.shape[1])
+        filled_columns = np.tile(np.arange(self.shape[1]), int(missing.sum()))
+        rows, columns, values = taken.tocoo()
+        dtype = np.result_type(self.dtype, np.asarray(fill_value).dtype)
+        return SparseCounts.from_coo(np.r_[rows, filled_rows], np.r_[columns, filled_columns],
+                                     np.r_[values.astype(dtype), np.full(len(filled_rows), fill_value, dtype=dtype)], taken.shape)
+
+    def take_columns(self, take):
+        """select and reorder columns
+
+        Args:
+            take (np.array convertible): column of the input for each output column
+
+        Returns:
+            SparseCounts: selected columns
+        """
+        take = np.asarray(take, dtype=np.int64)
+        rows, columns, values = self.tocoo()
+        # an input column can be taken several times, so expand each entry to all of its output columns
+        order = np.argsort(take, kind = 'stable')
+        first = np.searchsorted(take[order], columns, side = 'left')
+        last = np.searchsorted(take[order], columns, side = 'right')
+        repeats = last - first
+        entry = np.repeat(np.arange(len(values)), repeats)
+        within = np.arange(len(entry)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        new_columns = order[np.repeat(first, repeats) + within]
+        return SparseCounts.from_coo(rows[entry], new_columns, values[entry], (self.shape[0], len(take)))
+
+    def sum(self, axis=None):
+        if axis is None:
+            return self.data.sum()
+        axis = axis % 2
+        sums = np.zeros(self.shape[1 - axis], dtype=np.result_type(self.dtype, np.int64))
+        np.add.at(sums, self.indices if axis == 0 else self.row_indices(), self.data)
+        return sums
+
+    def to_scipy(self):
+        """scipy.sparse.csr_array of the counts, needs scipy to be installed"""
+        try:
+            from scipy import sparse
+        except ImportError as error:
+            raise ImportError('to_scipy needs scipy, which is not installed') from error
+        return sparse.csr_array((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def is_sparse(counts):
+    """whether counts are a SparseCounts"""
+    return isinstance(counts, SparseCounts)
+
+
+def as_sparse(counts):
+    """SparseCounts of dense counts, sparse counts are returned as they are"""
+    return counts if is_sparse(counts) else SparseCounts.from_dense(counts)
+
+
+def hstack(blocks):
+    """concatenate counts with the same number of rows side by side, dense blocks are made sparse
+
+    Args:
+        blocks (list): SparseCounts or dense 2-D arrays
+
+    Returns:
+        SparseCounts: concatenated counts
+    """
+    blocks = [as_sparse(block) for block in blocks]
+    return vstack([block.T for block in blocks]).T
+
+
+def vstack(blocks):
+    """concatenate counts with the same number of columns on top of each other, dense blocks are made sparse
+
+    Args:
+        blocks (list): SparseCounts or dense 2-D arrays
+
+    Returns:
+        SparseCounts: concatenated counts
+    """
+    blocks = [as_sparse(block) for block in blocks]
+    if not blocks:
+        raise ValueError('no counts to concatenate')
+    if len({block.shape[1] for block in blocks}) > 1:
+        raise ValueError('counts to concatenate have different numbers of columns')
+    offsets = np.cumsum([0] + [block.nnz for block in blocks])
+    indptr = np.concatenate([[0]] + [block.indptr[1:] + offset for block, offset in zip(blocks, offsets)])
+    dtype = np.result_type(*[block.dtype for block in blocks])
+    return SparseCounts(np.concatenate([block.data for block in blocks]).astype(dtype, copy=False),
+                        np.concatenate([block.indices for block in blocks]), indptr,
+                        (sum(block.shape[0] for block in blocks), blocks[0].shape[1]))
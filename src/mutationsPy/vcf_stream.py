@@ -0,0 +1,348 @@
+import csv
+import gzip
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from mutationsPy.read_file import sample_name
+
+# compressed bytes read at a time, the whole BGZF blocks they hold are inflated as one task
+_READ_SIZE = 1 << 20
+# decompressed bytes parsed into one VariantBatch
+_CHUNK_BYTES = 1 << 22
+# ID1 ID2 CM FLG MTIME XFL OS XLEN, the fixed part of a gzip member header
+_GZIP_HEADER = struct.Struct('<4BI2BH')
+# smallest BGZF header: the fixed part and the 6 bytes of the BC subfield
+_BGZF_HEADER_SIZE = 18
+_VCF_COLUMNS = ['CHROM', 'POS', 'ID', 'REF', 'ALT']
+# signals the end of a file to stream_vcfs
+_DONE = object()
+
+
+class VariantBatch:
+    """typed columns of a run of VCF records, which can be passed to get_contexts, get_context_codes,
+    get_dbs_codes or get_id_codes a chromosome at a time (see by_chrom)
+
+    Args:
+        chrom (np.array): chromosomes (str objects)
+        pos (np.array): 0-based positions (int64)
+        ref (np.array): reference alleles (str objects)
+        alt (np.array): alternative alleles (str objects)
+        sample (np.array): sample of each record (str objects)
+        source (path, optional): file the records come from. Defaults to None.
+    """
+
+    def __init__(self, chrom, pos, ref, alt, sample, source=None):
+        self.chrom = chrom
+        self.pos = pos
+        self.ref = ref
+        self.alt = alt
+        self.sample = sample
+        self.source = source
+
+    def __len__(self):
+        return len(self.pos)
+
+    def __repr__(self):
+        return f'VariantBatch({len(self)} records from {self.source!r})'
+
+    def by_chrom(self):
+        """rows of each chromosome
+
+        Returns:
+            dict: chromosome -> np.array of row indices, in order of first appearance
+        """
+        return pd.Series(np.arange(len(self))).groupby(self.chrom, sort=False).indices
+
+
+def is_bgzf(path):
+    """whether a file is BGZF (bgzip) compressed, ie a series of gzip blocks each recording its compressed size
+
+    Args:
+        path (path): path to the file
+
+    Returns:
+        bool
+    """
+    with open(path, 'rb') as file:
+        header = file.read(_BGZF_HEADER_SIZE)
+    try:
+        return _block_size(header, 0) is not None
+    except ValueError:
+        return False
+
+
+def read_bgzf(path, n_threads=None, executor=None, max_pending=8, read_size=_READ_SIZE):
+    """decompress a BGZF file on a thread pool
+
+    the compressed stream is read sequentially and cut at block boundaries, which BGZF block headers give without
+    inflating anything, so that the raw deflate data of the blocks can be inflated in parallel (zlib releases the GIL).
+    At most max_pending groups of blocks are in flight, so memory does not depend on the file size.
+
+    Args:
+        path (path): path to the BGZF file
+        n_threads (int, optional): number of threads if no executor is given, None for one per CPU. Defaults to None.
+        executor (concurrent.futures.Executor, optional): pool inflating the blocks, eg shared by several files. Defaults to None (a pool of n_threads).
+        max_pending (int, optional): maximum number of groups of blocks being inflated at a time. Defaults to 8.
+        read_size (int, optional): number of compressed bytes read at a time. Defaults to 1 MB.
+
+    Raises:
+        ValueError: the file is not BGZF compressed, is truncated or a block fails its CRC check
+
+    Yields:
+        bytes: decompressed data, in file order
+    """
+    if executor is None:
+        with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+            yield from read_bgzf(path, executor=executor, max_pending=max_pending, read_size=read_size)
+        return
+    pending = deque()
+    rest = b''
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(read_size)
+            buffer = rest + data if rest else data
+            spans, consumed = _split_blocks(buffer, path)
+            if spans:
+                pending.append(executor.submit(_inflate_blocks, buffer, spans, path))
+            rest = buffer[consumed:]
+            while len(pending) >= max_pending:
+                yield pending.popleft().result()
+            if not data:
+                break
+    if rest:
+        raise ValueError(f'{path} is truncated, it ends within a BGZF block')
+    while pending:
+        yield pending.popleft().result()
+
+
+def read_vcf_batches(vcf, chunk_bytes=_CHUNK_BYTES, n_threads=None, executor=None, max_pending=8):
+    """read a VCF file (plain, gzip or bgzip compressed) into VariantBatch, one sample per file named by sample_name
+
+    "##" meta lines and the "#CHROM" header are skipped and the columns are taken by position, only CHROM, POS, REF and ALT
+    are parsed. BGZF files are decompressed in parallel by read_bgzf, other files are read sequentially.
+
+    Args:
+        vcf (path): path to VCF format file
+        chunk_bytes (int, optional): decompressed bytes per batch. Defaults to 4 MB.
+        n_threads (int, optional): number of threads decompressing BGZF blocks if no executor is given, None for one per CPU. Defaults to None.
+        executor (concurrent.futures.Executor, optional): pool decompressing BGZF blocks. Defaults to None (a pool of n_threads).
+        max_pending (int, optional): see read_bgzf. Defaults to 8.
+
+    Raises:
+        ValueError: the header does not start with the VCF columns, or see read_bgzf
+
+    Yields:
+        VariantBatch: records of the file with 0-based positions, in file order
+    """
+    if executor is None and is_bgzf(vcf):
+        with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+            yield from read_vcf_batches(vcf, chunk_bytes=chunk_bytes, executor=executor, max_pending=max_pending)
+        return
+    sample = sample_name(vcf)
+    in_header = True
+    with closing(_read_bytes(vcf, executor, max_pending)) as pieces:
+        for data in _line_chunks(pieces, chunk_bytes):
+            start = _skip_header(data, vcf) if in_header else 0
+            if start < len(data):
+                in_header = False
+                batch = _parse_records(data[start:] if start else data, sample, vcf)
+                if batch is not None:
+                    yield batch
+
+
+def stream_vcfs(vcf_paths, n_threads=None, max_files=4, chunk_bytes=_CHUNK_BYTES, prefetch=2):
+    """read many VCF files into VariantBatch, overlapping the reading of up to max_files files
+
+    each file is read by its own thread (see read_vcf_batches) while the BGZF blocks of all files are decompressed on one
+    shared pool of n_threads threads. Batches are yielded in file order, files ahead of the one being consumed hold at most
+    prefetch batches, so memory is bound by max_files * prefetch batches whatever the number and size of the files.
+    Stopping early (eg an exception in the loop consuming the batches) stops the readers.
+
+    Args:
+        vcf_paths (list): paths to VCF format files (plain, gzip or bgzip compressed)
+        n_threads (int, optional): number of threads decompressing BGZF blocks, None for one per CPU. Defaults to None.
+        max_files (int, optional): number of files read at the same time. Defaults to 4.
+        chunk_bytes (int, optional): decompressed bytes per batch. Defaults to 4 MB.
+        prefetch (int, optional): number of batches each reader can get ahead by. Defaults to 2.
+
+    Raises:
+        errors of read_vcf_batches, eg FileNotFoundError or ValueError, once the batches before them are consumed
+
+    Yields:
+        VariantBatch: records of each file with 0-based positions, in file order
+    """
+    if isinstance(vcf_paths, str):
+        vcf_paths = [vcf_paths]
+    stop = threading.Event()
+    paths = iter(vcf_paths)
+    queues = deque()
+    with ThreadPoolExecutor(n_threads or os.cpu_count()) as inflaters, ThreadPoolExecutor(max_files) as readers:
+
+        def start_next():
+            vcf = next(paths, None)
+            if vcf is not None:
+                batches = queue.Queue(prefetch)
+                readers.submit(_read_into, batches, vcf, inflaters, chunk_bytes, stop)
+                queues.append(batches)
+
+        try:
+            for _ in range(max_files):
+                start_next()
+            while queues:
+                batches = queues.popleft()
+                while True:
+                    item = batches.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield item
+                start_next()
+        finally:
+            stop.set()
+
+
+def _read_into(batches, vcf, executor, chunk_bytes, stop):
+    """put the batches of a file into a queue followed by _DONE, or the exception reading it raised"""
+    try:
+        with closing(read_vcf_batches(vcf, chunk_bytes=chunk_bytes, executor=executor)) as reader:
+            for batch in reader:
+                if not _put(batches, batch, stop):
+                    return
+        item = _DONE
+    except Exception as error:
+        item = error
+    _put(batches, item, stop)
+
+
+def _put(batches, item, stop):
+    """put an item into a bounded queue unless the consumer stops, False if it did"""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_bytes(path, executor, max_pending):
+    """decompressed content of a plain, gzip or BGZF file, piece by piece"""
+    if executor is not None and is_bgzf(path):
+        yield from read_bgzf(path, executor=executor, max_pending=max_pending)
+        return
+    with open(path, 'rb') as file:
+        compressed = file.read(2) == b'\x1f\x8b'
+    with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as file:
+        while piece := file.read(_READ_SIZE):
+            yield piece
+
+
+def _line_chunks(pieces, chunk_bytes):
+    """regroup pieces of data into chunks of about chunk_bytes that end with a whole line"""
+    parts, size = [], 0
+    for piece in pieces:
+        parts.append(piece)
+        size += len(piece)
+        if size < chunk_bytes:
+            continue
+        data = b''.join(parts)
+        start = 0
+        while len(data) - start >= chunk_bytes:
+            # last line end within chunk_bytes, or the end of a line longer than that
+            cut = data.rfind(b'\n', start, start + chunk_bytes) + 1 or data.find(b'\n', start + chunk_bytes) + 1
+            if not cut:
+                break
+            yield data[start:cut]
+            start = cut
+        parts, size = [data[start:]], len(data) - start
+    data = b''.join(parts)
+    if data:
+        yield data
+
+
+def _skip_header(data, vcf):
+    """offset of the first record in a chunk of whole lines, len(data) if it only holds header lines"""
+    start = 0
+    while data.startswith(b'#', start):
+        end = data.find(b'\n', start)
+        end = len(data) if end == -1 else end
+        if not data.startswith(b'##', start):
+            columns = data[start + 1:end].rstrip(b'\r').decode().split('\t')
+            if columns[:len(_VCF_COLUMNS)] != _VCF_COLUMNS:
+                raise ValueError(f'{vcf} is not a VCF file, its header starts with {columns[:len(_VCF_COLUMNS)]}')
+        start = end + 1
+    return min(start, len(data))
+
+
+def _parse_records(data, sample, vcf):
+    """VariantBatch of a chunk of whole VCF record lines, None if it has no records"""
+    try:
+        table = pd.read_csv(io.BytesIO(data), sep='\t', header=None, usecols=[0, 1, 3, 4], quoting=csv.QUOTE_NONE,
+                            na_filter=False, dtype={0: str, 1: np.int64, 3: str, 4: str})
+    except pd.errors.EmptyDataError:
+        return None
+    n = len(table)
+    return VariantBatch(table[0].to_numpy(dtype=object), table[1].to_numpy(dtype=np.int64) - 1, table[3].to_numpy(dtype=object),
+                        table[4].to_numpy(dtype=object), np.full(n, sample, dtype=object), source=vcf)
+
+
+def _block_size(buffer, start):
+    """total size of the BGZF block starting at buffer[start], None if its header is cut short by the end of the buffer
+
+    Raises:
+        ValueError: the block is not a gzip member with a BC subfield
+    """
+    if len(buffer) - start < _GZIP_HEADER.size:
+        return None
+    id1, id2, method, flags, _, _, _, extra_length = _GZIP_HEADER.unpack_from(buffer, start)
+    if (id1, id2, method) != (0x1f, 0x8b, 8) or not flags & 4:
+        raise ValueError('not a BGZF block')
+    extra = start + _GZIP_HEADER.size
+    extra_end = extra + extra_length
+    if len(buffer) < extra_end:
+        return None
+    while extra + 4 <= extra_end:
+        subfield_length = struct.unpack_from('<H', buffer, extra + 2)[0]
+        if buffer[extra:extra + 2] == b'BC' and subfield_length == 2:
+            return struct.unpack_from('<H', buffer, extra + 4)[0] + 1
+        extra += 4 + subfield_length
+    raise ValueError('not a BGZF block')
+
+
+def _split_blocks(buffer, path):
+    """(start, size) of the whole BGZF blocks at the start of buffer, and the number of bytes they take up"""
+    spans, start = [], 0
+    while True:
+        try:
+            size = _block_size(buffer, start)
+        except ValueError:
+            raise ValueError(f'{path} is not BGZF compressed, or is corrupt at byte {start} of a read') from None
+        if size is None or start + size > len(buffer):
+            return spans, start
+        spans.append((start, size))
+        start += size
+
+
+def _inflate_blocks(buffer, spans, path):
+    """inflate the raw deflate data of BGZF blocks, checking their CRC32 and size"""
+    view = memoryview(buffer)
+    pieces = []
+    for start, size in spans:
+        extra_length = struct.unpack_from('<H', buffer, start + 10)[0]
+        crc, length = struct.unpack_from('<2I', buffer, start + size - 8)
+        piece = zlib.decompress(view[start + _GZIP_HEADER.size + extra_length:start + size - 8], -15)
+        if len(piece) != length or zlib.crc32(piece) != crc:
+            raise ValueError(f'BGZF block of {path} fails its CRC check')
+        pieces.append(piece)
+    return b''.join(pieces)
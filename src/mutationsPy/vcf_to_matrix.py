@@ -0,0 +1,375 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from mutationsPy.classify_mut import get_dbs_codes, get_id_codes
+from mutationsPy.encode_context import mutation_catalog
+from mutationsPy.get_mut import get_context_codes
+from mutationsPy.matrix_io import write_matrix
+from mutationsPy.profiling import profiled, stage
+from mutationsPy.read_file import FastaReference, read_vcf_chunks, sample_name
+from mutationsPy.result_cache import cached_call
+from mutationsPy.sparse_counts import SparseCounts, is_sparse
+from mutationsPy.vcf_stream import stream_vcfs
+
+
+def count_mutations(vcf_paths, reference, kmer=3, symmetric=True, sample_colname=None, chrom_colname='CHROM',
+                    pos_colname='POS', ref_colname='REF', alt_colname='ALT', chunksize=100_000, sep='\t', n_jobs=1, chrom_shards=1,
+                    sparse=False, mutation_type='SBS', io_threads=0):
+    """stream VCF files chunk by chunk and count SNVs per sample and context into a samples x gen_context(kmer, symmetric) array,
+    or with mutation_type 'DBS' or 'ID' doublet base substitutions or indels into samples x gen_dbs_context() or gen_id_context()
+
+    only one chunk is held in memory at any time, on top of the count array itself. Variants that are not single base substitutions
+    are skipped, as are SNVs whose kmer window runs off the end of the contig or contains a base other than A, C, G or T.
+
+    The work is split into one task per VCF file, which can run on a process pool. Workers map the reference file themselves
+    rather than receiving pickled sequences, and their partial counts are summed, so the result does not depend on n_jobs
+    or chrom_shards. With chrom_shards > 1 (and a pool) each file is instead parsed once in this process and the rows of each
+    chunk are split into chrom_shards groups of chromosomes that are classified on the pool, which spreads a few very large
+    files over the workers without parsing any file more than once.
+    Samples are ordered by their first appearance (file order, then row order).
+    With sparse=True the counts are kept as SparseCounts, so that memory scales with the number of distinct
+    (sample, context) pairs rather than samples x contexts (eg for large kmers and low burdens).
+    Doublet base substitutions and indels are classified a chunk at a time by get_dbs_codes and get_id_codes,
+    other variants are skipped (doublets called as two adjacent SNVs are not merged).
+    With io_threads > 0 the files are read by stream_vcfs in this process instead: bgzip blocks are decompressed on
+    io_threads threads and up to io_threads files are read ahead, which suits many compressed files on slow storage.
+    The VCF columns are then taken by position, so the column names, chunksize and sep are not used.
+
+    Args:
+        vcf_paths (list): paths to VCF format files
+        reference (path or FastaReference): reference genome, indexed on the fly if no .fai index is present
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+        sample_colname (str, optional): column with the sample of each mutation. Defaults to None, one sample per file named by sample_name.
+        chrom_colname (str, optional): name of the column with the chromosomes. Defaults to 'CHROM'.
+        pos_colname (str, optional): name of the column with the (1-based) positions. Defaults to 'POS'.
+        ref_colname (str, optional): name of the column with the reference alleles. Defaults to 'REF'.
+        alt_colname (str, optional): name of the column with the mutated alleles. Defaults to 'ALT'.
+        chunksize (int, optional): number of VCF rows per chunk. Defaults to 100_000.
+        sep (str, optional): delimiter of the VCF files. Defaults to '\t'.
+        n_jobs (int, optional): number of worker processes, None for one per CPU. Defaults to 1 (no pool).
+        chrom_shards (int, optional): number of chromosome groups the chunks of each VCF file are split into across workers. Defaults to 1.
+        sparse (bool, optional): return the counts as SparseCounts. Defaults to False.
+        mutation_type (str, optional): 'SBS', 'DBS' or 'ID', the mutations to count. Defaults to 'SBS' (SNVs).
+        io_threads (int, optional): number of threads reading and decompressing VCF files with stream_vcfs,
+            one sample per file. Defaults to 0 (pandas reader, see above).
+
+    Raises:
+        ValueError: io_threads is combined with sample_colname, n_jobs or chrom_shards
+        KeyError: reference allele of a counted mutation does not match the reference genome, or a chromosome is not in the reference genome
+
+    Returns:
+        tuple: np.array (or SparseCounts) of counts (samples x contexts) and list of sample names
+    """
+    if isinstance(vcf_paths, str):
+        vcf_paths = [vcf_paths]
+    if not isinstance(reference, FastaReference):
+        reference = FastaReference(reference)
+    if io_threads:
+        if sample_colname is not None or n_jobs != 1 or chrom_shards != 1:
+            raise ValueError('io_threads reads one sample per file in this process, it cannot be combined with sample_colname, n_jobs or chrom_shards')
+        return _count_stream(reference, vcf_paths, io_threads, kmer, symmetric, sparse, mutation_type)
+    options = dict(kmer=kmer, symmetric=symmetric, sample_colname=sample_colname, chrom_colname=chrom_colname, pos_colname=pos_colname,
+                   ref_colname=ref_colname, alt_colname=alt_colname, chunksize=chunksize, sep=sep, sparse=sparse,
+                   mutation_type=mutation_type)
+    file_indices = list(range(len(vcf_paths)))
+    if chrom_shards > 1 and n_jobs != 1:
+        results, file_indices = _count_sharded(reference, vcf_paths, _shard_contigs(reference, chrom_shards), n_jobs, **options)
+    elif n_jobs == 1 or len(vcf_paths) == 1:
+        results = [_count_file(reference, vcf, **options) for vcf in vcf_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_count_file, reference, vcf, **options) for vcf in vcf_paths]
+            results = [future.result() for future in futures]
+    with stage('merge_counts', rows=len(results)):
+        return _merge_counts(results, file_indices, len(mutation_catalog(mutation_type, kmer, symmetric)))
+
+
+@profiled()
+def build_matrix(vcf_paths, fasta, outpath, kmer=3, symmetric=True, matrix_format='sigprofiler', mutation_type='SBS', cache_dir=None, **kwargs):
+    """build a mutation matrix straight from VCF files, see count_mutations for how the VCF files are streamed
+
+    Args:
+        vcf_paths (list): paths to VCF format files
+        fasta (path): path to the reference genome
+        outpath (path): path to the output mutation matrix, in the binary format if it ends with .npz
+        kmer (int, optional): kmer size. Defaults to 3.
+        symmetric (bool, optional): whether mutation is symmetric. Defaults to True.
+        matrix_format (str, optional): 'sigprofiler' (mutation types as rows, sorted alphabetically)
+            or 'hdp' (samples as rows, mutation types ordered as in gen_context). Defaults to 'sigprofiler'.
+        mutation_type (str, optional): 'SBS', 'DBS' or 'ID', giving an SBS, DBS78 or ID83 matrix (COSMIC order in both formats 
+            for DBS78 and ID83). Defaults to 'SBS'.
+        cache_dir (path, optional): directory caching the matrix, keyed by the content of the VCF files and the reference and by the
+            options that change the matrix (see result_cache.cached_call). Defaults to None (no cache).
+        **kwargs: passed to count_mutations, eg sparse=True to keep the counts sparse (saved as a sparse .npz matrix)
+    """
+    if matrix_format not in ('sigprofiler', 'hdp'):
+        raise ValueError("matrix_format should be either 'sigprofiler' or 'hdp'")
+    if cache_dir is not None:
+        vcf_paths = [vcf_paths] if isinstance(vcf_paths, str) else list(vcf_paths)
+        params = dict(kmer=kmer, symmetric=symmetric, matrix_format=matrix_format, mutation_type=mutation_type, 
+                      samples=[sample_name(vcf) for vcf in vcf_paths],
+                      **{key: value for key, value in kwargs.items() if key not in _PERFORMANCE_OPTIONS})
+        cached_call(cache_dir, 'build_matrix', vcf_paths + [fasta], outpath, 
+                    lambda: build_matrix(vcf_paths, fasta, outpath, kmer, symmetric, matrix_format, mutation_type, **kwargs), params=params)
+        return
+    catalog = mutation_catalog(mutation_type, kmer, symmetric)
+    counts, samples = count_mutations(vcf_paths, fasta, kmer=kmer, symmetric=symmetric, mutation_type=mutation_type, **kwargs)
+    if matrix_format == 'hdp':
+        write_matrix(outpath, counts, samples, catalog.labels, 'hdp')
+    elif is_sparse(counts):
+        write_matrix(outpath, counts.take_columns(catalog.sigprofiler_order).T, catalog.sigprofiler_labels, samples, 'sigprofiler')
+    else:
+        write_matrix(outpath, catalog.to_sigprofiler(counts, axis=1).T, catalog.sigprofiler_labels, samples, 'sigprofiler')
+
+
+# options of count_mutations that do not change the counts, left out of the cache key of build_matrix
+_PERFORMANCE_OPTIONS = ('chunksize', 'n_jobs', 'chrom_shards', 'io_threads')
+
+
+def _chunk_codes(reference, chrom, pos, ref, alt, kmer, symmetric, mutation_type='SBS'):
+    """codes of the mutations of one chromosome in a chunk (SNV contexts, DBS78 or ID83 classes), -1 for skipped variants"""
+    contig = reference.contig(chrom)
+    if mutation_type != 'SBS':
+        codes, mismatch = (get_dbs_codes if mutation_type == 'DBS' else get_id_codes)(contig, pos, ref, alt)
+        if np.any(mismatch):
+            position, allele = pos[mismatch][0], ref[mismatch][0]
+            raise KeyError(f'position {position} of {chrom} is {contig[position:position + len(allele)]}, not {allele}')
+        return codes
+    codes, flagged = get_context_codes(contig, pos, ref, alt, kmer=kmer, symmetric=symmetric)
+    if np.any(flagged):
+        # only SNVs whose central base disagrees with the reference are an error, anything else is skipped
+        ref, alt, pos = pd.Series(ref[flagged]), pd.Series(alt[flagged]), pos[flagged]
+        is_snv = (ref.str.len() == 1) & (alt.str.len() == 1) & ref.str.upper().isin(list('ACGT')) & (pos >= 0) & (pos < len(contig))
+        if is_snv.any():
+            ref, pos = ref[is_snv].to_numpy(), pos[is_snv.to_numpy()]
+            bases = contig.bases(pos).tobytes().decode()
+            for base, allele, position in zip(bases, ref, pos):
+                if base != allele.upper():
+                    raise KeyError(f'position {position} of {chrom} is {base}, not {allele}')
+    return codes
+
+
+def _shard_contigs(reference, n_shards):
+    """split the contigs of the reference into n_shards groups of similar total length"""
+    shards = [set() for _ in range(n_shards)]
+    sizes = [0] * n_shards
+    for contig in sorted(reference.contigs, key=reference.length, reverse=True):
+        smallest = sizes.index(min(sizes))
+        shards[smallest].add(contig)
+        sizes[smallest] += reference.length(contig)
+    return shards
+
+
+def _read_chunks(vcf, sample_colname, chrom_colname, pos_colname, ref_colname, alt_colname, chunksize, sep):
+    """columns of the chunks of a VCF file as arrays: chromosomes, positions, reference and mutated alleles, samples
+    and the row of the file each chunk starts at"""
+    usecols = [chrom_colname, pos_colname, ref_colname, alt_colname] + ([sample_colname] if sample_colname else [])
+    dtype = {chrom_colname: str, ref_colname: str, alt_colname: str}
+    if sample_colname:
+        dtype[sample_colname] = str
+    row_offset = 0
+    for chunk in read_vcf_chunks(vcf, chunksize=chunksize, pos_colname=pos_colname, sep=sep, usecols=usecols, dtype=dtype):
+        samples = chunk[sample_colname].to_numpy() if sample_colname else np.full(len(chunk), sample_name(vcf), dtype=object)
+        yield (chunk[chrom_colname].to_numpy(), chunk[pos_colname].to_numpy(), chunk[ref_colname].to_numpy(), 
+               chunk[alt_colname].to_numpy(), samples, row_offset)
+        row_offset += len(chunk)
+
+
+def _count_file(reference, vcf, kmer, symmetric, sample_colname, chrom_colname, pos_colname, ref_colname, alt_colname, 
+                chunksize, sep, sparse=False, mutation_type='SBS'):
+    """count the mutations of one VCF file
+
+    Returns:
+        tuple: counts (samples x contexts), sample names and the row at which each sample first appears (-1 for file samples)
+    """
+    counter = _file_counter(vcf, sample_colname, len(mutation_catalog(mutation_type, kmer, symmetric)), sparse)
+    with stage('count_shard', vcf=str(vcf)) as record:
+        for chrom, pos, ref, alt, samples, row_offset in _read_chunks(vcf, sample_colname, chrom_colname, pos_colname, 
+                                                                      ref_colname, alt_colname, chunksize, sep):
+            _count_chunk(counter, reference, _chrom_rows(chrom), pos, ref, alt, samples, np.arange(len(pos)) + row_offset,
+                         kmer, symmetric, mutation_type)
+            record.add_rows(len(pos))
+    return counter.counts, counter.samples, counter.first_rows
+
+
+def _count_sharded(reference, vcf_paths, shards, n_jobs, kmer, symmetric, sample_colname, chrom_colname, pos_colname, 
+                   ref_colname, alt_colname, chunksize, sep, sparse=False, mutation_type='SBS'):
+    """parse each VCF file once in this process and classify the rows of each group of chromosomes of a chunk on a process pool,
+    keeping at most two tasks per worker in flight
+
+    Returns:
+        tuple: list of partial results (see _count_file) and the index of the file of each
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    n_classes = len(mutation_catalog(mutation_type, kmer, symmetric))
+    shard_of = {contig: i for i, contigs in enumerate(shards) for contig in contigs}
+    results, file_indices, pending = [], [], deque()
+
+    def collect(max_pending):
+        while len(pending) > max_pending:
+            file_index, future = pending.popleft()
+            results.append(future.result())
+            file_indices.append(file_index)
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_set_worker_reference, initargs=(reference,)) as executor:
+        for file_index, vcf in enumerate(vcf_paths):
+            counter = _file_counter(vcf, sample_colname, n_classes, sparse)
+            results.append((counter.counts, counter.samples, counter.first_rows))
+            file_indices.append(file_index)
+            with stage('count_shard', vcf=str(vcf)) as record:
+                for chrom, pos, ref, alt, samples, row_offset in _read_chunks(vcf, sample_colname, chrom_colname, pos_colname, 
+                                                                              ref_colname, alt_colname, chunksize, sep):
+                    # chromosomes missing from the reference go to the first group, where they raise a KeyError
+                    shard = pd.Series(chrom).map(shard_of).fillna(0).to_numpy(dtype=np.int64)
+                    for i in np.unique(shard):
+                        rows = np.flatnonzero(shard == i)
+                        future = executor.submit(_count_rows, chrom[rows], pos[rows], ref[rows], alt[rows], samples[rows], 
+                                                 rows + row_offset, kmer, symmetric, sparse, mutation_type)
+                        pending.append((file_index, future))
+                    record.add_rows(len(pos))
+                    collect(2 * n_jobs)
+        collect(0)
+    return results, file_indices
+
+
+# reference of a worker process of _count_sharded, mapped once per worker
+_worker_reference = None
+
+
+def _set_worker_reference(reference):
+    global _worker_reference
+    _worker_reference = reference
+
+
+def _count_rows(chrom, pos, ref, alt, samples, input_rows, kmer, symmetric, sparse, mutation_type):
+    """count the mutations of some rows of a chunk against the reference of the worker, see _count_file"""
+    counter = _MatrixCounter(len(mutation_catalog(mutation_type, kmer, symmetric)), sparse=sparse)
+    _count_chunk(counter, _worker_reference, _chrom_rows(chrom), pos, ref, alt, samples, input_rows, kmer, symmetric, mutation_type)
+    return counter.counts, counter.samples, counter.first_rows
+
+
+def _file_counter(vcf, sample_colname, n_classes, sparse):
+    """_MatrixCounter of a VCF file, holding its sample unless the samples are given by a column"""
+    counter = _MatrixCounter(n_classes, sparse=sparse)
+    if not sample_colname:
+        counter.sample_index([sample_name(vcf)], [-1])
+    return counter
+
+
+def _chrom_rows(chrom):
+    """rows of each chromosome of an array of chromosomes, in order of first appearance"""
+    return pd.Series(np.arange(len(chrom))).groupby(chrom, sort=False).indices
+
+
+def _count_stream(reference, vcf_paths, io_threads, kmer, symmetric, sparse, mutation_type):
+    """count the mutations of VCF files read by stream_vcfs, one sample per file
+
+    Returns:
+        tuple: counts (samples x contexts) and sample names, in file order
+    """
+    counter = _MatrixCounter(len(mutation_catalog(mutation_type, kmer, symmetric)), sparse=sparse)
+    for vcf in vcf_paths:
+        counter.sample_index([sample_name(vcf)], [-1])
+    with stage('count_stream', files=len(vcf_paths)) as record:
+        for batch in stream_vcfs(vcf_paths, n_threads=io_threads, max_files=io_threads):
+            _count_chunk(counter, reference, batch.by_chrom(), batch.pos, batch.ref, batch.alt, batch.sample,
+                         np.arange(len(batch)), kmer, symmetric, mutation_type)
+            record.add_rows(len(batch))
+    return counter.counts, counter.samples
+
+
+def _count_chunk(counter, reference, chrom_rows, pos, ref, alt, samples, input_rows, kmer, symmetric, mutation_type):
+    """add the mutations of a chunk to a _MatrixCounter, chrom_rows maps each chromosome to its rows of the chunk
+    and input_rows gives the row of the input of each"""
+    for chrom, rows in chrom_rows.items():
+        codes = _chunk_codes(reference, chrom, pos[rows], ref[rows], alt[rows], kmer, symmetric, mutation_type)
+        counter.add(samples[rows], codes, input_rows[rows])
+
+
+def _merge_counts(results, file_indices, n_classes):
+    """sum the partial counts of the shards, ordering samples by their first appearance (file, then smallest input row),
+    so that the order does not depend on how the rows were split between shards"""
+    first_seen = {}
+    for (_, samples, first_rows), file_index in zip(results, file_indices):
+        for sample, first_row in zip(samples, first_rows):
+            first_seen[sample] = min(first_seen.get(sample, (file_index, first_row)), (file_index, first_row))
+    samples = sorted(first_seen, key=first_seen.get)
+    rows = {sample: i for i, sample in enumerate(samples)}
+    if results and is_sparse(results[0][0]):
+        parts = []
+        for shard_counts, shard_samples, _ in results:
+            shard_rows, codes, values = shard_counts.tocoo()
+            parts.append((np.array([rows[sample] for sample in shard_samples], dtype=np.int64)[shard_rows], codes, values))
+        return SparseCounts.from_coo(*[np.concatenate([np.zeros(0, dtype=np.int64)] + [part[i] for part in parts]) for i in range(3)],
+                                     (len(samples), n_classes)), samples
+    counts = np.zeros((len(samples), n_classes), dtype=np.int64)
+    for shard_counts, shard_samples, _ in results:
+        counts[[rows[sample] for sample in shard_samples]] += shard_counts
+    return counts, samples
+
+
+# number of chunks after which a sparse counter sums its triplets
+_SPARSE_MERGE_EVERY = 64
+
+
+class _MatrixCounter:
+    """accumulates samples x contexts counts, adding a row whenever a new sample turns up.
+    Sparse counters keep one (sample, context, count) triplet per distinct pair of each chunk instead of a dense array"""
+
+    def __init__(self, n_classes, sparse=False):
+        self.n_classes = n_classes
+        self.sparse = sparse
+        self.samples = []
+        self.first_rows = []
+        self._rows = {}
+        self._counts = np.zeros((0, n_classes), dtype=np.int64)
+        self._triplets = []
+
+    @property
+    def counts(self):
+        """counts so far, np.array or SparseCounts"""
+        if not self.sparse:
+            return self._counts
+        triplets = [np.concatenate([np.zeros(0, dtype=np.int64)] + [triplet[i] for triplet in self._triplets]) for i in range(3)]
+        return SparseCounts.from_coo(*triplets, (len(self.samples), self.n_classes))
+
+    def sample_index(self, samples, first_rows):
+        """row of each sample in counts, new samples are added with the row of the input at which they first appear.
+        Rows may be added out of input order (eg one chromosome at a time), so the first row of a known sample is lowered
+        when an earlier one turns up"""
+        for sample, first_row in zip(samples, first_rows):
+            row = self._rows.get(sample)
+            if row is not None and first_row < self.first_rows[row]:
+                self.first_rows[row] = first_row
+        new = [(sample, first_row) for sample, first_row in zip(samples, first_rows) if sample not in self._rows]
+        if new:
+            for sample, first_row in new:
+                self._rows[sample] = len(self.samples)
+                self.samples.append(sample)
+                self.first_rows.append(first_row)
+            if not self.sparse:
+                self._counts = np.vstack([self._counts, np.zeros((len(new), self.n_classes), dtype=np.int64)])
+        return np.array([self._rows[sample] for sample in samples], dtype=np.int64)
+
+    def add(self, samples, codes, input_rows):
+        """add one count per (sample, code) pair, codes of -1 are ignored"""
+        keep = codes >= 0
+        samples, codes, input_rows = samples[keep], codes[keep], input_rows[keep]
+        if not len(codes):
+            return
+        inverse, unique_samples = pd.factorize(samples) # order of first appearance
+        first = np.unique(inverse, return_index=True)[1]
+        rows = self.sample_index(list(unique_samples), input_rows[first].tolist())
+        if self.sparse:
+            keys, counts = np.unique(inverse * self.n_classes + codes, return_counts=True)
+            self._triplets.append((rows[keys // self.n_classes], keys % self.n_classes, counts.astype(np.int64)))
+            if len(self._triplets) >= _SPARSE_MERGE_EVERY:
+                self._triplets = [self.counts.tocoo()] # sum repeated pairs so that memory stays bound by the nonzero counts
+            return
+        counts = np.bincount(inverse * self.n_classes + codes, minlength=len(unique_samples) * self.n_classes)
+        self._counts[rows] += counts.reshape(len(unique_samples), self.n_classes)
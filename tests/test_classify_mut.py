@@ -0,0 +1,108 @@
+import pytest
+import numpy as np
+
+from mutationsPy.classify_mut import get_dbs_context, get_dbs_codes, get_id_context, get_id_codes
+from mutationsPy.encode_context import id_catalog
+from mutationsPy.gen_context import gen_dbs_context
+from mutationsPy.get_mut import complementary_mut
+
+SEQ = 'ACGTTTTTACGATCGATCGAAACCCGGGTTTAGCTAGCTAG'
+
+
+def test_get_dbs_context():
+    assert get_dbs_context(SEQ, 0, 'AC', 'CA') == 'AC>CA'
+    # other strand
+    assert get_dbs_context(SEQ, 2, 'GT', 'TG') == 'AC>CA'
+    assert get_dbs_context(SEQ, 27, 'GT', 'AA') == complementary_mut('GT>AA')
+    with pytest.raises(KeyError):
+        get_dbs_context(SEQ, 1, 'AC', 'CA')
+    with pytest.raises(ValueError):
+        get_dbs_context(SEQ, 0, 'AC', 'AA')
+
+def test_get_dbs_codes():
+    codes, mismatch = get_dbs_codes(SEQ, [0, 0, 2, 40, 5, 0], ['AC', 'AG', 'GT', 'AG', 'TT', 'ACG'], ['CA', 'CA', 'TG', 'TT', 'NA', 'CAT'])
+    assert list(codes) == [0, -1, 0, -1, -1, -1]
+    assert list(mismatch) == [False, True, False, False, False, False]
+    # every substitution of both bases of a dinucleotide is one of the 78 classes
+    dinucleotides = [a + b for a in 'ACGT' for b in 'ACGT']
+    pairs = [(ref, alt) for ref in dinucleotides for alt in dinucleotides if ref[0] != alt[0] and ref[1] != alt[1]]
+    seq = ''.join(ref for ref, _ in pairs)
+    codes, _ = get_dbs_codes(seq, np.arange(len(pairs)) * 2, [ref for ref, _ in pairs], [alt for _, alt in pairs])
+    labels = np.array(gen_dbs_context())[codes]
+    for (ref, alt), label in zip(pairs, labels):
+        assert label in (f'{ref}>{alt}', complementary_mut(f'{ref}>{alt}'))
+    assert sorted(set(codes)) == list(range(78))
+
+@pytest.mark.parametrize('pos, ref, alt, expected', [
+    (6, 'TT', 'T', '1:Del:T:4'),
+    (0, 'AC', 'A', '1:Del:C:0'),
+    (18, 'GA', 'G', '1:Del:T:2'),
+    (0, 'A', 'AT', '1:Ins:T:0'),
+    (2, 'G', 'GT', '1:Ins:T:5'),
+    (24, 'C', 'CC', '1:Ins:C:3'),
+    (8, 'A', 'ACGAT', '4:Ins:R:2'),
+    (8, 'ACGAT', 'A', '4:Del:R:1'),
+])
+def test_get_id_context(pos, ref, alt, expected):
+    assert get_id_context(SEQ, pos, ref, alt) == expected
+
+@pytest.mark.parametrize('seq, pos, ref, expected', [
+    ('AAAACGTACGGG', 3, 'ACGT', '3:Del:R:0'),
+    # prefix CG of the deletion follows it
+    ('AAAACGTCGAGG', 3, 'ACGT', '3:Del:M:2'),
+    # suffix CG of the deletion precedes it
+    ('TTCGACGTT', 3, 'GACG', '3:Del:M:2'),
+    ('GGGGACGTACACCCC', 3, 'GACGTAC', '5:Del:M:2'),
+])
+def test_get_id_context_microhomology(seq, pos, ref, expected):
+    assert get_id_context(seq, pos, ref, ref[0]) == expected
+
+def test_get_id_context_invalid():
+    with pytest.raises(KeyError):
+        get_id_context(SEQ, 0, 'AG', 'A')
+    with pytest.raises(ValueError):
+        get_id_context(SEQ, 0, 'AC', 'GT')
+
+def naive_id_context(seq, pos, ref, alt):
+    """ID83 class of one indel, base by base"""
+    deletion = len(ref) > len(alt)
+    unit = ref[1:] if deletion else alt[1:]
+    size, start = len(unit), pos + 1
+    after = start + size if deletion else start
+    right = 0
+    while right < 5 and seq[after + right * size:after + (right + 1) * size] == unit:
+        right += 1
+    left = 0
+    while left < 5 and start - (left + 1) * size >= 0 and seq[start - (left + 1) * size:start - left * size] == unit:
+        left += 1
+    repeats = min(left + right, 5)
+    kind = 'Del' if deletion else 'Ins'
+    if size == 1:
+        return f"1:{kind}:{'C' if unit in 'CG' else 'T'}:{repeats}"
+    if deletion and repeats == 0:
+        prefix = next((i for i in range(size) if after + i >= len(seq) or seq[after + i] != unit[i]), size)
+        suffix = next((i for i in range(size) if start - 1 - i < 0 or seq[start - 1 - i] != unit[-1 - i]), size)
+        if max(prefix, suffix) > 0:
+            return f'{min(size, 5)}:Del:M:{min(max(prefix, suffix), 5)}'
+    return f'{min(size, 5)}:{kind}:R:{repeats}'
+
+def test_get_id_codes_random():
+    rng = np.random.default_rng(0)
+    # short repeated motifs, so that repeats and microhomologies are common
+    seq = ''.join(rng.choice(['A', 'C', 'AC', 'AGT', 'GT', 'T', 'ACGTT'], size=3000))
+    n = 2000
+    pos = rng.integers(0, len(seq) - 20, n)
+    lengths = rng.integers(1, 8, n)
+    deletion = rng.random(n) < 0.5
+    ref = [seq[p:p + 1 + length] if d else seq[p] for p, length, d in zip(pos, lengths, deletion)]
+    alt = [seq[p] if d else seq[p] + seq[p + 3:p + 3 + length] for p, length, d in zip(pos, lengths, deletion)]
+    codes, mismatch = get_id_codes(seq, pos, np.array(ref, dtype=object), np.array(alt, dtype=object))
+    assert not mismatch.any()
+    expected = [naive_id_context(seq, p, r, a) for p, r, a in zip(pos.tolist(), ref, alt)]
+    assert list(id_catalog().labels[codes]) == expected
+
+def test_get_id_codes_skipped():
+    codes, mismatch = get_id_codes(SEQ, [6, 100, 2, 2, 2, 39, 1], ['TT', 'A', 'GT', 'G', 'G', 'AGT', 'CT'], ['T', 'AT', 'GA', 'GN', 'T', 'A', 'C'])
+    assert list(codes[1:]) == [-1] * 6
+    assert codes[0] >= 0
+    assert list(mismatch) == [False] * 6 + [True]
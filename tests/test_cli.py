@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from mutationsPy.cli import main, read_manifest, run_batch
+
+SIGPROFILER_PATH = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+
+
+def test_cli_imports_no_numpy():
+    code = 'import sys, mutationsPy.cli; print("numpy" in sys.modules, "pandas" in sys.modules)'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ['False', 'False']
+
+
+def test_main(tmp_path):
+    main(['sigprofiler_to_hdp', '--sigprofiler_path', SIGPROFILER_PATH, '--hdp_outpath', str(tmp_path / 'hdp.txt')])
+    expected = pd.read_csv('tests/test_data/mut_matrix/hdp_mutmat.txt', sep = '\t')
+    assert pd.read_csv(tmp_path / 'hdp.txt', sep = '\t').equals(expected)
+
+
+def write_manifest(tmp_path, lines):
+    manifest = tmp_path / 'jobs.txt'
+    manifest.write_text('\n'.join(lines) + '\n')
+    return str(manifest)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_run_batch(tmp_path, n_jobs):
+    manifest = write_manifest(tmp_path, [
+        '# conversions of one cohort',
+        f'sigprofiler_to_hdp --sigprofiler_path {SIGPROFILER_PATH} --hdp_outpath {tmp_path}/hdp.txt',
+        '',
+        f'convert_format --inpath {SIGPROFILER_PATH} --outpath "{tmp_path}/matrix copy.npz"',
+        f'concat_sigprofiler_mutmats --mutmats {SIGPROFILER_PATH} {SIGPROFILER_PATH} --outpath {tmp_path}/concat.txt',
+    ])
+    assert [line_number for line_number, _ in read_manifest(manifest)] == [2, 4, 5]
+    assert run_batch(manifest, n_jobs=n_jobs) == 0
+    for name in ['hdp.txt', 'matrix copy.npz', 'concat.txt']:
+        assert (tmp_path / name).exists()
+    assert main(['batch', '--manifest', manifest, '--n_jobs', str(n_jobs)]) == 0
+
+
+def test_run_batch_failure(tmp_path, capsys):
+    manifest = write_manifest(tmp_path, [
+        f'hdp_to_sigprofiler --hdp_path {tmp_path}/missing.txt --sigprofiler_outpath {tmp_path}/out.txt',
+        f'sigprofiler_to_hdp --sigprofiler_path {SIGPROFILER_PATH} --hdp_outpath {tmp_path}/hdp.txt',
+    ])
+    assert run_batch(manifest) == 1
+    assert 'line 1' in capsys.readouterr().err
+    assert (tmp_path / 'hdp.txt').exists()
+
+
+@pytest.mark.parametrize('line', ['not_a_command --inpath x', 'convert_format --inpath x', 'convert_format --inpath x --outpath y.npz --sparse --dense', 'batch --manifest jobs.txt'])
+def test_read_manifest_invalid(tmp_path, line):
+    manifest = write_manifest(tmp_path, [line])
+    with pytest.raises(ValueError):
+        read_manifest(manifest)
@@ -0,0 +1,67 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from mutationsPy.gen_context import gen_context
+from mutationsPy.get_mut import symmetrise_context
+from mutationsPy.encode_context import collapse_table
+from mutationsPy.collapse_context import collapse_counts, aggregate_counts, collapse_matrix
+
+
+def _collapse_label(context, target_kmer):
+    # trim the flanks of a label, eg AA[C>G]TC -> A[C>G]T
+    flank, target_flank = (len(context) - 5) // 2, target_kmer // 2
+    mutation = context[flank:flank + 5]
+    if target_kmer == 1:
+        return mutation[1:4]
+    return context[flank - target_flank:flank] + mutation + context[flank + 5:flank + 5 + target_flank]
+
+@pytest.mark.parametrize('kmer, target_kmer, symmetric, target_symmetric', 
+                         [(5, 3, True, True), (5, 1, True, True), (3, 3, False, True), (5, 3, False, True), (5, 3, False, False)])
+def test_collapse_table(kmer, target_kmer, symmetric, target_symmetric):
+    contexts = gen_context(kmer, symmetric)
+    target = gen_context(target_kmer, target_symmetric)
+    expected = [_collapse_label(symmetrise_context(context) if target_symmetric else context, target_kmer) for context in contexts]
+    assert [target[code] for code in collapse_table(kmer, target_kmer, symmetric, target_symmetric)] == expected
+
+def test_collapse_table_errors():
+    with pytest.raises(ValueError):
+        collapse_table(3, 5)
+    with pytest.raises(ValueError):
+        collapse_table(3, 3, symmetric=True, target_symmetric=False)
+
+def test_collapse_counts():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 10, size=(4, 1536))
+    collapsed = collapse_counts(counts, 5, 3)
+    assert collapsed.shape == (4, 96)
+    assert collapsed.dtype == np.int64
+    assert np.array_equal(collapsed.sum(axis=1), counts.sum(axis=1))
+    assert np.array_equal(collapse_counts(collapsed, 3, 1), collapse_counts(counts, 5, 1))
+    assert np.array_equal(collapse_counts(counts.T, 5, 3, axis=0), collapsed.T)
+
+def test_aggregate_counts():
+    counts = np.array([[1., 2., 3., 4.]])
+    assert np.array_equal(aggregate_counts(counts, [2, 0, 2, 0], 4), [[6., 0., 4., 0.]])
+
+@pytest.mark.parametrize('layout', ['sigprofiler', 'hdp'])
+def test_collapse_matrix(tmp_path, monkeypatch, layout):
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 200)
+    rng = np.random.default_rng(1)
+    contexts = gen_context(3, symmetric=False)
+    hdp = pd.DataFrame(rng.integers(0, 10, size=(3, len(contexts))), index = ['s1', 's2', 's3'], columns = contexts)
+    inpath, outpath = str(tmp_path / 'matrix.txt'), str(tmp_path / 'collapsed.txt')
+    if layout == 'sigprofiler':
+        hdp.T.sort_index().rename_axis('MutationType').to_csv(inpath, sep = '\t')
+    else:
+        hdp.to_csv(inpath, sep = '\t', index_label = False)
+    collapse_matrix(inpath, outpath, 1, target_symmetric=True, layout=layout)
+    expected = hdp.T.groupby([symmetrise_context(context)[2:5] for context in contexts]).sum()
+    if layout == 'sigprofiler':
+        result = pd.read_csv(outpath, sep = '\t', index_col = 0)
+        assert list(result.index) == sorted(gen_context(1))
+        assert result.equals(expected.rename_axis('MutationType'))
+    else:
+        result = pd.read_csv(outpath, sep = '\t')
+        assert list(result.columns) == gen_context(1)
+        assert result.equals(expected.T.loc[:, gen_context(1)])
@@ -0,0 +1,90 @@
+import pytest
+import numpy as np
+
+from mutationsPy.gen_context import gen_context, gen_dbs_context, gen_id_context
+from mutationsPy.get_mut import symmetrise_context, rv_context, get_wt_seq
+from mutationsPy.encode_context import (n_contexts, encode_contexts, decode_contexts, encode_seqs, decode_seqs, 
+                                        reverse_complement_table, rv_context_table, symmetrise_table, wt_seq_table,
+                                        context_catalog, infer_context_catalog, dbs_catalog, id_catalog, mutation_catalog, 
+                                        infer_mutation_catalog)
+
+def test_n_contexts():
+    assert n_contexts(1) == len(gen_context(1))
+    assert n_contexts(5, symmetric=False) == len(gen_context(5, symmetric=False))
+    with pytest.raises(ValueError):
+        n_contexts(4)
+
+@pytest.mark.parametrize('kmer', [1, 3, 5])
+@pytest.mark.parametrize('symmetric', [True, False])
+def test_encode_decode_contexts(kmer, symmetric):
+    contexts = gen_context(kmer, symmetric)
+    codes = encode_contexts(contexts, kmer, symmetric)
+    assert list(codes) == list(range(len(contexts)))
+    assert list(decode_contexts(codes, kmer, symmetric)) == contexts
+
+def test_encode_contexts_invalid():
+    assert list(encode_contexts(['A[A>C]T', 'T[T>G]T'], symmetric=False)) == [3, 191]
+    with pytest.raises(ValueError):
+        encode_contexts(['A[A>C]T'], symmetric=True)
+    with pytest.raises(ValueError):
+        encode_contexts(['A[C>C]T'])
+    with pytest.raises(ValueError):
+        encode_contexts(['N[C>A]T'])
+    with pytest.raises(ValueError):
+        encode_contexts(['AA[C>A]T'])
+
+def test_encode_decode_seqs():
+    assert list(encode_seqs(['AAA', 'ACG', 'TTT'])) == [0, 6, 63]
+    assert list(decode_seqs([0, 6, 63], 3)) == ['AAA', 'ACG', 'TTT']
+    assert list(decode_seqs(reverse_complement_table(3)[encode_seqs(['AAC', 'ACG'])], 3)) == ['GTT', 'CGT']
+    with pytest.raises(ValueError):
+        encode_seqs(['ANA'])
+
+@pytest.mark.parametrize('kmer', [3, 5])
+def test_context_tables(kmer):
+    asymmetric = gen_context(kmer, symmetric=False)
+    symmetric = gen_context(kmer, symmetric=True)
+    assert [asymmetric[code] for code in rv_context_table(kmer)] == [rv_context(context) for context in asymmetric]
+    assert [symmetric[code] for code in symmetrise_table(kmer)] == [symmetrise_context(context) for context in asymmetric]
+    assert list(decode_seqs(wt_seq_table(kmer, symmetric=False), kmer)) == [get_wt_seq(context) for context in asymmetric]
+    assert list(decode_seqs(wt_seq_table(kmer), kmer)) == [get_wt_seq(context) for context in symmetric]
+    with pytest.raises(ValueError):
+        symmetrise_table(kmer)[0] = 1
+
+@pytest.mark.parametrize('kmer, symmetric', [(1, True), (3, True), (3, False), (5, True)])
+def test_context_catalog(kmer, symmetric):
+    catalog = context_catalog(kmer, symmetric)
+    assert context_catalog(kmer, symmetric) is catalog
+    assert list(catalog.labels) == gen_context(kmer, symmetric)
+    assert list(catalog.sigprofiler_labels) == sorted(gen_context(kmer, symmetric))
+    assert np.array_equal(catalog.labels[catalog.sigprofiler_order], catalog.sigprofiler_labels)
+    assert np.array_equal(catalog.sigprofiler_labels[catalog.hdp_order], catalog.labels)
+    assert catalog.index[catalog.labels[5]] == 5
+    assert infer_context_catalog(catalog.sigprofiler_labels) is catalog
+    counts = np.arange(3 * len(catalog)).reshape(3, len(catalog))
+    assert np.array_equal(catalog.to_hdp(catalog.to_sigprofiler(counts, axis=1), axis=1), counts)
+
+def test_context_catalog_codes():
+    catalog = context_catalog(3)
+    assert list(catalog.codes(['A[C>A]A', 'T[T>G]T'])) == [0, 95]
+    assert list(catalog.codes(np.array(['A[C>A]C', 'A[A>C]A']), default=-1)) == [1, -1]
+    with pytest.raises(KeyError):
+        catalog.codes(['A[A>C]A'])
+    assert infer_context_catalog(['A[A>C]A', 'A[C>A]A']) is context_catalog(3, symmetric=False)
+    with pytest.raises(ValueError):
+        infer_context_catalog(['A[C>A]'])
+
+def test_mutation_catalog():
+    assert mutation_catalog('SBS', 5, False) is context_catalog(5, False)
+    assert mutation_catalog('DBS') is dbs_catalog()
+    assert mutation_catalog('ID') is id_catalog()
+    with pytest.raises(ValueError):
+        mutation_catalog('SV')
+    for catalog, labels in [(dbs_catalog(), gen_dbs_context()), (id_catalog(), gen_id_context())]:
+        # COSMIC order in both layouts
+        assert list(catalog.labels) == list(catalog.sigprofiler_labels) == labels
+        assert list(catalog.sigprofiler_order) == list(catalog.hdp_order) == list(range(len(labels)))
+        assert infer_mutation_catalog(labels[::-1]) is catalog
+    assert infer_mutation_catalog(['A[C>A]A']) is context_catalog(3)
+    with pytest.raises(ValueError):
+        infer_mutation_catalog(['AC>CA>'])
@@ -0,0 +1,46 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from mutationsPy.simulate_mut_matrix import sample_mut_mat_simple, gen_mut_matrix
+from mutationsPy.fit_signatures import fit_exposures, fit_mut_matrix
+
+SIGNATURES = np.array([[0.5, 0.3, 0.1, 0.1, 0.0], 
+                       [0.0, 0.1, 0.2, 0.3, 0.4], 
+                       [0.2, 0.2, 0.2, 0.2, 0.2]])
+
+@pytest.mark.parametrize('method', ['kl', 'frobenius'])
+def test_fit_exposures_exact(method):
+    exposures = np.array([[0.2, 0.5, 0.3], [1, 0, 0], [0, 0.25, 0.75], [0, 0, 0]])
+    burdens = np.array([100, 50, 400, 0])
+    mut_mat = sample_mut_mat_simple(exposures, burdens, SIGNATURES)
+    fitted = fit_exposures(mut_mat, SIGNATURES, method=method, max_iter=20000, tol=1e-9)
+    # multiplicative updates approach exposures of 0 slowly
+    assert np.allclose(fitted, exposures * burdens[:, None], atol=0.01 * burdens.max())
+    assert np.all(fitted[3] == 0)
+
+def test_fit_exposures_threads():
+    rng = np.random.default_rng(0)
+    mut_mat = rng.poisson(20, size=(50, 5))
+    expected = fit_exposures(mut_mat, SIGNATURES)
+    assert np.allclose(fit_exposures(mut_mat, SIGNATURES, n_jobs=3, chunksize=7), expected)
+    with pytest.raises(ValueError):
+        fit_exposures(mut_mat, SIGNATURES, method='other')
+    with pytest.raises(ValueError):
+        fit_exposures(mut_mat[:, :4], SIGNATURES)
+
+def test_fit_mut_matrix_round_trip():
+    rng = np.random.default_rng(1)
+    n_samples = 200
+    sig1 = rng.uniform(0, 1, n_samples)
+    exposure_matrix = pd.DataFrame({'sample_id': [f's{i}' for i in range(n_samples)], 'burdens': rng.integers(2000, 5000, n_samples),
+                                    'sig1': sig1, 'sig2': 1 - sig1})
+    signatures = pd.DataFrame({'Type': ['mut1', 'mut2', 'mut3', 'mut4', 'mut5'], 'sig1': SIGNATURES[0], 'sig2': SIGNATURES[1]})
+    mut_matrix = gen_mut_matrix(exposure_matrix, signatures, rng=2)
+    fitted = fit_mut_matrix(mut_matrix, signatures, n_jobs=2)
+    assert list(fitted.columns) == ['sample_id', 'burdens', 'sig1', 'sig2']
+    assert list(fitted['sample_id']) == list(exposure_matrix['sample_id'])
+    assert np.allclose(fitted[['sig1', 'sig2']].sum(axis=1), 1)
+    assert np.abs(fitted['sig1'] - exposure_matrix['sig1']).max() < 0.1
+    with pytest.raises(KeyError):
+        fit_mut_matrix(mut_matrix.drop(columns=['mut1']), signatures)
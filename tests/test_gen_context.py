@@ -1,8 +1,22 @@
-from mutationsPy.gen_context import gen_context
+from mutationsPy.gen_context import gen_context, gen_dbs_context, gen_id_context
 
 def test_gen_context():
     assert gen_context(1) == ['C>A', 'C>G', 'C>T', 'T>A', 'T>C', 'T>G']
     assert len(gen_context(3)) == 6 * (4**(3 - 1))
     assert len(gen_context(3, symmetric=False)) == 12 * (4**(3 - 1))
     assert len(gen_context(5)) == 6 * (4**(5 - 1))
-    assert len(gen_context(5, symmetric=False)) == 12 * (4**(5 - 1))
\ No newline at end of file
+    assert len(gen_context(5, symmetric=False)) == 12 * (4**(5 - 1))
+def test_gen_dbs_context():
+    dbs = gen_dbs_context()
+    assert len(dbs) == len(set(dbs)) == 78
+    assert dbs[:3] == ['AC>CA', 'AC>CG', 'AC>CT']
+    assert dbs[-1] == 'TT>GG'
+
+def test_gen_id_context():
+    indels = gen_id_context()
+    assert len(indels) == len(set(indels)) == 83
+    assert indels[:2] == ['1:Del:C:0', '1:Del:C:1']
+    assert indels[24] == '2:Del:R:0'
+    assert indels[48] == '2:Ins:R:0'
+    assert indels[72:] == ['2:Del:M:1', '3:Del:M:1', '3:Del:M:2', '4:Del:M:1', '4:Del:M:2', '4:Del:M:3', 
+                           '5:Del:M:1', '5:Del:M:2', '5:Del:M:3', '5:Del:M:4', '5:Del:M:5']
@@ -1,5 +1,7 @@
 import pytest
-from mutationsPy.get_mut import get_mut, get_context, get_wt_seq, complementary_seq, symmetrise_context
+import numpy as np
+from mutationsPy.get_mut import get_mut, get_context, get_contexts, get_context_codes, get_wt_seq, complementary_mut, complementary_seq, rv_context, symmetrise_context
+from mutationsPy.encode_context import decode_contexts
 
 def test_get_mut():
     assert get_mut('A[T>C]G') == 'T>C'
@@ -14,14 +16,61 @@ def test_get_context():
     with pytest.raises(KeyError):
         get_context('ACGTAC', pos=2, ref='T', alt='T')
 
+def test_get_contexts():
+    contexts, mismatch = get_contexts('ACGTACg', pos=[2, 3, 0, 6, 4, 2], ref=['G', 'T', 'A', 'G', 'C', 'GA'], alt=['T', 'C', 'C', 'A', 'A', 'T'])
+    assert list(contexts) == ['C[G>T]T', 'G[T>C]A', '', '', '', '']
+    assert list(mismatch) == [False, False, True, True, True, True]
+    contexts, mismatch = get_contexts(b'ACGTACG', pos=np.array([2, 3]), ref='G', alt='T', kmer=1)
+    assert list(contexts) == ['G>T', '']
+    assert list(mismatch) == [False, True]
+    contexts, _ = get_contexts('ACGTACG', pos=[3], ref=['T'], alt=['G'], kmer=5)
+    assert list(contexts) == [get_context('ACGTACG', pos=3, ref='T', alt='G', kmer=5)]
+    with pytest.raises(ValueError):
+        get_contexts('ACGTAC', pos=[2], ref=['G'], alt=['T'], kmer=4)
+
+def test_get_context_codes():
+    seq = 'ACGTACGNA'
+    codes, mismatch = get_context_codes(seq, pos=[2, 3, 2, 6, 1, 4], ref=['G', 'T', 'G', 'G', 'C', 'A'], alt=['T', 'C', 'G', 'T', 'T', 'N'])
+    assert list(mismatch) == [False, False, True, True, False, True]
+    assert list(decode_contexts(codes[~mismatch])) == ['A[C>A]G', 'G[T>C]A', 'A[C>T]G']
+    assert list(codes[mismatch]) == [-1, -1, -1]
+    codes, _ = get_context_codes(seq, pos=[2], ref=['G'], alt=['T'], symmetric=False)
+    assert list(decode_contexts(codes, symmetric=False)) == ['C[G>T]T']
+
+def test_get_context_codes_allele_types():
+    seq = 'ACGTACGNA'
+    pos, ref, alt = [2, 3, 2, 6, 1, 4], ['G', 't', 'GA', 'G', 'C', 'A'], ['T', 'C', 'G', 'é', 'T', '']
+    expected, mismatch = get_context_codes(seq, pos=pos, ref=ref, alt=alt)
+    assert list(mismatch) == [False, False, True, True, False, True]
+    # unicode arrays, object arrays of mixed lengths and non-ASCII alleles are masked the same way
+    for ref_alleles, alt_alleles in [(np.array(ref), np.array(alt)), (np.array(ref, dtype=object), np.array(alt, dtype=object)),
+                                     (np.array(ref, dtype=object), np.array(['T', 'C', 'G', 5, 'T', b'']))]:
+        codes, flagged = get_context_codes(seq, pos=pos, ref=ref_alleles, alt=alt_alleles)
+        assert list(flagged) == list(mismatch)
+        assert list(codes) == list(expected)
+    codes, flagged = get_context_codes(seq, pos=[2, 5], ref='G', alt='T')
+    assert list(flagged) == [False, True]
+    # as many characters as alleles, but not one each
+    _, flagged = get_context_codes(seq, pos=[2, 3], ref=np.array(['G', 'T'], dtype=object), alt=np.array(['', 'CA'], dtype=object))
+    assert list(flagged) == [True, True]
+
 def test_get_wt():
     assert get_wt_seq('A[C>T]G') == "ACG"
     assert get_wt_seq('ACT[G>A]CTT') == "ACTGCTT"
     assert get_wt_seq('ACT[GA>A]CTT') == "ACTGACTT"
 
+def test_complementary_mut():
+    assert complementary_mut('C>A') == 'G>T'
+    assert complementary_mut('AC>GT') == 'GT>AC'
+    with pytest.raises(ValueError):
+        complementary_mut('AC>G')
+
 def test_complementary_seq():
     assert complementary_seq('ACGGT') == 'ACCGT'
     
+def test_rv_context():
+    assert rv_context('AGG[A>C]CGT') == 'ACG[T>G]CCT'
+
 def test_symmetrise_context():
     assert symmetrise_context('AGG[A>C]CGT') == 'ACG[T>G]CCT'
     assert symmetrise_context('ACG[T>G]CCT') == 'ACG[T>G]CCT'
\ No newline at end of file
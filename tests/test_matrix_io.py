@@ -0,0 +1,125 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from mutationsPy.matrix_io import (save_npz, load_npz, read_matrix, read_matrix_labels, write_matrix, convert_matrix_format, 
+                                   iter_matrix_blocks, transpose_matrix, is_sparse_matrix)
+from mutationsPy.sparse_counts import SparseCounts
+
+def test_save_load_npz(tmp_path):
+    path = str(tmp_path / 'matrix.npz')
+    counts = np.arange(12, dtype=np.int32).reshape(3, 4)
+    save_npz(path, counts, ['A>C', 'A>G', 'A>T'], ['s1', 's2', 's3', 's4'], 'sigprofiler')
+    for mmap in (False, True):
+        loaded, rows, columns, layout = load_npz(path, mmap=mmap)
+        assert np.array_equal(loaded, counts)
+        assert loaded.dtype == np.int32
+        assert list(rows) == ['A>C', 'A>G', 'A>T']
+        assert list(columns) == ['s1', 's2', 's3', 's4']
+        assert layout == 'sigprofiler'
+    assert isinstance(load_npz(path, mmap=True)[0], np.memmap)
+    with np.load(path) as archive:
+        assert np.array_equal(archive['counts'], counts)
+    with pytest.raises(ValueError):
+        save_npz(path, counts, ['A>C'], ['s1'], 'sigprofiler')
+    with pytest.raises(ValueError):
+        save_npz(path, counts, ['A>C', 'A>G', 'A>T'], ['s1', 's2', 's3', 's4'], 'other')
+
+def test_read_matrix_transposes_binary(tmp_path):
+    path = str(tmp_path / 'matrix.npz')
+    counts = np.arange(6).reshape(2, 3)
+    write_matrix(path, counts, ['s1', 's2'], ['C>A', 'C>G', 'C>T'], 'hdp')
+    transposed, rows, columns = read_matrix(path, 'sigprofiler', mmap=True)
+    assert np.array_equal(transposed, counts.T)
+    assert list(rows) == ['C>A', 'C>G', 'C>T']
+    assert list(columns) == ['s1', 's2']
+
+@pytest.mark.parametrize('layout', ['sigprofiler', 'hdp'])
+def test_convert_matrix_format(tmp_path, layout):
+    text_path = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt' if layout == 'sigprofiler' else 'tests/test_data/mut_matrix/hdp_mutmat.txt'
+    binary_path, roundtrip_path = str(tmp_path / 'matrix.npz'), str(tmp_path / 'matrix.txt')
+    convert_matrix_format(text_path, binary_path, layout=layout)
+    convert_matrix_format(binary_path, roundtrip_path, layout=layout)
+    assert pd.read_csv(roundtrip_path, sep = '\t').equals(pd.read_csv(text_path, sep = '\t'))
+    counts, rows, columns = read_matrix(binary_path, layout)
+    assert counts.dtype == np.int64
+
+def test_read_matrix_labels(tmp_path):
+    for path, layout in [('tests/test_data/mut_matrix/sigprofiler_mutmat.txt', 'sigprofiler'), ('tests/test_data/mut_matrix/hdp_mutmat.txt', 'hdp')]:
+        _, rows, columns = read_matrix(path, layout)
+        labels = read_matrix_labels(path, layout)
+        assert np.array_equal(labels[0], rows) and np.array_equal(labels[1], columns)
+        binary_path = str(tmp_path / f'{layout}.npz')
+        convert_matrix_format(path, binary_path, layout)
+        labels = read_matrix_labels(binary_path, 'hdp' if layout == 'sigprofiler' else 'sigprofiler')
+        assert np.array_equal(labels[0], columns) and np.array_equal(labels[1], rows)
+
+def test_write_matrix_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 7)
+    path = str(tmp_path / 'matrix.txt')
+    counts = np.arange(24).reshape(6, 4)
+    write_matrix(path, counts, ['s1', 's2', 's3', 's4', 's5', 's6'], ['C>A', 'C>G', 'C>T', 'T>A'], 'hdp')
+    expected = pd.DataFrame(counts, index = ['s1', 's2', 's3', 's4', 's5', 's6'], columns = ['C>A', 'C>G', 'C>T', 'T>A'])
+    assert pd.read_csv(path, sep = '\t').equals(expected)
+
+def test_iter_matrix_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 5)
+    path = str(tmp_path / 'matrix.txt')
+    counts = np.arange(12).reshape(4, 3)
+    write_matrix(path, counts, ['C>A', 'C>G', 'C>T', 'T>A'], ['s1', 's2', 's3'], 'sigprofiler')
+    blocks = list(iter_matrix_blocks(path, 'sigprofiler'))
+    assert len(blocks) == 4
+    assert [label for labels, _ in blocks for label in labels] == ['C>A', 'C>G', 'C>T', 'T>A']
+    assert np.array_equal(np.vstack([block for _, block in blocks]), counts)
+    assert all(block.dtype == np.int64 for _, block in blocks)
+
+def test_transpose_matrix(tmp_path, monkeypatch):
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 6)
+    path = str(tmp_path / 'matrix.txt')
+    counts = np.arange(12).reshape(4, 3)
+    write_matrix(path, counts, ['C>A', 'C>G', 'C>T', 'T>A'], ['s1', 's2', 's3'], 'sigprofiler')
+    transposed, rows, columns = transpose_matrix(path, 'sigprofiler', str(tmp_path))
+    assert np.array_equal(transposed, counts.T)
+    assert transposed.dtype == np.int64
+    assert list(rows) == ['s1', 's2', 's3']
+    assert list(columns) == ['C>A', 'C>G', 'C>T', 'T>A']
+    del transposed
+    transposed, rows, columns = transpose_matrix(path, 'sigprofiler', str(tmp_path), take=[2, 0], destination=[1, -1, 2, 0])
+    assert np.array_equal(transposed, counts[[3, 0, 2]][:, [2, 0]].T)
+    assert list(rows) == ['s3', 's1']
+    assert list(columns) == ['T>A', 'C>A', 'C>T']
+
+def test_transpose_matrix_float_block(tmp_path, monkeypatch):
+    # a non-integer value in a later block upgrades what was already transposed
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 3)
+    path = str(tmp_path / 'matrix.txt')
+    counts = np.array([[1, 2, 3], [4, 5, 6], [7.5, 8, 9]])
+    write_matrix(path, counts, ['C>A', 'C>G', 'C>T'], ['s1', 's2', 's3'], 'sigprofiler')
+    transposed, _, _ = transpose_matrix(path, 'sigprofiler', str(tmp_path))
+    assert transposed.dtype == np.float64
+    assert np.array_equal(transposed, counts.T)
+
+def test_sparse_matrix(tmp_path, monkeypatch):
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 4)
+    counts = np.array([[0, 2, 0], [0, 0, 0], [3, 0, 4]])
+    text_path, sparse_path, dense_path, roundtrip_path = [str(tmp_path / name) for name in ('m.txt', 'sparse.npz', 'dense.npz', 'roundtrip.txt')]
+    write_matrix(text_path, counts, ['C>A', 'C>G', 'C>T'], ['s1', 's2', 's3'], 'sigprofiler')
+    convert_matrix_format(text_path, sparse_path, sparse=True)
+    assert is_sparse_matrix(sparse_path) and not is_sparse_matrix(text_path)
+    for mmap in (False, True):
+        loaded, rows, columns, layout = load_npz(sparse_path, mmap=mmap)
+        assert isinstance(loaded, SparseCounts)
+        assert loaded.nnz == 3
+        assert np.array_equal(loaded.toarray(), counts)
+    transposed, rows, columns = read_matrix(sparse_path, 'hdp')
+    assert np.array_equal(np.asarray(transposed), counts.T)
+    assert list(rows) == ['s1', 's2', 's3']
+    convert_matrix_format(sparse_path, roundtrip_path)
+    assert open(roundtrip_path).read() == open(text_path).read()
+    convert_matrix_format(sparse_path, dense_path, sparse=False)
+    assert not is_sparse_matrix(dense_path)
+    assert np.array_equal(load_npz(dense_path)[0], counts)
+    transposed, rows, columns = transpose_matrix(sparse_path, 'sigprofiler', str(tmp_path), take=[2, 0], destination=[1, -1, 0])
+    assert np.array_equal(transposed.toarray(), counts[[2, 0]][:, [2, 0]].T)
+    assert list(rows) == ['s3', 's1']
+    assert list(columns) == ['C>T', 'C>A']
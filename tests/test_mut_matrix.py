@@ -1,9 +1,12 @@
 
 import pytest
+import numpy as np
 import pandas as pd
 from tempfile import NamedTemporaryFile
 
 from mutationsPy.mut_matrix import sigprofiler_to_hdp_no_rearrangement, sigprofiler_to_hdp, hdp_to_sigprofiler, concat_sigprofiler_mutmats
+from mutationsPy.matrix_io import convert_matrix_format, read_matrix, is_sparse_matrix
+from mutationsPy.gen_context import gen_context
 
 import os
 import sys
@@ -41,3 +44,122 @@ def test_hdp_to_sigprofiler():
         expected = pd.read_csv('tests/test_data/mut_matrix/sigprofiler_mutmat.txt', sep = '\t')
         print(expected)
         assert result.equals(expected)
+
+def test_converters_binary(tmp_path):
+    sigprofiler_npz, hdp_npz, sigprofiler_txt, hdp_txt = [str(tmp_path / name) for name in ('sp.npz', 'hdp.npz', 'sp.txt', 'hdp.txt')]
+    convert_matrix_format('tests/test_data/mut_matrix/sigprofiler_mutmat.txt', sigprofiler_npz)
+    sigprofiler_to_hdp(sigprofiler_path=sigprofiler_npz, hdp_outpath=hdp_npz)
+    sigprofiler_to_hdp(sigprofiler_path=sigprofiler_npz, hdp_outpath=hdp_txt)
+    assert pd.read_csv(hdp_txt, sep = '\t').equals(pd.read_csv('tests/test_data/mut_matrix/hdp_mutmat.txt', sep = '\t'))
+    hdp_to_sigprofiler(hdp_path=hdp_npz, sigprofiler_outpath=sigprofiler_txt)
+    assert pd.read_csv(sigprofiler_txt, sep = '\t').equals(pd.read_csv('tests/test_data/mut_matrix/sigprofiler_mutmat.txt', sep = '\t'))
+
+@pytest.mark.parametrize('kmer, symmetric', [(1, True), (3, False), (5, True)])
+def test_sigprofiler_to_hdp_infers_kmer(tmp_path, kmer, symmetric):
+    mut_vector = gen_context(kmer, symmetric)
+    counts = np.arange(2 * len(mut_vector)).reshape(2, len(mut_vector))
+    sigprofiler_path, hdp_path, roundtrip_path = [str(tmp_path / name) for name in ('sp.txt', 'hdp.txt', 'roundtrip.txt')]
+    hdp = pd.DataFrame(counts, index = ['s1', 's2'], columns = mut_vector)
+    hdp.T.sort_index().rename_axis('MutationType').to_csv(sigprofiler_path, sep = '\t')
+    sigprofiler_to_hdp(sigprofiler_path=sigprofiler_path, hdp_outpath=hdp_path)
+    assert pd.read_csv(hdp_path, sep = '\t').equals(hdp)
+    hdp_to_sigprofiler(hdp_path=hdp_path, sigprofiler_outpath=roundtrip_path)
+    assert pd.read_csv(roundtrip_path, sep = '\t').equals(pd.read_csv(sigprofiler_path, sep = '\t'))
+
+def test_concat_sigprofiler_mutmats(tmp_path):
+    sigprofiler_path = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+    sigprofiler = pd.read_csv(sigprofiler_path, sep = '\t')
+    shuffled_path = str(tmp_path / 'shuffled.npz')
+    shuffled = sigprofiler.sample(frac = 1, random_state = 1).rename(columns = {'PD47151n_lo0002': 'a', 'PD47151n_lo0004': 'b'})
+    shuffled.to_csv(str(tmp_path / 'shuffled.txt'), sep = '\t', index = False)
+    convert_matrix_format(str(tmp_path / 'shuffled.txt'), shuffled_path)
+    outpath = str(tmp_path / 'combined.txt')
+    concat_sigprofiler_mutmats([sigprofiler_path, shuffled_path], outpath)
+    result = pd.read_csv(outpath, sep = '\t')
+    assert list(result.columns) == ['MutationType', 'PD47151n_lo0002', 'PD47151n_lo0004', 'a', 'b']
+    assert list(result['MutationType']) == list(sigprofiler['MutationType'])
+    assert list(result['a']) == list(sigprofiler['PD47151n_lo0002'])
+
+@pytest.mark.parametrize('subset_first', [False, True])
+def test_concat_sigprofiler_mutmats_missing_rows(tmp_path, subset_first):
+    sigprofiler_path = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+    sigprofiler = pd.read_csv(sigprofiler_path, sep = '\t')
+    subset_path, shuffled_path = str(tmp_path / 'subset.txt'), str(tmp_path / 'shuffled.txt')
+    sigprofiler.drop(index = [3, 40]).rename(columns = {'PD47151n_lo0002': 'a', 'PD47151n_lo0004': 'b'}).to_csv(subset_path, sep = '\t', index = False)
+    sigprofiler.sample(frac = 1, random_state = 3).rename(columns = {'PD47151n_lo0002': 'c', 'PD47151n_lo0004': 'd'}).to_csv(shuffled_path, sep = '\t', index = False)
+    paths = [subset_path, sigprofiler_path, shuffled_path] if subset_first else [sigprofiler_path, subset_path, shuffled_path]
+    outpath = str(tmp_path / 'combined.txt')
+    concat_sigprofiler_mutmats(paths, outpath)
+    # as pd.concat writes it: complete inputs stay integers, the one missing mutation types is float with empty fields
+    mutmats = [pd.read_csv(path, sep = '\t') for path in paths]
+    mut_vector = mutmats[0]['MutationType']
+    expected = pd.concat([mutmat.set_index('MutationType').reindex(mut_vector) for mutmat in mutmats], axis = 1).reset_index()
+    expected_path = str(tmp_path / 'expected.txt')
+    expected.to_csv(expected_path, sep = '\t', index = False)
+    with open(outpath) as result, open(expected_path) as expected_file:
+        assert result.read() == expected_file.read()
+
+@pytest.mark.parametrize('extension', ['txt', 'npz'])
+def test_concat_sigprofiler_mutmats_streaming(tmp_path, monkeypatch, extension):
+    monkeypatch.setattr('mutationsPy.matrix_io.TEXT_BLOCK_SIZE', 50)
+    sigprofiler_path = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+    sigprofiler = pd.read_csv(sigprofiler_path, sep = '\t')
+    shuffled_path = str(tmp_path / 'shuffled.txt')
+    sigprofiler.sample(frac = 1, random_state = 2).to_csv(shuffled_path, sep = '\t', index = False)
+    binary_path = str(tmp_path / 'binary.npz')
+    convert_matrix_format(sigprofiler_path, binary_path)
+    expected_path, outpath = str(tmp_path / f'expected.{extension}'), str(tmp_path / f'combined.{extension}')
+    concat_sigprofiler_mutmats([sigprofiler_path, shuffled_path, binary_path], expected_path)
+    concat_sigprofiler_mutmats([sigprofiler_path, shuffled_path, binary_path], outpath, streaming=True)
+    expected, result = read_matrix(expected_path, 'sigprofiler'), read_matrix(outpath, 'sigprofiler')
+    assert result[0].shape == (96, 6)
+    assert all(np.array_equal(a, b) for a, b in zip(result, expected))
+    assert sorted(os.listdir(tmp_path)) == sorted(['binary.npz', 'shuffled.txt', f'expected.{extension}', f'combined.{extension}'])
+
+def test_concat_sigprofiler_mutmats_streaming_mismatch(tmp_path):
+    sigprofiler_path = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+    sigprofiler = pd.read_csv(sigprofiler_path, sep = '\t')
+    subset_path = str(tmp_path / 'subset.txt')
+    sigprofiler.iloc[:90].to_csv(subset_path, sep = '\t', index = False)
+    with pytest.raises(ValueError):
+        concat_sigprofiler_mutmats([sigprofiler_path, subset_path], str(tmp_path / 'combined.txt'), streaming=True)
+    float_path = str(tmp_path / 'float.txt')
+    sigprofiler.assign(PD47151n_lo0002 = 0.5).to_csv(float_path, sep = '\t', index = False)
+    with pytest.raises(ValueError):
+        concat_sigprofiler_mutmats([sigprofiler_path, float_path], str(tmp_path / 'combined.txt'), streaming=True)
+
+def test_sparse_converters_and_concat(tmp_path):
+    sigprofiler_txt = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+    sparse_npz, hdp_npz, hdp_txt, concat_npz, concat_txt = [str(tmp_path / name) for name in ('sp.npz', 'hdp.npz', 'hdp.txt', 'concat.npz', 'concat.txt')]
+    convert_matrix_format(sigprofiler_txt, sparse_npz, sparse=True)
+    sigprofiler_to_hdp(sigprofiler_path=sparse_npz, hdp_outpath=hdp_npz)
+    assert is_sparse_matrix(hdp_npz)
+    sigprofiler_to_hdp(sigprofiler_path=sparse_npz, hdp_outpath=hdp_txt)
+    assert pd.read_csv(hdp_txt, sep = '\t').equals(pd.read_csv('tests/test_data/mut_matrix/hdp_mutmat.txt', sep = '\t'))
+    concat_sigprofiler_mutmats([sparse_npz, sigprofiler_txt], concat_npz)
+    assert is_sparse_matrix(concat_npz)
+    concat_sigprofiler_mutmats([sigprofiler_txt, sigprofiler_txt], concat_txt)
+    counts, rows, columns = read_matrix(concat_npz, 'sigprofiler')
+    expected, expected_rows, expected_columns = read_matrix(concat_txt, 'sigprofiler')
+    assert np.array_equal(counts.toarray(), expected)
+    assert list(rows) == list(expected_rows) and len(columns) == len(expected_columns)
+
+def test_converters_cache(tmp_path, monkeypatch):
+    sigprofiler_path = 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt'
+    cache_dir = str(tmp_path / 'cache')
+    for outpath in [str(tmp_path / 'hdp.txt'), str(tmp_path / 'hdp.npz')]:
+        sigprofiler_to_hdp(sigprofiler_path, outpath, cache_dir=cache_dir)
+    hdp_to_sigprofiler(str(tmp_path / 'hdp.txt'), str(tmp_path / 'back.txt'), cache_dir=cache_dir)
+    concat_sigprofiler_mutmats([sigprofiler_path, sigprofiler_path], str(tmp_path / 'concat.txt'), cache_dir=cache_dir)
+    expected = {name: open(tmp_path / name, 'rb').read() for name in ['hdp.txt', 'hdp.npz', 'back.txt', 'concat.txt']}
+    # cached results are copied back without converting anything
+    monkeypatch.setattr('mutationsPy.mut_matrix.transpose_matrix', None)
+    monkeypatch.setattr('mutationsPy.mut_matrix.read_matrix', None)
+    for outpath in [str(tmp_path / 'hdp2.txt'), str(tmp_path / 'hdp2.npz')]:
+        sigprofiler_to_hdp(sigprofiler_path, outpath, cache_dir=cache_dir)
+    hdp_to_sigprofiler(str(tmp_path / 'hdp.txt'), str(tmp_path / 'back2.txt'), cache_dir=cache_dir)
+    concat_sigprofiler_mutmats([sigprofiler_path, sigprofiler_path], str(tmp_path / 'concat2.txt'), cache_dir=cache_dir)
+    for name, content in expected.items():
+        assert open(tmp_path / name.replace('.', '2.'), 'rb').read() == content
+    with pytest.raises(TypeError):
+        concat_sigprofiler_mutmats([sigprofiler_path, sigprofiler_path], str(tmp_path / 'concat3.txt'), streaming=True, cache_dir=cache_dir)
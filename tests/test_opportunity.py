@@ -0,0 +1,85 @@
+import pytest
+import numpy as np
+from collections import Counter
+
+from mutationsPy.gen_context import gen_context
+from mutationsPy.get_mut import get_wt_seq, complementary_seq
+from mutationsPy.encode_context import encode_seqs
+from mutationsPy.matrix_io import read_matrix
+from mutationsPy.opportunity import count_kmers, context_opportunities, count_opportunities
+
+FASTA = ">chr1\nACGTACGTAC\nGGTTCCAANA\nTG\n>chr2\nTTGACCATGG\n"
+SEQS = {'chr1': 'ACGTACGTACGGTTCCAANATG', 'chr2': 'TTGACCATGG'}
+
+def write_fasta(tmp_path):
+    fasta = str(tmp_path / 'ref.fa')
+    with open(fasta, 'w') as file:
+        file.write(FASTA)
+    return fasta
+
+def naive_kmers(kmer, regions=None):
+    counts = Counter()
+    for chrom, seq in SEQS.items():
+        for centre in range(kmer // 2, len(seq) - kmer // 2):
+            if regions is not None and not any(start <= centre < end for c, start, end in regions if c == chrom):
+                continue
+            window = seq[centre - kmer // 2:centre + kmer // 2 + 1]
+            if set(window) <= set('ACGT'):
+                counts[window] += 1
+    return counts
+
+@pytest.mark.parametrize('kmer', [1, 3, 5])
+def test_count_kmers(tmp_path, monkeypatch, kmer):
+    monkeypatch.setattr('mutationsPy.opportunity.KMER_BLOCK_SIZE', 4)
+    fasta = write_fasta(tmp_path)
+    counts = count_kmers(fasta, kmer)
+    expected = naive_kmers(kmer)
+    assert counts.sum() == sum(expected.values())
+    codes = encode_seqs(list(expected))
+    assert list(counts[codes]) == list(expected.values())
+    assert np.array_equal(count_kmers(fasta, kmer, n_jobs=2), counts)
+
+def test_count_kmers_regions(tmp_path):
+    fasta = write_fasta(tmp_path)
+    bed = str(tmp_path / 'regions.bed')
+    with open(bed, 'w') as file:
+        file.write('track name=targets\nchr1\t0\t4\nchr1\t2\t6\nchr2\t5\t10\n')
+    counts = count_kmers(fasta, 3, regions=bed)
+    expected = naive_kmers(3, [('chr1', 0, 6), ('chr2', 5, 10)])
+    assert counts.sum() == sum(expected.values())
+    assert list(counts[encode_seqs(list(expected))]) == list(expected.values())
+    with open(bed, 'a') as file:
+        file.write('chrX\t0\t4\n')
+    with pytest.raises(KeyError):
+        count_kmers(fasta, 3, regions=bed)
+
+def test_count_kmers_cache(tmp_path, monkeypatch):
+    fasta = write_fasta(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    counts = count_kmers(fasta, 3, cache_dir=cache_dir)
+    assert len(list((tmp_path / 'cache').glob('kmers_*'))) == 1
+    monkeypatch.setattr('mutationsPy.opportunity._count_contig', None) # a cached result does not count again
+    # nor reads the unchanged reference again
+    monkeypatch.setattr('mutationsPy.result_cache.file_checksum', None)
+    assert np.array_equal(count_kmers(fasta, 3, cache_dir=cache_dir), counts)
+    monkeypatch.setattr('mutationsPy.result_cache._VERSION', 'other') # nor is it reused by another version
+    with pytest.raises(TypeError):
+        count_kmers(fasta, 3, cache_dir=cache_dir)
+
+@pytest.mark.parametrize('symmetric', [True, False])
+def test_context_opportunities(tmp_path, symmetric):
+    fasta = write_fasta(tmp_path)
+    opportunities = context_opportunities(fasta, 3, symmetric)
+    kmers = naive_kmers(3)
+    for context, opportunity in zip(gen_context(3, symmetric), opportunities):
+        wt = get_wt_seq(context)
+        assert opportunity == kmers[wt] + (kmers[complementary_seq(wt)] if symmetric else 0)
+
+def test_count_opportunities(tmp_path):
+    fasta = write_fasta(tmp_path)
+    outpath = str(tmp_path / 'opportunities.txt')
+    count_opportunities(fasta, outpath)
+    counts, rows, columns = read_matrix(outpath, 'sigprofiler')
+    assert list(rows) == sorted(gen_context(3))
+    assert list(columns) == ['opportunities']
+    assert counts.sum() == 3 * sum(naive_kmers(3).values()) # each kmer has a C or T at its centre either way round
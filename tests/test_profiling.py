@@ -0,0 +1,109 @@
+import json
+import sys
+
+import pytest
+
+from mutationsPy import profiling
+from mutationsPy.profiling import PROFILE_ENV, enable_profiling, disable_profiling, profiling_enabled, stage, profiled
+from mutationsPy.cli import main
+
+
+@pytest.fixture(autouse=True)
+def no_profiling():
+    disable_profiling()
+    yield
+    disable_profiling()
+
+
+def read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_stage_disabled(tmp_path):
+    assert not profiling_enabled()
+    with stage('nothing', rows=3) as record:
+        record.add_rows(5)
+    assert stage('other') is stage('nothing')
+
+
+def test_stage(tmp_path):
+    path = tmp_path / 'profile.jsonl'
+    enable_profiling(str(path))
+    assert profiling_enabled()
+    with stage('outer', path='input.txt'):
+        with stage('inner') as record:
+            record.add_rows(10)
+            record.add_rows(5)
+    with pytest.raises(ValueError):
+        with stage('failing'):
+            raise ValueError
+    inner, outer, failing = read_records(path)
+    assert inner['stage'] == 'inner' and inner['parent'] == 'outer'
+    assert inner['rows'] == 15 and inner['rows_per_second'] > 0
+    assert outer['parent'] is None and outer['rows'] is None and outer['path'] == 'input.txt'
+    assert outer['seconds'] >= inner['seconds']
+    assert failing['error'] == 'ValueError'
+    if profiling.resource is not None:
+        assert outer['process_peak_rss_mb'] > 0
+    if profiling.rss_mb() is not None:
+        assert 0 < outer['rss_start_mb'] <= outer['process_peak_rss_mb'] and outer['rss_end_mb'] > 0
+
+
+def test_stage_rss(tmp_path):
+    if profiling._high_water_mb() is None:
+        pytest.skip('resident memory not available')
+    path = tmp_path / 'profile.jsonl'
+    enable_profiling(str(path))
+    with stage('outer'):
+        with stage('allocate'):
+            allocated = bytearray(64 * 2 ** 20)
+            allocated[::4096] = b'x' * len(allocated[::4096]) # touch every page
+            del allocated
+        with stage('after'):
+            pass
+    allocate, after, outer = read_records(path)
+    if allocate['peak_rss_mb'] is None:
+        pytest.skip('high-water mark cannot be reset')
+    # the memory freed within a stage counts towards its peak and the peaks of its parents, not the stages after it
+    assert allocate['peak_rss_mb'] - allocate['rss_start_mb'] > 32 and allocate['rss_end_mb'] - allocate['rss_start_mb'] < 32
+    assert outer['peak_rss_mb'] >= allocate['peak_rss_mb'] > after['peak_rss_mb'] + 32
+    assert outer['process_peak_rss_mb'] >= allocate['peak_rss_mb']
+
+
+def test_profile_env_after_import(tmp_path, monkeypatch):
+    path = tmp_path / 'profile.jsonl'
+    monkeypatch.setenv(PROFILE_ENV, str(path))
+    assert profiling_enabled()
+    with stage('late'):
+        pass
+    assert [record['stage'] for record in read_records(path)] == ['late']
+
+
+def test_profiled(tmp_path):
+    path = tmp_path / 'profile.jsonl'
+
+    @profiled()
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    enable_profiling(str(path))
+    assert add(1, b=2) == 3
+    assert [record['stage'] for record in read_records(path)] == ['add']
+
+
+def test_main_profile(tmp_path, monkeypatch):
+    path = tmp_path / 'profile.jsonl'
+    monkeypatch.setattr(sys, 'argv', ['mutation_matrix', '--profile', str(path), 'sigprofiler_to_hdp',
+                                      '--sigprofiler_path', 'tests/test_data/mut_matrix/sigprofiler_mutmat.txt',
+                                      '--hdp_outpath', str(tmp_path / 'hdp.txt')])
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    main()
+    records = read_records(path)
+    # the library function ends within the stage of the subcommand that runs it
+    assert [(record['stage'], record['parent']) for record in records[-2:]] == [('sigprofiler_to_hdp', 'sigprofiler_to_hdp'), 
+                                                                                 ('sigprofiler_to_hdp', None)]
+    records = {record['stage']: record for record in records}
+    assert records['transpose_blocks']['rows'] == 96
+    assert records['write_matrix']['parent'] == 'sigprofiler_to_hdp' and records['write_matrix']['rows'] > 0
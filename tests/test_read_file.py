@@ -2,7 +2,10 @@ import pytest
 from tempfile import NamedTemporaryFile
 import pandas as pd
 
-from mutationsPy.read_file import read_vcf, extract_seq_from_fasta
+import os
+import pickle
+from mutationsPy.read_file import read_vcf, read_vcf_chunks, extract_seq_from_fasta, index_fasta, read_fasta_index, FastaReference, read_bed
+from mutationsPy.get_mut import get_context
 
 def test_read_vcf():
     with NamedTemporaryFile(delete=False, mode = 'w+t') as vcf:
@@ -18,6 +21,15 @@ def test_read_vcf_with_kwargs():
         expected = pd.DataFrame({'CHROM': ['chr1', 'chr15'], 'POS': [29, 9], 'REF': ['A', 'G'], 'ALT': ['C', 'C']})
         assert read_vcf(vcf.name, usecols = ['CHROM', 'POS', 'REF', 'ALT']).equals(expected)
 
+def test_read_vcf_chunks():
+    with NamedTemporaryFile(delete=False, mode = 'w+t') as vcf:
+        vcf.writelines("##fileformat=VCFv4.2\n#CHROM\tPOS\tREF\tALT\nchr1\t30\tA\tC\nchr15\t10\tG\tC\nchr2\t5\tT\tA\n")
+        vcf.seek(0)
+        chunks = list(read_vcf_chunks(vcf.name, chunksize=2))
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        expected = pd.DataFrame({'CHROM': ['chr1', 'chr15', 'chr2'], 'POS': [29, 9, 4], 'REF': ['A', 'G', 'T'], 'ALT': ['C', 'C', 'A']})
+        assert pd.concat(chunks, ignore_index=True).equals(expected)
+
 def test_extract_seq_from_fasta():
     with NamedTemporaryFile(delete=False, mode = 'w+t') as fasta:
         fasta.writelines(">chr1 \nACGTCA  \nAGCTACTAGCATANN\n>chr10\nGCTACNNNacgtaA\n\n>chr2   \nGCTACTGCA")
@@ -27,4 +39,71 @@ def test_extract_seq_from_fasta():
         # test for uppercase and skip empty lines
         assert extract_seq_from_fasta(fasta.name, identifier='chr10') == 'GCTACNNNACGTAA'
         assert extract_seq_from_fasta(fasta.name, identifier='chr2') == 'GCTACTGCA'
-        
\ No newline at end of file
+
+
+def write_fasta(tmp_path):
+    fasta = str(tmp_path / 'ref.fa')
+    with open(fasta, 'w') as file:
+        file.writelines(">chr1 description\nACGTC\nAagct\nAC\n\n>chr10\nGCTA\nCNNN\n>chr2\r\nGCTACT\r\nGCA\r\n")
+    return fasta
+
+def test_index_fasta(tmp_path):
+    fasta = write_fasta(tmp_path)
+    expected = {'chr1': (12, 18, 5, 6), 'chr10': (8, 41, 4, 5), 'chr2': (9, 58, 6, 8)}
+    assert index_fasta(fasta) == expected
+    assert read_fasta_index(fasta + '.fai') == expected
+
+def test_index_fasta_irregular_lines(tmp_path):
+    fasta = str(tmp_path / 'ref.fa')
+    with open(fasta, 'w') as file:
+        file.writelines(">chr1\nACG\nACGT\n")
+    with pytest.raises(ValueError):
+        index_fasta(fasta)
+
+def test_fasta_reference(tmp_path):
+    fasta = write_fasta(tmp_path)
+    with FastaReference(fasta) as reference:
+        assert reference.contigs == ['chr1', 'chr10', 'chr2']
+        assert reference.fetch('chr1') == 'ACGTCAAGCTAC'
+        assert reference.fetch('chr1', 4, 11) == 'CAAGCTA'
+        assert reference.fetch('chr2', 5) == 'TGCA'
+        assert reference.fetch('chr10', 3, 100) == 'ACNNN'
+        assert list(reference.bases('chr1', [0, 5, 11])) == [ord('A'), ord('A'), ord('C')]
+        with pytest.raises(IndexError):
+            reference.bases('chr1', [12])
+        with pytest.raises(KeyError):
+            reference.fetch('chr3')
+        contig = reference['chr1']
+        assert len(contig) == 12
+        assert contig[3] == 'T'
+        assert contig[-1] == 'C'
+        assert contig[2:6] == 'GTCA'
+        assert contig[::3] == 'ATAT'
+        assert str(contig) == 'ACGTCAAGCTAC'
+        assert get_context(contig, pos=7, ref='G', alt='T', kmer=5) == 'AA[G>T]CT'
+        assert pickle.loads(pickle.dumps(reference)).fetch('chr2') == 'GCTACTGCA'
+
+def test_fasta_reference_reuses_index(tmp_path):
+    fasta = write_fasta(tmp_path)
+    with open(fasta + '.fai', 'w') as file:
+        file.write('chr1\t4\t18\t5\t6\n')
+    assert FastaReference(fasta).contigs == ['chr1']
+    assert extract_seq_from_fasta(fasta, identifier='chr1') == 'ACGT'
+
+def test_fasta_reference_unwritable_index(tmp_path, monkeypatch):
+    fasta = write_fasta(tmp_path)
+    fai = str(tmp_path / 'missing' / 'ref.fa.fai') # cannot be written, as in a read-only directory
+    with FastaReference(fasta, fai) as reference:
+        assert reference.fetch('chr1') == 'ACGTCAAGCTAC'
+        assert not os.path.exists(fai)
+        monkeypatch.setattr('mutationsPy.read_file._build_index', None) # the index in memory goes along with a copy
+        assert pickle.loads(pickle.dumps(reference)).fetch('chr2') == 'GCTACTGCA'
+
+def test_read_bed(tmp_path):
+    bed = str(tmp_path / 'regions.bed')
+    with open(bed, 'w') as file:
+        file.write('browser position chr1:1-100\n#comment\nchr2\t10\t20\tname\nchr1\t5\t8\nchr1\t0\t3\nchr1\t2\t5\nchr1\t9\t12\nchr2\t12\t15\n')
+    regions = read_bed(bed)
+    assert list(regions) == ['chr2', 'chr1']
+    assert [list(array) for array in regions['chr1']] == [[0, 9], [8, 12]]
+    assert [list(array) for array in regions['chr2']] == [[10], [20]]
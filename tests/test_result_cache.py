@@ -0,0 +1,119 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from mutationsPy.result_cache import CACHE_MAX_MB_ENV, cache_key, cached_call, evict
+
+
+def write(path, text):
+    with open(path, 'w') as file:
+        file.write(text)
+    return str(path)
+
+
+def reverse_file(inpath, outpath, calls):
+    calls.append(inpath)
+    with open(inpath) as file:
+        write(outpath, file.read()[::-1])
+
+
+def test_cached_call(tmp_path):
+    cache_dir, calls = str(tmp_path / 'cache'), []
+    inpath, outpath = write(tmp_path / 'in.txt', 'abc'), str(tmp_path / 'out.txt')
+    compute = lambda: reverse_file(inpath, outpath, calls)
+    assert not cached_call(cache_dir, 'reverse', [inpath], outpath, compute)
+    os.remove(outpath)
+    assert cached_call(cache_dir, 'reverse', [inpath], outpath, compute)
+    assert open(outpath).read() == 'cba' and len(calls) == 1
+    # other parameters, output format or content of the input are other results
+    assert not cached_call(cache_dir, 'reverse', [inpath], outpath, compute, params={'kmer': 5})
+    assert not cached_call(cache_dir, 'reverse', [inpath], str(tmp_path / 'out.npz'), lambda: reverse_file(inpath, tmp_path / 'out.npz', calls))
+    write(inpath, 'abd')
+    assert not cached_call(cache_dir, 'reverse', [inpath], outpath, compute)
+    assert open(outpath).read() == 'dba' and len(calls) == 4
+    # the same content under another path is the same result
+    assert cached_call(cache_dir, 'reverse', [write(tmp_path / 'copy.txt', 'abd')], outpath, compute)
+    assert len(calls) == 4
+
+
+def test_cache_key_remembers_checksums(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    inpath = write(tmp_path / 'in.txt', 'abc')
+    key = cache_key('reverse', [inpath], 'out.txt', cache_dir=cache_dir)
+    assert key == cache_key('reverse', [inpath], 'out.txt')
+    monkeypatch.setattr('mutationsPy.result_cache.file_checksum', None) # an unchanged input is not read again
+    assert cache_key('reverse', [inpath], 'out.txt', cache_dir=cache_dir) == key
+
+
+def test_evict(tmp_path):
+    cache_dir, calls = str(tmp_path / 'cache'), []
+    outpath = str(tmp_path / 'out.txt')
+    inpaths = [write(tmp_path / f'in{i}.txt', str(i) * 100) for i in range(4)]
+    for i, inpath in enumerate(inpaths[:3]):
+        cached_call(cache_dir, 'reverse', [inpath], outpath, lambda: reverse_file(inpath, outpath, calls))
+        entry = os.path.join(cache_dir, 'results', cache_key('reverse', [inpath], outpath) + '.txt')
+        os.utime(entry, ns=(i * 10 ** 9, i * 10 ** 9))
+    # a hit makes the oldest result the most recently used
+    assert cached_call(cache_dir, 'reverse', [inpaths[0]], outpath, None)
+    # room for two results and the 32 byte checksums of the four inputs
+    cached_call(cache_dir, 'reverse', [inpaths[3]], outpath, lambda: reverse_file(inpaths[3], outpath, calls), max_bytes=2 * 100 + 4 * 32 + 50)
+    kept = [cached_call(cache_dir, 'reverse', [inpath], outpath, lambda: None, max_bytes=10 ** 6) for inpath in inpaths]
+    assert kept == [True, False, False, True]
+    assert evict(cache_dir, 0) == 8
+    assert os.listdir(os.path.join(cache_dir, 'results')) == os.listdir(os.path.join(cache_dir, 'checksums')) == []
+
+
+def test_cached_call_interrupted_hit(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    inpath, outpath = write(tmp_path / 'in.txt', 'abc'), str(tmp_path / 'out.txt')
+    cached_call(cache_dir, 'reverse', [inpath], outpath, lambda: reverse_file(inpath, outpath, []))
+    write(outpath, 'previous')
+
+    def interrupted_copy(source, destination, length):
+        destination.write(source.read(1))
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr('shutil.copyfileobj', interrupted_copy)
+    with pytest.raises(KeyboardInterrupt):
+        cached_call(cache_dir, 'reverse', [inpath], outpath, None)
+    assert open(outpath).read() == 'previous'
+    assert sorted(os.listdir(tmp_path)) == ['cache', 'in.txt', 'out.txt']
+
+
+def test_evict_stale_temporary(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    inpath, outpath = write(tmp_path / 'in.txt', 'abc'), str(tmp_path / 'out.txt')
+    cached_call(cache_dir, 'reverse', [inpath], outpath, lambda: reverse_file(inpath, outpath, []))
+    results = os.path.join(cache_dir, 'results')
+    stale, fresh = write(os.path.join(results, 'killed.1.tmp'), 'x' * 100), write(os.path.join(results, 'writing.2.tmp'), 'x' * 100)
+    os.utime(stale, ns=(0, 0))
+    # a writer still running keeps its temporary file
+    assert evict(cache_dir, 10 ** 6) == 1
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+    assert len(os.listdir(results)) == 2
+
+
+def test_cache_max_mb_env(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setenv(CACHE_MAX_MB_ENV, '0')
+    inpath, outpath = write(tmp_path / 'in.txt', 'abc'), str(tmp_path / 'out.txt')
+    cached_call(cache_dir, 'reverse', [inpath], outpath, lambda: reverse_file(inpath, outpath, []))
+    assert os.listdir(os.path.join(cache_dir, 'results')) == []
+
+
+def _run_job(cache_dir, tmp_path, i):
+    inpath = write(os.path.join(tmp_path, f'in{i % 6}.txt'), str(i % 6) * 1000)
+    outpath = os.path.join(tmp_path, f'out{i}.txt')
+    cached_call(cache_dir, 'reverse', [inpath], outpath, lambda: reverse_file(inpath, outpath, []), max_bytes=3500)
+    with open(outpath) as file:
+        return file.read() == (str(i % 6) * 1000)[::-1]
+
+
+def test_cached_call_processes(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(_run_job, [cache_dir] * 48, [str(tmp_path)] * 48, range(48)))
+    entries = os.listdir(os.path.join(cache_dir, 'results'))
+    assert all(entry.endswith('.txt') for entry in entries)
+    assert sum(os.path.getsize(os.path.join(cache_dir, 'results', entry)) for entry in entries) <= 3500
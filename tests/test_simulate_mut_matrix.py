@@ -1,8 +1,13 @@
+import os
+import subprocess
+import sys
+
 import pytest
 import numpy as np
 import pandas as pd
 
-from mutationsPy.simulate_mut_matrix import sample_mut_mat_simple, sample_mut_mat_multinomial, gen_mut_matrix
+from mutationsPy.simulate_mut_matrix import (sample_mut_mat_simple, sample_mut_mat_multinomial, sample_mut_mat_sparse, gen_mut_matrix, 
+                                             gen_sparse_mut_matrix, gen_mut_matrix_replicates, normalise_signatures)
 
 
 def test_sample_mut_mat_simple():
@@ -28,6 +33,35 @@ def test_sample_mut_mat_multinomial():
     signatures = [[0.3, 0.3, 0.4], 
                   [0.1, 0.6, 0.3]]
     
+    # draws are made signature by signature
+    rng = np.random.default_rng(10)
+    sample1_sig1 = rng.multinomial(round(5*0.4), [0.3, 0.3, 0.4])
+    sample2_sig1 = rng.multinomial(round(10*0.3), [0.3, 0.3, 0.4])
+    sample3_sig1 = rng.multinomial(round(20*0.5), [0.3, 0.3, 0.4])
+    sample4_sig1 = rng.multinomial(round(30*0.6), [0.3, 0.3, 0.4])
+    sample1_sig2 = rng.multinomial(round(5*0.6), [0.1, 0.6, 0.3])
+    sample2_sig2 = rng.multinomial(round(10*0.7), [0.1, 0.6, 0.3])
+    sample3_sig2 = rng.multinomial(round(20*0.5), [0.1, 0.6, 0.3])
+    sample4_sig2 = rng.multinomial(round(30*0.4), [0.1, 0.6, 0.3])
+    expected = np.array([
+        sample1_sig1 + sample1_sig2, 
+        sample2_sig1 + sample2_sig2, 
+        sample3_sig1 + sample3_sig2, 
+        sample4_sig1 + sample4_sig2
+    ])
+    assert np.allclose(sample_mut_mat_multinomial(exposures, burdens, signatures, rng=10), expected)
+    assert np.allclose(sample_mut_mat_multinomial(exposures, burdens, signatures, rng=np.random.default_rng(10)), expected)
+
+def test_sample_mut_mat_multinomial_global_seed():
+    exposures = [[0.4, 0.6],
+                [0.3, 0.7],
+                [0.5, 0.5],
+                [0.6, 0.4]]
+    burdens = [5, 10, 20, 30]
+    signatures = [[0.3, 0.3, 0.4], 
+                  [0.1, 0.6, 0.3]]
+    
+    # without rng, draws come from the global random state sample by sample
     np.random.seed(10)
     sample1_sig1 = np.random.multinomial(round(5*0.4), [0.3, 0.3, 0.4])
     sample1_sig2 = np.random.multinomial(round(5*0.6), [0.1, 0.6, 0.3])
@@ -45,6 +79,19 @@ def test_sample_mut_mat_multinomial():
     ])
     np.random.seed(10)
     assert np.allclose(sample_mut_mat_multinomial(exposures, burdens, signatures), expected)
+    np.random.seed(10)
+    first = sample_mut_mat_sparse(exposures, burdens, signatures).toarray()
+    np.random.seed(10)
+    assert np.array_equal(sample_mut_mat_sparse(exposures, burdens, signatures).toarray(), first)
+
+def test_sample_mut_mat_multinomial_distribution():
+    exposures = [[1, 0], [0.25, 0.75]]
+    burdens = [100, 200]
+    signatures = [[0.3, 0.3, 0.4], 
+                  [0.1, 0.6, 0.3]]
+    mut_mats = np.array([sample_mut_mat_multinomial(exposures, burdens, signatures, rng=seed) for seed in range(500)])
+    assert np.all(mut_mats.sum(axis=2) == [100, 200])
+    assert np.allclose(mut_mats.mean(axis=0), sample_mut_mat_simple(exposures, burdens, signatures), rtol=0.05)
     
 def test_gen_mut_matrix():
     exposure_matrix = pd.DataFrame(
@@ -58,6 +105,7 @@ def test_gen_mut_matrix():
     )
     assert list(gen_mut_matrix(exposure_matrix, signatures).columns) == ['sample_id', 'mut1', 'mut2', 'mut3']
     assert list(gen_mut_matrix(exposure_matrix, signatures, sample_func=sample_mut_mat_simple).columns) == ['sample_id', 'mut1', 'mut2', 'mut3']
+    assert gen_mut_matrix(exposure_matrix, signatures, rng=3).equals(gen_mut_matrix(exposure_matrix, signatures, rng=3))
     
 def test_gen_mut_matrix_exposure_sum_unequal_one():
     exposure_matrix = pd.DataFrame(
@@ -70,4 +118,128 @@ def test_gen_mut_matrix_exposure_sum_unequal_one():
         data = {'Type': ['mut1', 'mut2', 'mut3'], 'sig1': [0.3, 0.3, 0.4], 'sig2': [0.1, 0.6, 0.3]}
     )
     with pytest.raises(ValueError):
-        gen_mut_matrix(exposure_matrix, signatures)
\ No newline at end of file
+        gen_mut_matrix(exposure_matrix, signatures)
+
+def test_gen_mut_matrix_replicates():
+    exposure_matrix = pd.DataFrame(
+        data = {'sample_id': [1, 2, 3, 4],
+                'burdens': [5, 10, 20, 30],
+                'sig1': [0.4, 0.3, 0.5, 0.6],
+                'sig2': [0.6, 0.7, 0.5, 0.4]}
+    )
+    signatures = pd.DataFrame(
+        data = {'Type': ['mut1', 'mut2', 'mut3'], 'sig1': [0.3, 0.3, 0.4], 'sig2': [0.1, 0.6, 0.3]}
+    )
+    mut_mats, sample_ids, mut_class = gen_mut_matrix_replicates(exposure_matrix, signatures, n_replicates=5, seed=42)
+    assert mut_mats.shape == (4, 3, 5)
+    assert sample_ids == [1, 2, 3, 4]
+    assert mut_class == ['mut1', 'mut2', 'mut3']
+    assert np.all(mut_mats.sum(axis=1) == np.array([5, 10, 20, 30])[:, None])
+    parallel, _, _ = gen_mut_matrix_replicates(exposure_matrix, signatures, n_replicates=5, seed=42, n_jobs=2)
+    assert np.array_equal(parallel, mut_mats)
+    fewer, _, _ = gen_mut_matrix_replicates(exposure_matrix, signatures, n_replicates=3, seed=42)
+    assert np.array_equal(fewer, mut_mats[:, :, :3])
+    with pytest.raises(ValueError):
+        gen_mut_matrix_replicates(exposure_matrix.assign(sig1 = 0.5), signatures, n_replicates=2)
+
+def test_sample_mut_mat_sparse():
+    exposures = np.array([[0.5, 0.5], [1, 0], [0, 0]])
+    burdens = np.array([4000, 10, 7])
+    signatures = np.array([[0.2, 0.8, 0], [0, 0.5, 0.5]])
+    mut_mat = sample_mut_mat_sparse(exposures, burdens, signatures, rng=0)
+    assert mut_mat.shape == (3, 3)
+    dense = mut_mat.toarray()
+    assert list(dense.sum(axis=1)) == [4000, 10, 0]
+    assert dense[1, 2] == 0
+    # expected proportions of the first sample: 0.1, 0.65, 0.25
+    assert np.allclose(dense[0] / 4000, [0.1, 0.65, 0.25], atol=0.03)
+    assert np.array_equal(sample_mut_mat_sparse(exposures, burdens, signatures, rng=1).toarray(), 
+                          sample_mut_mat_sparse(exposures, burdens, signatures, rng=1).toarray())
+
+def test_gen_sparse_mut_matrix():
+    exposure_matrix = pd.DataFrame(
+        data = {'sample_id': [1, 2], 'burdens': [5, 10], 'sig1': [0.4, 0.3], 'sig2': [0.6, 0.7]}
+    )
+    signatures = pd.DataFrame(
+        data = {'Type': ['mut1', 'mut2', 'mut3'], 'sig1': [0.3, 0.3, 0.4], 'sig2': [0.1, 0.6, 0.3]}
+    )
+    mut_mat, sample_ids, mut_class = gen_sparse_mut_matrix(exposure_matrix, signatures, rng=3)
+    assert sample_ids == [1, 2]
+    assert mut_class == ['mut1', 'mut2', 'mut3']
+    assert list(mut_mat.sum(axis=1)) == [5, 10]
+
+def test_normalise_signatures():
+    signatures = np.array([[0.3, 0.3, 0.4], [0.1, 0.6, 0.3]])
+    normalised = normalise_signatures(signatures, [1, 2, 0])
+    assert np.allclose(normalised, [[1/3, 2/3, 0], [0.1/1.3, 1.2/1.3, 0]])
+    assert np.allclose(normalise_signatures(signatures, [2, 4, 6], reference_opportunities=[2, 4, 6]), signatures)
+    per_sample = normalise_signatures(signatures, [[1, 2, 0], [1, 1, 1]])
+    assert per_sample.shape == (2, 2, 3)
+    assert np.allclose(per_sample[0], normalised)
+    assert np.allclose(per_sample[1], signatures)
+    with pytest.raises(ValueError):
+        normalise_signatures(signatures, [0, 0, 1, 1])
+    with pytest.raises(ValueError):
+        normalise_signatures([[0, 0, 1]], [1, 1, 0])
+
+@pytest.mark.parametrize('sample_func', [sample_mut_mat_multinomial, sample_mut_mat_sparse])
+def test_sample_opportunities(sample_func):
+    exposures = [[0.5, 0.5], [0.5, 0.5]]
+    burdens = [1000, 1000]
+    signatures = [[0.3, 0.3, 0.4], [0.1, 0.6, 0.3]]
+    mut_mat = np.asarray(sample_func(exposures, burdens, signatures, rng=0, opportunities=[[1, 1, 0], [0, 1, 1]]))
+    assert list(mut_mat.sum(axis=1)) == [1000, 1000]
+    assert mut_mat[0, 2] == 0 and mut_mat[1, 0] == 0
+    expected = sample_mut_mat_simple(exposures, burdens, signatures, opportunities=[[1, 1, 0], [0, 1, 1]])
+    assert np.allclose(mut_mat, expected, rtol=0.15)
+
+def test_gen_mut_matrix_opportunities():
+    exposure_matrix = pd.DataFrame(
+        data = {'sample_id': [1, 2], 'burdens': [50, 100], 'sig1': [0.4, 0.3], 'sig2': [0.6, 0.7]}
+    )
+    signatures = pd.DataFrame(
+        data = {'Type': ['mut1', 'mut2', 'mut3'], 'sig1': [0.3, 0.3, 0.4], 'sig2': [0.1, 0.6, 0.3]}
+    )
+    opportunities = pd.Series({'mut3': 0, 'mut2': 5, 'mut1': 5})
+    mut_mat = gen_mut_matrix(exposure_matrix, signatures, rng=1, opportunities=opportunities)
+    assert list(mut_mat['mut3']) == [0, 0]
+    per_sample = pd.DataFrame({'mut1': [1, 0], 'mut2': [1, 1], 'mut3': [1, 1]}, index=[1, 2])
+    mut_mat = gen_mut_matrix(exposure_matrix, signatures, sample_func=sample_mut_mat_simple, opportunities=per_sample)
+    assert mut_mat.loc[1, 'mut1'] == 0
+    mut_mats, _, _ = gen_mut_matrix_replicates(exposure_matrix, signatures, 3, seed=1, opportunities=per_sample)
+    assert np.all(mut_mats[1, 0] == 0)
+    sparse_mat, _, _ = gen_sparse_mut_matrix(exposure_matrix, signatures, rng=1, opportunities=opportunities.to_numpy()[::-1])
+    assert np.all(sparse_mat.toarray()[:, 2] == 0)
+
+def test_simulations_independent_of_hash_seed():
+    # the signatures are drawn in a fixed order, so seeded simulations do not change with the hash seed of the process
+    code = '''
+import pandas as pd
+from mutationsPy.simulate_mut_matrix import gen_mut_matrix, gen_mut_matrix_replicates
+names = ['SBS1', 'SBS5', 'SBS2', 'SBS13', 'SBS40', 'SBS3']
+exposure_matrix = pd.DataFrame({'sample_id': [1, 2, 3], 'burdens': [500, 1000, 2000], **{name: [1 / 6] * 3 for name in names}})
+signatures = pd.DataFrame({'Type': ['mut1', 'mut2', 'mut3', 'mut4'], **{name: [0.1 * (i % 3 + 1), 0.2, 0.3, 0.5 - 0.1 * (i % 3 + 1)] for i, name in enumerate(names)}})
+print(gen_mut_matrix(exposure_matrix, signatures, rng=1).to_numpy().tolist())
+print(gen_mut_matrix_replicates(exposure_matrix, signatures, 2, seed=1)[0].tolist())
+'''
+    outputs = [subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                              env={**os.environ, 'PYTHONHASHSEED': str(hash_seed)}).stdout for hash_seed in [1, 2, 3]]
+    assert outputs[0] == outputs[1] == outputs[2]
+
+def test_gen_mut_matrix_opportunities_by_sample():
+    exposure_matrix = pd.DataFrame(
+        data = {'sample_id': ['a', 'b', 'c'], 'burdens': [50, 100, 80], 'sig1': [0.4, 0.3, 1], 'sig2': [0.6, 0.7, 0]}
+    )
+    signatures = pd.DataFrame(
+        data = {'Type': ['mut1', 'mut2', 'mut3'], 'sig1': [0.3, 0.3, 0.4], 'sig2': [0.1, 0.6, 0.3]}
+    )
+    per_sample = pd.DataFrame({'mut1': [1, 0, 1], 'mut2': [1, 1, 0], 'mut3': [1, 1, 1]}, index=['a', 'b', 'c'])
+    expected = gen_mut_matrix(exposure_matrix, signatures, sample_func=sample_mut_mat_simple, opportunities=per_sample)
+    # rows are matched by sample_id, not position
+    shuffled = per_sample.loc[['c', 'a', 'b'], ['mut3', 'mut1', 'mut2']]
+    assert gen_mut_matrix(exposure_matrix, signatures, sample_func=sample_mut_mat_simple, opportunities=shuffled).equals(expected)
+    assert list(expected['mut1']) == [round(50 * (0.4 * 0.3 + 0.6 * 0.1)), 0, round(80 * 0.3 / 0.7)]
+    mut_mats, _, _ = gen_mut_matrix_replicates(exposure_matrix, signatures, 2, seed=1, opportunities=shuffled)
+    assert np.all(mut_mats[1, 0] == 0) and np.all(mut_mats[2, 1] == 0)
+    with pytest.raises(KeyError):
+        gen_mut_matrix(exposure_matrix, signatures, opportunities=per_sample.loc[['a', 'c']])
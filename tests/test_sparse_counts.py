@@ -0,0 +1,48 @@
+import pytest
+import numpy as np
+
+from mutationsPy.sparse_counts import SparseCounts, as_sparse, hstack, vstack
+
+DENSE = np.array([[0, 2, 0, 1], [0, 0, 0, 0], [3, 0, 0, 4]])
+
+def test_from_dense_toarray():
+    counts = SparseCounts.from_dense(DENSE)
+    assert counts.shape == (3, 4)
+    assert counts.nnz == 4
+    assert counts.dtype == DENSE.dtype
+    assert np.array_equal(counts.toarray(), DENSE)
+    assert np.array_equal(np.asarray(counts), DENSE)
+    assert np.array_equal(counts.T.toarray(), DENSE.T)
+
+def test_from_coo_sums_repeats():
+    counts = SparseCounts.from_coo([2, 0, 2, 0, 2], [3, 1, 0, 3, 3], [1, 2, 3, 1, 3], (3, 4))
+    assert np.array_equal(counts.toarray(), DENSE)
+    assert np.array_equal(SparseCounts.from_coo([1, 1], [2, 2], 1, (2, 3)).toarray(), [[0, 0, 0], [0, 0, 2]])
+    assert SparseCounts.from_coo([], [], 1, (2, 3)).nnz == 0
+
+def test_slices_and_takes():
+    counts = as_sparse(DENSE)
+    assert np.array_equal(counts[1:3].toarray(), DENSE[1:3])
+    assert np.array_equal(counts[::2].toarray(), DENSE[::2])
+    assert np.array_equal(counts.take_rows([2, 0, 0]).toarray(), DENSE[[2, 0, 0]])
+    filled = counts.take_rows([2, -1], fill_value=np.nan).toarray()
+    assert np.array_equal(filled[0], DENSE[2])
+    assert np.all(np.isnan(filled[1]))
+    assert np.array_equal(counts.take_columns([3, 0, 3]).toarray(), DENSE[:, [3, 0, 3]])
+    assert np.array_equal(counts.sum(axis=0), DENSE.sum(axis=0))
+    assert np.array_equal(counts.sum(axis=1), DENSE.sum(axis=1))
+    assert counts.sum() == DENSE.sum()
+    with pytest.raises(TypeError):
+        counts[0]
+
+def test_stack():
+    assert np.array_equal(vstack([DENSE, as_sparse(DENSE[:1])]).toarray(), np.vstack([DENSE, DENSE[:1]]))
+    assert np.array_equal(hstack([DENSE, as_sparse(DENSE[:, :2])]).toarray(), np.hstack([DENSE, DENSE[:, :2]]))
+    with pytest.raises(ValueError):
+        vstack([DENSE, DENSE[:, :2]])
+
+def test_to_scipy():
+    sparse = pytest.importorskip('scipy.sparse')
+    matrix = as_sparse(DENSE).to_scipy()
+    assert np.array_equal(matrix.toarray(), DENSE)
+    assert np.array_equal(SparseCounts.from_scipy(sparse.coo_array(DENSE)).toarray(), DENSE)
@@ -0,0 +1,114 @@
+import gzip
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from mutationsPy.get_mut import get_context_codes
+from mutationsPy.vcf_stream import is_bgzf, read_bgzf, read_vcf_batches, stream_vcfs
+
+HEADER = "##fileformat=VCFv4.2\n##contig=<ID=chr1>\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+SEQ = 'ACGTACGTACGGTTCCAATA'
+
+
+def bgzf_block(data):
+    """one BGZF block holding data, as bgzip writes it"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    return header + deflated + struct.pack('<2I', zlib.crc32(data), len(data))
+
+
+def write_bgzf(path, text, block_size=50):
+    data = text.encode()
+    with open(path, 'wb') as file:
+        for start in range(0, len(data), block_size):
+            file.write(bgzf_block(data[start:start + block_size]))
+        file.write(bgzf_block(b'')) # end of file marker
+    return str(path)
+
+
+def records(n, chrom='chr1'):
+    refs = [SEQ[i % 18 + 1] for i in range(n)]
+    return ''.join(f"{chrom}\t{i % 18 + 2}\t.\t{ref}\t{'A' if ref == 'T' else 'T'}\t.\tPASS\tDP=10\n" for i, ref in enumerate(refs))
+
+
+def test_read_bgzf(tmp_path):
+    text = HEADER + records(40)
+    path = write_bgzf(tmp_path / 'sample.vcf.gz', text)
+    assert is_bgzf(path)
+    # a small read size splits blocks across reads
+    for read_size in [7, 100, 1 << 20]:
+        assert b''.join(read_bgzf(path, n_threads=2, max_pending=2, read_size=read_size)) == text.encode()
+    # bgzip output is valid gzip
+    with gzip.open(path, 'rt') as file:
+        assert file.read() == text
+    with gzip.open(tmp_path / 'plain_gzip.vcf.gz', 'wt') as file:
+        file.write(text)
+    assert not is_bgzf(tmp_path / 'plain_gzip.vcf.gz')
+    with pytest.raises(ValueError):
+        list(read_bgzf(tmp_path / 'plain_gzip.vcf.gz'))
+
+
+def test_read_bgzf_corrupt(tmp_path):
+    path = write_bgzf(tmp_path / 'sample.vcf.gz', HEADER + records(10))
+    with open(path, 'rb') as file:
+        data = file.read()
+    with open(path, 'wb') as file:
+        file.write(data[:-40])
+    with pytest.raises(ValueError, match='truncated'):
+        list(read_bgzf(path))
+    first = bgzf_block(b'chr1\t1\t.\tA\tT\n')
+    with open(path, 'wb') as file:
+        file.write(first[:-8] + struct.pack('<2I', 0, 12))
+    with pytest.raises(ValueError, match='CRC'):
+        list(read_bgzf(path))
+
+
+@pytest.mark.parametrize('compression', ['plain', 'gzip', 'bgzf'])
+def test_read_vcf_batches(tmp_path, compression):
+    text = HEADER + records(30) + records(5, 'chr2')
+    path = str(tmp_path / ('sample1.vcf' if compression == 'plain' else 'sample1.vcf.gz'))
+    if compression == 'bgzf':
+        write_bgzf(path, text)
+    else:
+        with (gzip.open(path, 'wt') if compression == 'gzip' else open(path, 'w')) as file:
+            file.write(text)
+    batches = list(read_vcf_batches(path, chunk_bytes=200, n_threads=2))
+    assert len(batches) > 1
+    pos = np.concatenate([batch.pos for batch in batches])
+    assert pos.dtype == np.int64
+    assert pos.tolist() == [i % 18 + 1 for i in range(30)] + [i % 18 + 1 for i in range(5)]
+    assert np.concatenate([batch.chrom for batch in batches]).tolist() == ['chr1'] * 30 + ['chr2'] * 5
+    assert {sample for batch in batches for sample in batch.sample} == {'sample1'}
+    # the columns go straight into the per-mutation functions
+    batch = batches[0]
+    rows = batch.by_chrom()['chr1']
+    codes, flagged = get_context_codes(SEQ, batch.pos[rows], batch.ref[rows], batch.alt[rows])
+    assert not flagged.any() and (codes >= 0).all()
+
+
+def test_read_vcf_batches_not_vcf(tmp_path):
+    path = tmp_path / 'table.txt'
+    path.write_text('#Sample\tCHROM\tPOS\tREF\tALT\nA\tchr1\t3\tG\tT\n')
+    with pytest.raises(ValueError):
+        list(read_vcf_batches(path))
+
+
+def test_stream_vcfs(tmp_path):
+    paths = []
+    for i in range(5):
+        paths.append(write_bgzf(tmp_path / f'sample{i}.vcf.gz', HEADER + records(10 + i)))
+    (tmp_path / 'empty.vcf').write_text(HEADER)
+    paths.insert(2, str(tmp_path / 'empty.vcf'))
+    batches = list(stream_vcfs(paths, n_threads=2, max_files=2, chunk_bytes=100, prefetch=1))
+    samples = [batch.sample[0] for batch in batches]
+    assert sorted(set(samples), key=samples.index) == [f'sample{i}' for i in range(5)]
+    assert [sum(len(batch) for batch in batches if batch.sample[0] == f'sample{i}') for i in range(5)] == [10 + i for i in range(5)]
+    # stopping early does not wait on the readers
+    stream = stream_vcfs(paths, n_threads=2, max_files=3, chunk_bytes=100, prefetch=1)
+    next(stream)
+    stream.close()
+    with pytest.raises(FileNotFoundError):
+        list(stream_vcfs(paths + [str(tmp_path / 'missing.vcf.gz')], max_files=2))
@@ -0,0 +1,198 @@
+import gzip
+import pytest
+import numpy as np
+import pandas as pd
+
+from mutationsPy.gen_context import gen_context, gen_dbs_context, gen_id_context
+from mutationsPy.get_mut import get_context, symmetrise_context
+from mutationsPy import vcf_to_matrix
+from mutationsPy.vcf_to_matrix import sample_name, count_mutations, build_matrix
+from mutationsPy.matrix_io import read_matrix, is_sparse_matrix
+
+FASTA = ">chr1\nACGTACGTAC\nGGTTCCAANA\nTG\n>chr2\nTTGACCATGG\n"
+VCF_HEADER = "##fileformat=VCFv4.2\n##contig=<ID=chr1>\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+def write_inputs(tmp_path):
+    fasta = str(tmp_path / 'ref.fa')
+    with open(fasta, 'w') as file:
+        file.write(FASTA)
+    vcf1 = str(tmp_path / 'sample1.vcf')
+    with open(vcf1, 'w') as file:
+        file.write(VCF_HEADER)
+        file.write("chr1\t3\t.\tG\tT\t.\tPASS\t.\nchr1\t12\t.\tG\tA\t.\tPASS\t.\nchr2\t4\t.\tA\tC\t.\tPASS\t.\n"
+                   "chr1\t5\t.\tAC\tA\t.\tPASS\t.\nchr1\t18\t.\tA\tG\t.\tPASS\t.\nchr1\t1\t.\tA\tC\t.\tPASS\t.\n")
+    vcf2 = str(tmp_path / 'sample2.vcf.gz')
+    with gzip.open(vcf2, 'wt') as file:
+        file.write(VCF_HEADER)
+        file.write("chr2\t4\t.\tA\tC\t.\tPASS\t.\nchr2\t5\t.\tC\tG\t.\tPASS\t.\n")
+    return fasta, vcf1, vcf2
+
+def expected_counts(mutations, kmer=3):
+    seqs = {'chr1': 'ACGTACGTACGGTTCCAANATG', 'chr2': 'TTGACCATGG'}
+    counts = dict.fromkeys(gen_context(kmer), 0)
+    for chrom, pos, ref, alt in mutations:
+        counts[symmetrise_context(get_context(seqs[chrom], pos - 1, ref, alt, kmer))] += 1
+    return list(counts.values())
+
+def test_sample_name():
+    assert sample_name('path/to/sample1.vcf.gz') == 'sample1'
+    assert sample_name('sample2.vcf') == 'sample2'
+
+def test_count_mutations(tmp_path):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    counts, samples = count_mutations([vcf1, vcf2], fasta, chunksize=2)
+    assert samples == ['sample1', 'sample2']
+    assert counts.shape == (2, 96)
+    # the indel, the mutation next to N and the one at the start of chr1 are skipped
+    assert list(counts[0]) == expected_counts([('chr1', 3, 'G', 'T'), ('chr1', 12, 'G', 'A'), ('chr2', 4, 'A', 'C')])
+    assert list(counts[1]) == expected_counts([('chr2', 4, 'A', 'C'), ('chr2', 5, 'C', 'G')])
+
+def test_count_mutations_sample_column(tmp_path):
+    fasta, _, _ = write_inputs(tmp_path)
+    table = str(tmp_path / 'mutations.txt')
+    with open(table, 'w') as file:
+        file.write("Sample\tCHROM\tPOS\tREF\tALT\nB\tchr1\t3\tG\tT\nA\tchr2\t4\tA\tC\nB\tchr2\t5\tC\tG\n")
+    counts, samples = count_mutations(table, fasta, kmer=1, symmetric=False, sample_colname='Sample', chunksize=1)
+    assert samples == ['B', 'A']
+    assert counts.sum(axis=1).tolist() == [2, 1]
+    assert counts[1, gen_context(1, symmetric=False).index('A>C')] == 1
+
+@pytest.mark.parametrize('chrom_shards', [1, 2, 3])
+def test_count_mutations_parallel(tmp_path, chrom_shards):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    table = str(tmp_path / 'mutations.txt')
+    with open(table, 'w') as file:
+        file.write("Sample\tCHROM\tPOS\tREF\tALT\nB\tchr2\t3\tG\tT\nA\tchr1\t3\tG\tC\nB\tchr2\t5\tC\tG\nC\tchr1\t12\tG\tA\n")
+    expected_counts, expected_samples = count_mutations([vcf1, vcf2], fasta)
+    counts, samples = count_mutations([vcf1, vcf2], fasta, n_jobs=2, chrom_shards=chrom_shards)
+    assert samples == expected_samples
+    assert np.array_equal(counts, expected_counts)
+    expected_counts, expected_samples = count_mutations([table, table], fasta, sample_colname='Sample', chunksize=1)
+    counts, samples = count_mutations([table, table], fasta, sample_colname='Sample', n_jobs=2, chrom_shards=chrom_shards)
+    assert samples == expected_samples == ['B', 'A', 'C']
+    assert np.array_equal(counts, expected_counts)
+
+def test_count_mutations_parallel_interleaved_samples(tmp_path):
+    rng = np.random.default_rng(0)
+    seqs = {f'chr{i}': ''.join(rng.choice(list('ACGT'), 60)) for i in range(5)}
+    fasta = str(tmp_path / 'ref.fa')
+    with open(fasta, 'w') as file:
+        file.write(''.join(f'>{chrom}\n{seq}\n' for chrom, seq in seqs.items()))
+    tables, first_seen = [], []
+    for i in range(4):
+        table = str(tmp_path / f'mutations{i}.txt')
+        with open(table, 'w') as file:
+            file.write('Sample\tCHROM\tPOS\tREF\tALT\n')
+            for _ in range(40):
+                sample, chrom, pos = f'S{rng.integers(6)}', f'chr{rng.integers(5)}', int(rng.integers(3, 58))
+                ref = seqs[chrom][pos - 1]
+                file.write(f"{sample}\t{chrom}\t{pos}\t{ref}\t{'A' if ref != 'A' else 'C'}\n")
+                if sample not in first_seen:
+                    first_seen.append(sample)
+        tables.append(table)
+    for sparse in [False, True]:
+        expected, expected_samples = count_mutations(tables, fasta, kmer=5, sample_colname='Sample', chunksize=15, sparse=sparse)
+        counts, samples = count_mutations(tables, fasta, kmer=5, sample_colname='Sample', chunksize=15, sparse=sparse,
+                                          n_jobs=3, chrom_shards=3)
+        # samples in order of first appearance whichever way the rows were split
+        assert samples == expected_samples == first_seen
+        if sparse:
+            counts, expected = counts.toarray(), expected.toarray()
+        assert np.array_equal(counts, expected)
+
+def test_count_mutations_ref_mismatch(tmp_path):
+    fasta, _, _ = write_inputs(tmp_path)
+    vcf = str(tmp_path / 'mismatch.vcf')
+    with open(vcf, 'w') as file:
+        file.write(VCF_HEADER + "chr1\t3\t.\tA\tT\t.\tPASS\t.\n")
+    with pytest.raises(KeyError):
+        count_mutations(vcf, fasta)
+    with open(vcf, 'w') as file:
+        file.write(VCF_HEADER + "chr3\t3\t.\tA\tT\t.\tPASS\t.\n")
+    with pytest.raises(KeyError):
+        count_mutations(vcf, fasta, n_jobs=2, chrom_shards=2)
+
+@pytest.mark.parametrize('matrix_format', ['sigprofiler', 'hdp'])
+def test_build_matrix(tmp_path, matrix_format):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    outpath = str(tmp_path / 'matrix.txt')
+    build_matrix([vcf1, vcf2], fasta, outpath, matrix_format=matrix_format)
+    result = pd.read_csv(outpath, sep = '\t')
+    if matrix_format == 'hdp':
+        assert list(result.columns) == gen_context(3)
+        assert list(result.index) == ['sample1', 'sample2']
+        assert list(result.loc['sample2']) == expected_counts([('chr2', 4, 'A', 'C'), ('chr2', 5, 'C', 'G')])
+    else:
+        assert list(result.columns) == ['MutationType', 'sample1', 'sample2']
+        assert list(result['MutationType']) == sorted(gen_context(3))
+        assert result['sample1'].sum() == 3
+
+@pytest.mark.parametrize('matrix_format', ['sigprofiler', 'hdp'])
+def test_build_matrix_sparse(tmp_path, monkeypatch, matrix_format):
+    monkeypatch.setattr('mutationsPy.vcf_to_matrix._SPARSE_MERGE_EVERY', 2)
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    counts, samples = count_mutations([vcf1, vcf2], fasta, chunksize=1, sparse=True)
+    expected, _ = count_mutations([vcf1, vcf2], fasta)
+    assert np.array_equal(counts.toarray(), expected)
+    assert np.array_equal(count_mutations([vcf1, vcf2], fasta, n_jobs=2, chrom_shards=2, sparse=True)[0].toarray(), expected)
+    sparse_path, dense_path = str(tmp_path / 'sparse.npz'), str(tmp_path / 'dense.txt')
+    build_matrix([vcf1, vcf2], fasta, sparse_path, matrix_format=matrix_format, sparse=True)
+    build_matrix([vcf1, vcf2], fasta, dense_path, matrix_format=matrix_format)
+    assert is_sparse_matrix(sparse_path)
+    result, rows, columns = read_matrix(sparse_path, matrix_format)
+    dense, dense_rows, dense_columns = read_matrix(dense_path, matrix_format)
+    assert np.array_equal(result.toarray(), dense)
+    assert list(rows) == list(dense_rows) and list(columns) == list(dense_columns)
+
+@pytest.mark.parametrize('matrix_format', ['sigprofiler', 'hdp'])
+def test_build_matrix_dbs_id(tmp_path, matrix_format):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    with gzip.open(vcf2, 'wt') as file:
+        file.write(VCF_HEADER + "chr1\t1\t.\tAC\tCA\t.\tPASS\t.\nchr1\t3\t.\tGT\tTG\t.\tPASS\t.\nchr2\t1\t.\tT\tTTA\t.\tPASS\t.\n")
+    outpath = str(tmp_path / 'matrix.txt')
+    build_matrix([vcf1, vcf2], fasta, outpath, matrix_format=matrix_format, mutation_type='DBS')
+    result, rows, columns = read_matrix(outpath, matrix_format)
+    labels, samples = (columns, rows) if matrix_format == 'hdp' else (rows, columns)
+    assert list(labels) == gen_dbs_context() and list(samples) == ['sample1', 'sample2']
+    counts = result if matrix_format == 'hdp' else result.T
+    # both doublets are AC>CA, one on each strand; the SNVs and indels are skipped
+    assert counts[0].sum() == 0 and counts[1, 0] == 2 and counts[1].sum() == 2
+    build_matrix([vcf1, vcf2], fasta, outpath, matrix_format=matrix_format, mutation_type='ID')
+    result, rows, columns = read_matrix(outpath, matrix_format)
+    labels = list(columns if matrix_format == 'hdp' else rows)
+    assert labels == gen_id_context()
+    counts = result if matrix_format == 'hdp' else result.T
+    assert counts[0, labels.index('1:Del:C:0')] == 1 and counts[0].sum() == 1
+    assert counts[1, labels.index('2:Ins:R:0')] == 1 and counts[1].sum() == 1
+
+def test_count_mutations_io_threads(tmp_path):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    for mutation_type in ['SBS', 'ID']:
+        expected, expected_samples = count_mutations([vcf1, vcf2, vcf1], fasta, mutation_type=mutation_type)
+        counts, samples = count_mutations([vcf1, vcf2, vcf1], fasta, mutation_type=mutation_type, io_threads=2)
+        assert samples == expected_samples
+        assert np.array_equal(counts, expected)
+    with pytest.raises(ValueError):
+        count_mutations([vcf1, vcf2], fasta, io_threads=2, n_jobs=2)
+
+def test_build_matrix_cache(tmp_path, monkeypatch):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    build_matrix([vcf1, vcf2], fasta, str(tmp_path / 'matrix.txt'), cache_dir=cache_dir, chunksize=2)
+    monkeypatch.setattr('mutationsPy.vcf_to_matrix.count_mutations', None)
+    # options that do not change the matrix share its result
+    build_matrix([vcf1, vcf2], fasta, str(tmp_path / 'cached.txt'), cache_dir=cache_dir, n_jobs=2)
+    assert open(tmp_path / 'cached.txt').read() == open(tmp_path / 'matrix.txt').read()
+    with pytest.raises(TypeError):
+        build_matrix([vcf1, vcf2], fasta, str(tmp_path / 'hdp.txt'), matrix_format='hdp', cache_dir=cache_dir)
+
+def test_count_mutations_shards_parse_once(tmp_path, monkeypatch):
+    fasta, vcf1, vcf2 = write_inputs(tmp_path)
+    expected, expected_samples = count_mutations([vcf1, vcf2], fasta)
+    parsed = []
+    read_chunks = vcf_to_matrix.read_vcf_chunks
+    monkeypatch.setattr('mutationsPy.vcf_to_matrix.read_vcf_chunks', lambda vcf, **kwargs: parsed.append(vcf) or read_chunks(vcf, **kwargs))
+    counts, samples = count_mutations([vcf1, vcf2], fasta, n_jobs=2, chrom_shards=3, chunksize=2)
+    # each file is parsed once, whatever the number of chromosome groups
+    assert parsed == [vcf1, vcf2]
+    assert samples == expected_samples and np.array_equal(counts, expected)